@@ -0,0 +1,135 @@
+"""Evaluate all trained models in data/outputs that have no metrics.json yet"""
+import os
+import time
+import datetime
+import queue
+import threading
+from multiprocessing.pool import ThreadPool
+
+import train
+import timing
+
+def find_runs_missing_metrics(root_dir, datasets=None):
+    """
+    Output folders (<dataset>/<variant>/<session>) with a trained model but
+    no metrics, in the layout read by parse_outputs.py
+    """
+    runs = []
+    for dirpath, _, filenames in os.walk(root_dir):
+        if 'config.yml' not in filenames: continue
+        parts = dirpath[len(root_dir)+1:].split('/')
+        if len(parts) != 5 or parts[3] != 'splatfacto': continue
+        if datasets is not None and parts[0] not in datasets: continue
+        if 'metrics.json' in filenames: continue
+        runs.append(os.path.join(root_dir, *parts[:3]))
+    return sorted(set(runs))
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.n_done = 0
+        self.n_failed = 0
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+
+    def report(self, output_folder, elapsed, error=None):
+        with self.lock:
+            self.n_done += 1
+            if error is not None: self.n_failed += 1
+            total_elapsed = time.time() - self.start_time
+            rate = self.n_done / total_elapsed
+            eta = (self.total - self.n_done) / rate
+            print('[%d/%d] %s %s in %.1fs (%.2f runs/min, ETA %s)' % (
+                self.n_done, self.total, output_folder,
+                'FAILED: %s %s' % (type(error).__name__, str(error)) if error is not None else 'evaluated',
+                elapsed, rate * 60, str(datetime.timedelta(seconds=round(eta)))))
+
+def evaluate_in_subprocesses(runs, args):
+    """Evaluate with train.evaluate, i.e., one evaluation process per run, args.jobs at a time"""
+    gpus = args.gpus.split(',') if args.gpus is not None else [None]
+    slots = queue.Queue()
+    for i in range(args.jobs): slots.put(i)
+    progress = Progress(len(runs))
+
+    def evaluate_run(output_folder):
+        slot = slots.get()
+        env = dict(os.environ)
+        gpu = gpus[slot % len(gpus)]
+        if gpu is not None: env['CUDA_VISIBLE_DEVICES'] = gpu
+        start_time = time.time()
+        error = None
+        try:
+            train.evaluate(output_folder, train.read_training_time(output_folder),
+                render_images=args.render_images,
+                use_cache=not args.no_cache,
+                separate_eval=args.separate_eval,
+                env=env)
+        except Exception as e:
+            error = e
+        finally:
+            slots.put(slot)
+        progress.report(output_folder, time.time() - start_time, error)
+
+    with ThreadPool(args.jobs) as pool:
+        pool.map(evaluate_run, runs, chunksize=1)
+    return progress
+
+def evaluate_in_process(runs, args):
+    """
+    Evaluate all runs in this process, one model after another, which
+    saves the Python, CUDA and Nerfstudio startup of every evaluation
+    """
+    import gc
+    from pathlib import Path
+    import torch
+    from eval_model import EvalModel
+
+    progress = Progress(len(runs))
+    for output_folder in runs:
+        start_time = time.time()
+        error = None
+        try:
+            result_paths = train.find_config_path(output_folder)
+            if result_paths is None: raise RuntimeError('no trained model in %s' % output_folder)
+            model_folder, config_path = result_paths
+            eval_timings = timing.measure_in_process(EvalModel(
+                load_config=Path(config_path),
+                output_path=Path(model_folder) / 'metrics.json',
+                render_images=args.render_images).main)
+            train.complete_metrics(output_folder, model_folder, train.read_training_time(output_folder), eval_timings)
+        except Exception as e:
+            error = e
+        # release the previous model before loading the next one
+        gc.collect()
+        torch.cuda.empty_cache()
+        progress.report(output_folder, time.time() - start_time, error)
+    return progress
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('datasets', nargs='*', help='only these datasets (default: all)')
+    parser.add_argument('--output_root', type=str, default='data/outputs')
+    parser.add_argument('--jobs', type=int, default=1, help='concurrent evaluation processes')
+    parser.add_argument('--gpus', type=str, default=None,
+        help='comma-separated CUDA devices assigned round-robin to the evaluation processes')
+    parser.add_argument('--in_process', action='store_true',
+        help='evaluate all models in this process instead of starting a process per model')
+    parser.add_argument('--render_images', action='store_true')
+    parser.add_argument('--separate_eval', action='store_true', help='use ns-eval (not with --in_process)')
+    parser.add_argument('--no_cache', action='store_true',
+        help='re-evaluate even if the cache manifest says the evaluation is up to date (not used with --in_process)')
+    parser.add_argument('--dry_run', action='store_true', help='only list the runs missing metrics')
+    args = parser.parse_args()
+
+    runs = find_runs_missing_metrics(args.output_root, args.datasets if len(args.datasets) > 0 else None)
+    print('%d runs missing metrics' % len(runs))
+    if args.dry_run:
+        for r in runs: print(r)
+    elif len(runs) > 0:
+        if args.in_process:
+            progress = evaluate_in_process(runs, args)
+        else:
+            progress = evaluate_in_subprocesses(runs, args)
+        print('evaluated %d runs, %d failed, in %s' % (progress.n_done - progress.n_failed, progress.n_failed,
+            str(datetime.timedelta(seconds=round(time.time() - progress.start_time)))))
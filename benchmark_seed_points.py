@@ -0,0 +1,183 @@
+"""Benchmark seed point generation components"""
+import time
+import numpy as np
+
+from process_synthetic_inputs import (
+    triangulate,
+    triangulate_point,
+    reproject_point,
+    reprojection_error,
+    read_seed_point_training_frames,
+    find_keypoints_and_descriptors,
+    keypoint_coordinates,
+    plan_image_pairs,
+    create_descriptor_matcher,
+    DESCRIPTOR_MATCHERS,
+    DEFAULT_FEATURE_CACHE_DIR
+)
+
+INTRINSICS = {
+    'w': 1920,
+    'h': 1080,
+    'fl_x': 1500.0,
+    'fl_y': 1500.0,
+    'cx': 960.0,
+    'cy': 540.0
+}
+
+def look_at_c2w(cam_pos, cam_target, up_dir=np.array([0, 0, 1])):
+    z = cam_target - cam_pos
+    z = z / np.linalg.norm(z)
+    x = np.cross(z, up_dir)
+    x = x / np.linalg.norm(x)
+    y = np.cross(z, x)
+    m = np.eye(4)
+    m[:3, 3] = cam_pos
+    m[:3, :3] = np.column_stack((x, -y, -z))
+    return m
+
+def project(P, c2w, intrinsics):
+    p_cam = (P - c2w[:3, 3]) @ c2w[:3, :3]
+    d = -p_cam[:, 2]
+    return np.stack([
+        p_cam[:, 0] / d * intrinsics['fl_x'] + intrinsics['cx'],
+        -p_cam[:, 1] / d * intrinsics['fl_y'] + intrinsics['cy']
+    ], axis=1)
+
+def synthetic_pair(n_matches, outlier_fraction=0.2, noise_pixels=0.5, seed=0):
+    """Two cameras looking at a random point cloud, with noisy and outlier matches"""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    target = np.zeros(3)
+    c2w_i = look_at_c2w(np.array([-0.5, -5, 0.5]), target)
+    c2w_j = look_at_c2w(np.array([0.5, -5, 0.3]), target)
+
+    P = rng.uniform(-1, 1, size=(n_matches, 3))
+    p1 = project(P, c2w_i, INTRINSICS) + rng.normal(scale=noise_pixels, size=(n_matches, 2))
+    p2 = project(P, c2w_j, INTRINSICS) + rng.normal(scale=noise_pixels, size=(n_matches, 2))
+
+    n_outliers = int(n_matches * outlier_fraction)
+    p2[:n_outliers] = rng.uniform([0, 0], [INTRINSICS['w'], INTRINSICS['h']], size=(n_outliers, 2))
+
+    keypoints1 = [cv2.KeyPoint(float(x), float(y), 1) for x, y in p1]
+    keypoints2 = [cv2.KeyPoint(float(x), float(y), 1) for x, y in p2]
+    order = rng.permutation(n_matches)
+    matches = [cv2.DMatch(int(k), int(k), float(d)) for d, k in enumerate(order)]
+    return keypoints1, keypoints2, c2w_i, c2w_j, matches
+
+def triangulate_reference(points1, points2, c2w_i, c2w_j, matches, intrinsics, reprojection_error_pixels):
+    """The original per-match triangulation loop, kept as a reference"""
+    filtered_matches = []
+    points3d = []
+    rejected_matches = []
+
+    for match in matches:
+        i, j = match.queryIdx, match.trainIdx
+
+        def to_dir(p):
+            px = (p[0] - intrinsics['cx']) / intrinsics['fl_x']
+            py = -(p[1] - intrinsics['cy']) / intrinsics['fl_y']
+            h = [px, py, -1]
+            return np.array(h) / np.linalg.norm(h)
+
+        p1 = points1[i].pt
+        p2 = points2[j].pt
+
+        dir_i = c2w_i[:3, :3] @ to_dir(p1)
+        dir_j = c2w_j[:3, :3] @ to_dir(p2)
+
+        P = triangulate_point(c2w_i[:3, 3], dir_i, c2w_j[:3, 3], dir_j)
+
+        rp1 = reproject_point(P, c2w_i, intrinsics)
+        rp2 = reproject_point(P, c2w_j, intrinsics)
+
+        err = max(
+            reprojection_error(rp1, p1),
+            reprojection_error(rp2, p2))
+
+        if err > reprojection_error_pixels:
+            rejected_matches.append((match, rp1, rp2))
+            continue
+
+        filtered_matches.append(match)
+        points3d.append(P)
+
+    return filtered_matches, points3d, rejected_matches
+
+def timed(func, repeats):
+    best = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best: best = elapsed
+    return best, result
+
+def benchmark_triangulation(args):
+    print('--- triangulation (per image pair)')
+    print('matches\tloop (ms)\tbatched (ms)\tspeedup\taccepted')
+    for n in args.n_matches:
+        kp1, kp2, c2w_i, c2w_j, matches = synthetic_pair(n)
+        run = lambda f: f(kp1, kp2, c2w_i, c2w_j, matches, INTRINSICS, args.reprojection_error_pixels)
+
+        t_ref, ref = timed(lambda: run(triangulate_reference), args.repeats)
+        t_new, new = timed(lambda: run(triangulate), args.repeats)
+
+        assert [m.queryIdx for m in ref[0]] == [m.queryIdx for m in new[0]]
+        assert len(ref[2]) == len(new[2])
+        if len(ref[1]) > 0:
+            assert np.allclose(np.array(ref[1]), np.array(new[1]), atol=1e-6)
+
+        print('%d\t%.2f\t\t%.2f\t\t%.1fx\t%d' % (n, t_ref * 1000, t_new * 1000, t_ref / t_new, len(new[0])))
+
+def benchmark_matching(args):
+    """Match the same image pairs of a processed dataset with each matcher backend"""
+    import os
+    transforms, frames = read_seed_point_training_frames(args.dataset_folder)
+    frames = frames[:args.max_images]
+    image_paths = [os.path.join(args.dataset_folder, f['file_path']) for f in frames]
+    keypoints_and_descriptors = find_keypoints_and_descriptors(image_paths, cache_dir=args.feature_cache_dir)
+    keypoint_coords = [keypoint_coordinates(kps) for kps, _ in keypoints_and_descriptors]
+    descriptors = [d for _, d in keypoints_and_descriptors]
+    pairs = plan_image_pairs(frames, transforms, policy='exhaustive')[:args.max_pairs]
+    n_keypoints = np.mean([len(d) for d in descriptors])
+
+    print('--- descriptor matching (%d images, %d pairs, %.0f keypoints/image)' % (len(frames), len(pairs), n_keypoints))
+    print('matcher\t\tpairs/s\t\tmatches\t\tpoints\t\tinlier %')
+    for name in args.matchers:
+        matcher = create_descriptor_matcher(name, descriptors)
+        n_matches = 0
+        n_points = 0
+        match_time = 0
+        for (i, j) in pairs:
+            t0 = time.perf_counter()
+            matches_ij = matcher.match(i, j)
+            match_time += time.perf_counter() - t0
+            filtered, _, _ = triangulate(keypoint_coords[i], keypoint_coords[j],
+                np.array(frames[i]['transform_matrix']), np.array(frames[j]['transform_matrix']),
+                matches_ij, transforms, args.reprojection_error_pixels)
+            n_matches += len(matches_ij)
+            n_points += len(filtered)
+        print('%s\t%s%.2f\t\t%d\t\t%d\t\t%.1f' % (
+            name, '\t' if len(name) < 8 else '',
+            len(pairs) / max(match_time, 1e-9),
+            n_matches, n_points, 100.0 * n_points / max(n_matches, 1)))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n_matches', type=int, nargs='+', default=[100, 1000, 5000, 20000])
+    parser.add_argument('--reprojection_error_pixels', type=float, default=10)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--dataset_folder', type=str, default=None,
+                        help='Processed dataset (e.g., data/inputs-processed/synthetic-mb/cozyroom) for the matching benchmark')
+    parser.add_argument('--matchers', nargs='+', choices=DESCRIPTOR_MATCHERS, default=DESCRIPTOR_MATCHERS)
+    parser.add_argument('--max_images', type=int, default=20)
+    parser.add_argument('--max_pairs', type=int, default=50)
+    parser.add_argument('--feature_cache_dir', type=str, default=DEFAULT_FEATURE_CACHE_DIR)
+    args = parser.parse_args()
+
+    benchmark_triangulation(args)
+    if args.dataset_folder is not None:
+        benchmark_matching(args)
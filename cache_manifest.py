@@ -0,0 +1,120 @@
+"""Fingerprints and per-output-folder manifests for skipping up-to-date steps"""
+import os
+import json
+import hashlib
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+MANIFEST_FILE = 'cache_manifest.json'
+CODE_SUBMODULES = ['nerfstudio', 'gsplat']
+# scripts of this repository that define the training, evaluation and rendering steps
+CODE_FILES = ['train.py', 'eval_model.py', 'render_model.py', 'render_metrics.py', 'render_archive.py']
+
+def hash_file(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk: break
+            h.update(chunk)
+    return h.hexdigest()
+
+def hash_json(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()
+
+def dataset_files(input_folder):
+    """transforms.json and all files it references, relative to input_folder"""
+    with open(os.path.join(input_folder, 'transforms.json')) as f:
+        transforms = json.load(f)
+
+    files = ['transforms.json']
+    for frame in transforms['frames']:
+        for key in ['file_path', 'mask_path']:
+            if key in frame: files.append(frame[key])
+
+    ply_file = transforms.get('ply_file_path', 'sparse_pc.ply')
+    if os.path.exists(os.path.join(input_folder, ply_file)):
+        files.append(ply_file)
+    return files
+
+def dataset_fingerprint(input_folder, num_workers=8):
+    """Content hash of a processed dataset (transforms.json, images, masks and point cloud)"""
+    files = dataset_files(input_folder)
+    # hashlib releases the GIL, so threads are enough here
+    with ThreadPool(num_workers) as pool:
+        hashes = pool.map(hash_file, [os.path.join(input_folder, f) for f in files])
+    return hash_json(list(zip(files, hashes)))
+
+def model_fingerprint(model_folder):
+    """
+    Fingerprint of a trained model in a Nerfstudio output folder
+    (.../splatfacto/<timestamp>). The config is hashed by content and the
+    (large) checkpoints by name, size and modification time
+    """
+    parts = [('config.yml', hash_file(os.path.join(model_folder, 'config.yml')))]
+    ckpt_folder = os.path.join(model_folder, 'nerfstudio_models')
+    if os.path.exists(ckpt_folder):
+        for fn in sorted(os.listdir(ckpt_folder)):
+            st = os.stat(os.path.join(ckpt_folder, fn))
+            parts.append((fn, st.st_size, st.st_mtime_ns))
+    return hash_json(parts)
+
+def git_version(folder):
+    def git(*args):
+        return subprocess.check_output(['git', '-C', folder] + list(args),
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+
+    try:
+        version = git('rev-parse', 'HEAD')
+        if git('status', '--porcelain', '--untracked-files=no') != '':
+            version += '-dirty-' + hashlib.sha1(git('diff', 'HEAD').encode('utf-8')).hexdigest()[:12]
+        return version
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+def code_version():
+    """
+    Versions of the training code: hashes of the scripts in CODE_FILES, and the
+    submodule commits (and local changes), or installed package versions
+    """
+    from importlib import metadata
+    root = os.path.dirname(os.path.abspath(__file__))
+    versions = {}
+    for name in CODE_SUBMODULES:
+        version = None
+        folder = os.path.join(root, name)
+        if os.path.exists(os.path.join(folder, '.git')):
+            version = git_version(folder)
+        if version is None:
+            try:
+                version = metadata.version(name)
+            except metadata.PackageNotFoundError:
+                version = 'unknown'
+        versions[name] = version
+    for name in CODE_FILES:
+        path = os.path.join(root, name)
+        versions[name] = hash_file(path) if os.path.exists(path) else 'missing'
+    return versions
+
+def read_manifest(output_folder):
+    path = os.path.join(output_folder, MANIFEST_FILE)
+    if not os.path.exists(path): return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def is_up_to_date(output_folder, step, fingerprint):
+    entry = read_manifest(output_folder).get(step)
+    return entry is not None and entry['fingerprint'] == fingerprint
+
+def record_step(output_folder, step, fingerprint, **info):
+    manifest = read_manifest(output_folder)
+    manifest[step] = dict(fingerprint=fingerprint, **info)
+    os.makedirs(output_folder, exist_ok=True)
+    path = os.path.join(output_folder, MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, path)
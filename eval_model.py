@@ -0,0 +1,75 @@
+"""Evaluate a model and optionally save the rendered eval images, with one model load"""
+
+from dataclasses import dataclass
+from pathlib import Path
+import json
+import os
+import shutil
+import tyro
+
+from nerfstudio.models.splatfacto import SplatfactoModel
+from nerfstudio.utils.eval_utils import eval_setup
+
+from render_model import save_outputs, ImageWriter
+
+@dataclass
+class EvalModel:
+    """Compute the same metrics as ns-eval and save the renders of the same pass."""
+
+    load_config: Path
+    """Path to the config YAML file."""
+    output_path: Path = Path("metrics.json")
+    """Name of the output metrics file (same format as ns-eval)."""
+    render_images: bool = False
+    """Also save the renders (as render_model.py --set eval) to the renders subfolder of the load_config path"""
+    writer_threads: int = 4
+    """Threads writing the renders while the evaluation continues (0: write synchronously)"""
+
+    def main(self):
+        config, pipeline, checkpoint_path, _ = eval_setup(self.load_config)
+
+        assert isinstance(pipeline.model, SplatfactoModel)
+        model: SplatfactoModel = pipeline.model
+
+        writer = None
+        if self.render_images:
+            renders_dir = os.path.join(os.path.dirname(self.load_config), 'renders')
+            if os.path.exists(renders_dir):
+                shutil.rmtree(renders_dir)
+            os.makedirs(renders_dir)
+            print('writing %s' % renders_dir)
+
+            image_filenames = pipeline.datamanager.eval_dataset.image_filenames
+            writer = ImageWriter(self.writer_threads) if self.writer_threads > 0 else None
+            compute_metrics = model.get_image_metrics_and_images
+
+            # The metrics are computed from the outputs of the eval loop below.
+            # Save the same outputs instead of rendering the cameras again
+            def get_image_metrics_and_images(outputs, batch):
+                result = compute_metrics(outputs, batch)
+                image_name = Path(image_filenames[int(batch["image_idx"])]).stem
+                save_outputs(outputs, batch, renders_dir, image_name, writer)
+                return result
+
+            model.get_image_metrics_and_images = get_image_metrics_and_images
+
+        try:
+            metrics_dict = pipeline.get_average_eval_image_metrics(get_std=True)
+        finally:
+            # also on errors: wait for the queued writes and raise their errors
+            if writer is not None:
+                writer.close()
+
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        benchmark_info = {
+            "experiment_name": config.experiment_name,
+            "method_name": config.method_name,
+            "checkpoint": str(checkpoint_path),
+            "results": metrics_dict,
+        }
+        self.output_path.write_text(json.dumps(benchmark_info, indent=2), "utf8")
+        print('saved results to: %s' % str(self.output_path))
+
+
+if __name__ == "__main__":
+    tyro.cli(EvalModel).main()
@@ -0,0 +1,124 @@
+"""Batched camera pose and velocity math"""
+import numpy as np
+
+def rotation_matrices_to_rotvecs(R):
+    """(N, 3, 3) rotation matrices to (N, 3) rotation vectors"""
+    # Using a proven/stable algorithm. Other options are sketchy for small rotation
+    from scipy.spatial.transform import Rotation
+    R = np.asarray(R, dtype=np.float64).reshape(-1, 3, 3)
+    if len(R) == 0: return np.zeros((0, 3))
+    return Rotation.from_matrix(R).as_rotvec()
+
+def camera_velocities(c2w_start, c2w_end, c2w_cur, delta_t):
+    """
+    Camera-frame linear and angular velocities from the motion between two
+    poses, for N cameras at once.
+
+    Args:
+        c2w_start, c2w_end: (N, 4, 4) (or (N, 3, 4)) camera-to-world poses at
+            the beginning and the end of the motion
+        c2w_cur: (N, 4, 4) poses defining the camera frame of the output
+        delta_t: scalar or (N,) durations of the motion
+
+    Returns:
+        (linear (N, 3), angular (N, 3)) velocities in camera coordinates
+    """
+    c2w_start = np.asarray(c2w_start, dtype=np.float64)
+    c2w_end = np.asarray(c2w_end, dtype=np.float64)
+    c2w_cur = np.asarray(c2w_cur, dtype=np.float64)
+    delta_t = np.broadcast_to(np.asarray(delta_t, dtype=np.float64), (len(c2w_cur),))[:, None]
+
+    velocity_w = (c2w_end[:, :3, 3] - c2w_start[:, :3, 3]) / delta_t
+    rot = c2w_end[:, :3, :3] @ np.transpose(c2w_start[:, :3, :3], (0, 2, 1))
+    ang_vel_w = rotation_matrices_to_rotvecs(rot) / delta_t
+
+    # R_w2c @ v for each camera
+    R_c2w = c2w_cur[:, :3, :3]
+    velocity_cam = np.einsum('nji,nj->ni', R_c2w, velocity_w)
+    ang_vel_cam = np.einsum('nji,nj->ni', R_c2w, ang_vel_w)
+    return velocity_cam, ang_vel_cam
+
+def finite_difference_velocities(c2ws, loop=False):
+    """
+    Central difference velocities of a pose sequence, in units per frame.
+    The ends use one-sided differences, unless loop is True, in which case
+    the sequence wraps around.
+
+    Args:
+        c2ws: (N, 4, 4) camera-to-world poses
+
+    Returns:
+        (linear (N, 3), angular (N, 3)) velocities in camera coordinates
+    """
+    c2ws = np.asarray(c2ws, dtype=np.float64)
+    n = len(c2ws)
+    if n < 2: return np.zeros((n, 3)), np.zeros((n, 3))
+
+    idx = np.arange(n)
+    if loop:
+        i_prev = (idx - 1) % n
+        i_next = (idx + 1) % n
+        delta_t = np.full(n, 2.0)
+    else:
+        i_prev = np.maximum(idx - 1, 0)
+        i_next = np.minimum(idx + 1, n - 1)
+        delta_t = (i_next - i_prev).astype(np.float64)
+
+    return camera_velocities(c2ws[i_prev], c2ws[i_next], c2ws, delta_t)
+
+def blur_matrix_velocities(c2ws, blur_first, blur_last, exposure_duration):
+    """
+    Velocities of synthetic motion blurred frames, from the first and last
+    pose during the exposure (see process_synthetic_inputs.py)
+
+    Args:
+        c2ws: (N, 4, 4) frame poses
+        blur_first, blur_last: (N, 4, 4) first and last blur poses
+        exposure_duration: exposure time + rolling shutter time
+    """
+    return camera_velocities(blur_first, blur_last, c2ws, exposure_duration)
+
+def reference_finite_difference_velocities(c2ws):
+    """Per-frame implementation (the original render_video.add_velocities loop), for benchmarking"""
+    from scipy.spatial.transform import Rotation
+    n = len(c2ws)
+    linear = []
+    angular = []
+    for i in range(n):
+        i_prev = max(0, i - 1)
+        i_next = min(n - 1, i + 1)
+        delta_t = i_next - i_prev
+        prev_pose = c2ws[i_prev]
+        next_pose = c2ws[i_next]
+        velocity_w = (next_pose[:3, 3] - prev_pose[:3, 3]) / delta_t
+        rot = next_pose[:3, :3] @ prev_pose[:3, :3].transpose()
+        ang_vel_w = Rotation.from_matrix(rot).as_rotvec() / delta_t
+        R_w2c = c2ws[i][:3, :3].transpose()
+        linear.append(R_w2c @ velocity_w)
+        angular.append(R_w2c @ ang_vel_w)
+    return np.array(linear), np.array(angular)
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    from scipy.spatial.transform import Rotation
+
+    parser = argparse.ArgumentParser(description='Benchmark batched velocity computation')
+    parser.add_argument('--n_frames', type=int, nargs='+', default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    print('frames\tper-frame (ms)\tbatched (ms)\tspeedup')
+    for n in args.n_frames:
+        t = np.linspace(0, 10, n)
+        c2ws = np.tile(np.eye(4), (n, 1, 1))
+        c2ws[:, :3, :3] = Rotation.from_rotvec(np.stack([np.sin(t), 0.5 * t, np.cos(2 * t)], axis=1)).as_matrix()
+        c2ws[:, :3, 3] = np.stack([np.cos(t), np.sin(t), 0.1 * t], axis=1)
+
+        t0 = time.perf_counter()
+        ref = reference_finite_difference_velocities(c2ws)
+        t1 = time.perf_counter()
+        new = finite_difference_velocities(c2ws)
+        t2 = time.perf_counter()
+
+        assert np.allclose(ref[0], new[0]) and np.allclose(ref[1], new[1])
+        print('%d\t%.1f\t\t%.1f\t\t%.0fx' % (n, (t1 - t0) * 1000, (t2 - t1) * 1000, (t1 - t0) / (t2 - t1)))
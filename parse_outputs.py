@@ -6,6 +6,45 @@ def parse_metrics(metrics_path):
     with open(metrics_path) as f:
         return json.load(f)
 
+TIMING_COLUMNS = [
+    'train_time', 'train_startup', 'train_caching', 'train_training', 'train_finishing',
+    'train_cpu', 'train_rss_mb', 'train_io_mb',
+    'eval_time', 'eval_cpu', 'eval_rss_mb',
+    'render_time', 'render_cpu', 'render_rss_mb'
+]
+
+def flatten_timings(timings):
+    """Timings block of metrics.json (see timing.py) to flat columns like train_time, train_rss_mb"""
+    d = {}
+    for step, t in timings.items():
+        d[step + '_time'] = t['wall_seconds']
+        d[step + '_cpu'] = t['user_cpu_seconds'] + t['system_cpu_seconds']
+        d[step + '_rss_mb'] = t['peak_rss_mb']
+        d[step + '_io_mb'] = (t['read_bytes'] + t['write_bytes']) / 1e6
+        for phase, duration in t.get('phases', {}).items():
+            d[step + '_' + phase] = duration
+    return d
+
+THROUGHPUT_COLUMNS = [
+    'it_s', 'steady_it_s', 'iter_ms', 'to_3000_s', 'to_20000_s', 'final_gaussians', 'peak_gaussians', 'final_loss'
+]
+
+def flatten_training_telemetry(telemetry):
+    """Training telemetry of metrics.json (see tensorboard_telemetry.py) to flat columns"""
+    d = {
+        'it_s': telemetry.get('iterations_per_second'),
+        'steady_it_s': telemetry.get('steady_state_iterations_per_second'),
+        'iter_ms': telemetry.get('median_iteration_ms'),
+    }
+    for n, t in telemetry.get('seconds_to_step', {}).items():
+        d['to_%s_s' % n] = t
+    if 'gaussian_count' in telemetry:
+        d['final_gaussians'] = telemetry['gaussian_count']['final']
+        d['peak_gaussians'] = telemetry['gaussian_count']['peak']
+    if 'loss' in telemetry:
+        d['final_loss'] = telemetry['loss']['final']
+    return d
+
 def find_and_parse_directories_containing_splatting_metrics(root_dir):
     matching_dirs = []
 
@@ -31,6 +70,9 @@ def find_and_parse_directories_containing_splatting_metrics(root_dir):
 
         
         for k, v in m['results'].items(): d[k] = v
+        d.update(flatten_timings(m.get('timings', {})))
+        if 'training_telemetry' in m:
+            d.update(flatten_training_telemetry(m['training_telemetry']))
         # print(d)
         return d
 
@@ -50,12 +92,21 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('dataset', type=str, nargs='?', default=None)
     parser.add_argument('-f', '--output_format', choices=['csv', 'txt'], default='txt')
+    parser.add_argument('--timings', action='store_true', help='show per-step timings and resource usage')
+    parser.add_argument('--throughput', action='store_true',
+        help='show training throughput telemetry, and its averages by dataset and variant')
     args = parser.parse_args()
 
     import pandas as pd
     pd.set_option("display.max_rows", None)
     df = pd.DataFrame(find_and_parse_directories_containing_splatting_metrics('data/outputs'))
     cols = 'dataset variant session psnr ssim lpips time'.split()
+    if args.timings:
+        cols += [c for c in TIMING_COLUMNS if c in df.columns]
+    throughput_cols = []
+    if args.throughput:
+        throughput_cols = [c for c in THROUGHPUT_COLUMNS if c in df.columns]
+        cols += throughput_cols
     df = df[cols]
     if args.dataset is not None:
         df = df[df['dataset'] == args.dataset].drop('dataset', axis=1)
@@ -65,4 +116,12 @@ if __name__ == '__main__':
     elif args.output_format == 'txt':
         print(df)
     else:
-        raise ValueError(f'Unknown format: {args.output_format}')
\ No newline at end of file
+        raise ValueError(f'Unknown format: {args.output_format}')
+    if len(throughput_cols) > 0:
+        group = [c for c in ['dataset', 'variant'] if c in df.columns]
+        summary = df.groupby(group)[throughput_cols].mean().reset_index()
+        if args.output_format == 'csv':
+            print(summary.to_csv(index=False))
+        else:
+            print('\nmean by %s' % ' and '.join(group))
+            print(summary)
@@ -5,7 +5,12 @@ import shutil
 import tempfile
 import json
 
-from process_synthetic_inputs import generate_seed_points_match_and_triangulate
+from process_synthetic_inputs import (
+    generate_seed_points_match_and_triangulate,
+    PAIR_SELECTION_POLICIES,
+    DESCRIPTOR_MATCHERS,
+    DEFAULT_FEATURE_CACHE_DIR
+)
 
 def process(input_folder, args, pass_no=1):
 
@@ -212,7 +217,18 @@ def process(input_folder, args, pass_no=1):
                     shutil.copyfile(ply_fn, backup_ply)
                 if not os.path.exists(backup_json):
                     shutil.copyfile(json_fn, backup_json)
-            generate_seed_points_match_and_triangulate(output_folder, dry_run=args.dry_run, visualize=args.dry_run)
+            generate_seed_points_match_and_triangulate(output_folder,
+                dry_run=args.dry_run,
+                visualize=args.dry_run,
+                pair_selection=args.pair_selection,
+                feature_cache_dir=args.feature_cache_dir,
+                num_workers=args.num_workers,
+                merge_tracks=args.merge_tracks,
+                voxel_size=args.voxel_size,
+                max_points=args.max_points,
+                matcher=args.matcher,
+                streaming=args.streaming,
+                memory_limit_mb=args.memory_limit_mb)
         else:
             assert args.dry_run
     
@@ -227,6 +243,17 @@ if __name__ == '__main__':
     parser.add_argument('--dataset', default='synthetic_camera_motion_blur')
     parser.add_argument('--post_process_only', action='store_true')
     parser.add_argument('--manual_point_cloud', action='store_true')
+    parser.add_argument('--pair_selection', choices=PAIR_SELECTION_POLICIES, default='exhaustive',
+                        help='Which image pairs to match in --manual_point_cloud mode')
+    parser.add_argument('--feature_cache_dir', type=str, default=DEFAULT_FEATURE_CACHE_DIR)
+    parser.add_argument('--no_feature_cache', dest='feature_cache_dir', action='store_const', const=None)
+    parser.add_argument('--num_workers', type=int, default=None)
+    parser.add_argument('--merge_tracks', action='store_true')
+    parser.add_argument('--voxel_size', type=float, default=None)
+    parser.add_argument('--max_points', type=int, default=None)
+    parser.add_argument('--matcher', choices=DESCRIPTOR_MATCHERS, default='bruteforce')
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--memory_limit_mb', type=int, default=4000)
     parser.add_argument('--deblurring_version', action='store_true')
     parser.add_argument('--exact_intrinsics', action='store_true')
     parser.add_argument('--hloc', action='store_true')
@@ -2,19 +2,17 @@
 import os
 import json
 import shutil
+import time
 import cv2
 import numpy as np
 
+from kinematics import blur_matrix_velocities
+
 POSE_POSITION_NOISE_REL = 0.05
 POSE_ORIENTATION_NOISE_DEG = 1
 
 INTRINSIC_NOISE_REL = 0.01
 
-def rotation_matrix_to_rotvec(R):
-    # Using a proven/stable algorithm. Other options are sketchy for small rotation
-    from scipy.spatial.transform import Rotation
-    return Rotation.from_matrix(R).as_rotvec()
-
 def quaternion_to_rotation_matrix(q_wxyz):
     q = q_wxyz
     return np.array([
@@ -41,7 +39,44 @@ def deterministic_uniform_rand_generator(seed=1000):
         x = (a * x + c) % m
         yield float(x % uniform_steps) / uniform_steps
 
-def process(data_path, target, noisy_poses=False, noisy_intrinsics=False):
+def is_rgb8_image(path):
+    """
+    True if the file decodes as is to the 8-bit, 3-channel image that
+    cv2.imread(IMREAD_COLOR) would produce: no alpha, grayscale, 16-bit
+    samples, transparency key or EXIF rotation. Only the header is read
+    """
+    from PIL import Image
+    try:
+        with Image.open(path) as im:
+            if im.mode != 'RGB' or 'transparency' in im.info: return False
+            for tile in im.tile:
+                rawmode = tile[3][0] if isinstance(tile[3], tuple) else tile[3]
+                if ';16' in str(rawmode): return False
+            return im.getexif().get(0x0112, 1) == 1
+    except (OSError, SyntaxError):
+        return False
+
+def copy_image(src, dst, hardlink=False):
+    """
+    Copy an image file without decoding it when no pixel transform is
+    needed: hardlink (if requested and supported) or byte copy. Otherwise,
+    re-encode as an 8-bit, 3-channel image
+    """
+    if os.path.splitext(src)[1].lower() != os.path.splitext(dst)[1].lower() or not is_rgb8_image(src):
+        img = cv2.imread(src, cv2.IMREAD_COLOR)
+        if img is None: raise RuntimeError('could not read image %s' % src)
+        cv2.imwrite(dst, img)
+        return
+
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+def convert_synthetic_frames(data_path):
     """
     # --- Based on
     # https://github.com/limacv/Deblur-NeRF/blob/766ca3cfafa026ea45f75ee1d3186ec3d9e13d99/scripts/synthe2poses.py
@@ -70,24 +105,7 @@ def process(data_path, target, noisy_poses=False, noisy_intrinsics=False):
     SOFTWARE.
     """
 
-    print(f"Processing: {data_path} -> {target}")
-    if os.path.exists(target): shutil.rmtree(target)
-
-    input_path = data_path
-    json_path = os.path.join(input_path, "transforms.json")
-    out_path = os.path.join(target, "images")
-    converted_json_path = os.path.join(target, "transforms.json")
-    os.makedirs(out_path, exist_ok=True)
-
-    rand = deterministic_uniform_rand_generator()
-    def rand3():
-        nonlocal rand
-        return np.array([next(rand) for _ in range(3)]) * 2 - 1
-
-    def convert_pose_c2w(pose, scaling):
-        pose = np.array(pose)
-        pose[:3, :] *= scaling
-        return pose
+    json_path = os.path.join(data_path, "transforms.json")
 
     def get_scaling(m):
         return 1.0 / np.sqrt((m[:3,:3].transpose() @ m[:3,:3])[0,0])
@@ -102,14 +120,6 @@ def process(data_path, target, noisy_poses=False, noisy_intrinsics=False):
 
     focal_length = w / 2 / np.tan(fov / 2)
 
-    if noisy_intrinsics:
-        # slight (fixed) error in intrinsics
-        intrinsic_noisy_scaling_x = 1 + INTRINSIC_NOISE_REL
-        intrinsic_noisy_scaling_y = 1 - INTRINSIC_NOISE_REL
-    else:
-        intrinsic_noisy_scaling_x = 1
-        intrinsic_noisy_scaling_y = 1
-
     converted_meta = {
         "aabb_scale": 16,
         "w": w,
@@ -119,8 +129,8 @@ def process(data_path, target, noisy_poses=False, noisy_intrinsics=False):
         "orientation_override": "none",
         "exposure_time": exposure_time,
         "rolling_shutter_time": rolling_shutter_time,
-        "fl_x": focal_length * intrinsic_noisy_scaling_x,
-        "fl_y": focal_length * intrinsic_noisy_scaling_y,
+        "fl_x": focal_length,
+        "fl_y": focal_length,
         "k1": 0,
         "k2": 0,
         "p1": 0,
@@ -128,54 +138,60 @@ def process(data_path, target, noisy_poses=False, noisy_intrinsics=False):
         "frames": []
     }
 
-    scaling = None
-
-    cam_positions = []
-
-    for frame_data in frames_data:
-        pose = np.array(frame_data["transform_matrix"])
-        if scaling is None:
-            scaling = get_scaling(pose)
-        pose = convert_pose_c2w(pose, scaling)
-        cam_positions.append(pose[:3, 3])
+    if len(frames_data) == 0: return converted_meta, []
+
+    poses = np.array([frame_data["transform_matrix"] for frame_data in frames_data], dtype=np.float64)
+    scaling = get_scaling(poses[0])
+    poses[:, :3, :] *= scaling
+
+    blurred = [k for k, frame_data in enumerate(frames_data) if frame_data["blurcount"] > 0]
+    blur_first = np.array([frames_data[k]['blur_matrices'][0] for k in blurred], dtype=np.float64).reshape(-1, 4, 4)
+    blur_last = np.array([
+        frames_data[k]['blur_matrices'][frames_data[k]["blurcount"] - 1] for k in blurred
+    ], dtype=np.float64).reshape(-1, 4, 4)
+    blur_first[:, :3, :] *= scaling
+    blur_last[:, :3, :] *= scaling
+
+    velocities = {}
+    if len(blurred) > 0:
+        velocity_cam, ang_vel_cam = blur_matrix_velocities(poses[blurred], blur_first, blur_last,
+            exposure_time + rolling_shutter_time)
+        for k, v, w in zip(blurred, velocity_cam, ang_vel_cam):
+            velocities[k] = (v, w)
+
+    source_images = []
+    for k, frame_data in enumerate(frames_data):
         img_path = os.path.join(data_path, frame_data["filename"])
         img_name = os.path.basename(img_path)
-        img_out = os.path.join(out_path, img_name)
-
-        if frame_data["blurcount"] == 0:
-            img = cv2.imread(img_path)
-            cv2.imwrite(img_out, img)
-
-            velocity_cam = np.array([0, 0, 0])
-            ang_vel_cam = np.array([0, 0, 0])
-        else:
-            img = cv2.imread(img_path)
-            blur_poses = []
-            for bluri in range(frame_data["blurcount"]):
-                blur_poses.append(convert_pose_c2w(frame_data['blur_matrices'][bluri], scaling))
-
-            velocity_w = (blur_poses[-1][:3, 3] - blur_poses[0][:3, 3]) / (exposure_time + rolling_shutter_time)
-            rot = blur_poses[-1][:3, :3] @ blur_poses[0][:3, :3].transpose()
-            rot_vec = rotation_matrix_to_rotvec(rot)
-            # print(rot, rot_vec, np.linalg.norm(rot_vec))
-            ang_vel_w = rot_vec / (exposure_time + rolling_shutter_time)
-
-            R_w2c = pose[:3, :3].transpose()
-            velocity_cam = R_w2c @ velocity_w
-            ang_vel_cam = R_w2c @ ang_vel_w
-            # print(velocity_cam, ang_vel_cam)
-            cv2.imwrite(img_out, img)
-
-        print(f"frame {img_name} saved!")
+        velocity_cam, ang_vel_cam = velocities.get(k, (np.array([0, 0, 0]), np.array([0, 0, 0])))
 
+        source_images.append(img_path)
         converted_meta["frames"].append({
             "camera_linear_velocity": velocity_cam.tolist(),
             "camera_angular_velocity": ang_vel_cam.tolist(),
             "file_path": f"./images/{img_name}",
-            "transform_matrix": pose.tolist()
+            "transform_matrix": poses[k].tolist()
         })
-    
+
+    return converted_meta, source_images
+
+def add_synthetic_noise(converted_meta, noisy_poses=False, noisy_intrinsics=False):
+    """Return a copy of the converted metadata with (deterministic) pose and intrinsic noise"""
+    import copy
+    converted_meta = copy.deepcopy(converted_meta)
+
+    rand = deterministic_uniform_rand_generator()
+    def rand3():
+        nonlocal rand
+        return np.array([next(rand) for _ in range(3)]) * 2 - 1
+
+    if noisy_intrinsics:
+        # slight (fixed) error in intrinsics
+        converted_meta["fl_x"] *= 1 + INTRINSIC_NOISE_REL
+        converted_meta["fl_y"] *= 1 - INTRINSIC_NOISE_REL
+
     if noisy_poses:
+        cam_positions = [np.array(f['transform_matrix'])[:3, 3] for f in converted_meta['frames']]
         center = np.mean(cam_positions, axis=0)
         scene_motion_scale = np.max(np.linalg.norm(cam_positions - center, axis=1))
         pos_noise_scale = POSE_POSITION_NOISE_REL * scene_motion_scale
@@ -197,26 +213,151 @@ def process(data_path, target, noisy_poses=False, noisy_intrinsics=False):
             pose[:3, :3] = pose[:3, :3] @ noise_R
             f['transform_matrix'] = pose.tolist()
 
+    return converted_meta
+
+def write_synthetic_dataset(target, converted_meta, source_images, hardlink_images=False, num_workers=None):
+    if os.path.exists(target): shutil.rmtree(target)
+
+    out_path = os.path.join(target, "images")
+    converted_json_path = os.path.join(target, "transforms.json")
+    os.makedirs(out_path, exist_ok=True)
+
+    def copy_frame(img_path):
+        img_name = os.path.basename(img_path)
+        copy_image(img_path, os.path.join(out_path, img_name), hardlink=hardlink_images)
+        return img_name
+
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for img_name in executor.map(copy_frame, source_images):
+            print(f"frame {img_name} saved!")
+
     with open(converted_json_path, 'wt') as f:
         json.dump(converted_meta, f, indent=4)
 
-def point_cloud_to_ply(xyzrgbs, out_fn):
-    with open(out_fn, 'wt') as f:
-        f.write('\n'.join([
-            'ply',
-            'format ascii 1.0',
-            'element vertex %d' % len(xyzrgbs),
-            'property float x',
-            'property float y',
-            'property float z',
-            'property uint8 red',
-            'property uint8 green',
-            'property uint8 blue',
-            'end_header'
-        ]) + '\n')
-        for r in xyzrgbs:
-            for i in range(3): r[i+3] = int(r[i+3])
-            f.write(' '.join([str(v) for v in r]) + '\n')
+def process(data_path, target, noisy_poses=False, noisy_intrinsics=False, hardlink_images=False, num_workers=None, converted=None):
+    """
+    Convert a raw synthetic dataset to the benchmark format. The output of
+    convert_synthetic_frames(data_path) can be passed as converted to avoid
+    recomputing it
+    """
+    print(f"Processing: {data_path} -> {target}")
+    if converted is None:
+        converted = convert_synthetic_frames(data_path)
+    converted_meta, source_images = converted
+    converted_meta = add_synthetic_noise(converted_meta, noisy_poses=noisy_poses, noisy_intrinsics=noisy_intrinsics)
+    write_synthetic_dataset(target, converted_meta, source_images,
+        hardlink_images=hardlink_images,
+        num_workers=num_workers)
+
+PLY_VERTEX_DTYPE = np.dtype([
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('z', '<f4'),
+    ('red', 'u1'),
+    ('green', 'u1'),
+    ('blue', 'u1')
+])
+
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1',
+    'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2',
+    'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4',
+    'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4',
+    'double': 'f8', 'float64': 'f8'
+}
+
+def make_point_cloud(xyz, rgb):
+    """Build a PLY_VERTEX_DTYPE structured array from (N, 3) positions and (N, 3) colors"""
+    xyz = np.asarray(xyz).reshape(-1, 3)
+    rgb = np.asarray(rgb).reshape(-1, 3)
+    points = np.empty(len(xyz), dtype=PLY_VERTEX_DTYPE)
+    for i, c in enumerate('xyz'): points[c] = xyz[:, i]
+    for i, c in enumerate(['red', 'green', 'blue']): points[c] = rgb[:, i]
+    return points
+
+def ply_header(n_vertices, binary=True):
+    return ('\n'.join([
+        'ply',
+        'format %s 1.0' % ('binary_little_endian' if binary else 'ascii'),
+        'element vertex %d' % n_vertices,
+        'property float x',
+        'property float y',
+        'property float z',
+        'property uint8 red',
+        'property uint8 green',
+        'property uint8 blue',
+        'end_header'
+    ]) + '\n').encode('ascii')
+
+def point_cloud_to_ply(xyzrgbs, out_fn, binary=True):
+    """
+    Write a colored point cloud as a PLY file.
+
+    Args:
+        xyzrgbs: PLY_VERTEX_DTYPE structured array, or a list of [x, y, z, r, g, b] rows
+        out_fn: output path
+        binary: write binary_little_endian (default) or ASCII PLY
+    """
+    if not (isinstance(xyzrgbs, np.ndarray) and xyzrgbs.dtype.names is not None):
+        rows = np.asarray(xyzrgbs, dtype=np.float64).reshape(-1, 6)
+        xyzrgbs = make_point_cloud(rows[:, :3], rows[:, 3:].astype(np.int64))
+    xyzrgbs = xyzrgbs.astype(PLY_VERTEX_DTYPE, copy=False)
+
+    with open(out_fn, 'wb') as f:
+        f.write(ply_header(len(xyzrgbs), binary))
+        if binary:
+            f.write(xyzrgbs.tobytes())
+        else:
+            np.savetxt(f, xyzrgbs, fmt='%.9g %.9g %.9g %d %d %d')
+
+def read_ply(fn):
+    """
+    Read the vertex element of an ASCII or binary PLY file as a structured array.
+    Only files with vertices as the first element are supported.
+    """
+    with open(fn, 'rb') as f:
+        if f.readline().strip() != b'ply': raise ValueError('%s: not a PLY file' % fn)
+        fmt = None
+        n_vertices = None
+        properties = []
+        in_vertex = False
+        while True:
+            line = f.readline()
+            if not line: raise ValueError('%s: unexpected end of header' % fn)
+            tokens = line.decode('ascii').split()
+            if len(tokens) == 0: continue
+            if tokens[0] == 'end_header': break
+            if tokens[0] == 'format':
+                fmt = tokens[1]
+            elif tokens[0] == 'element':
+                if n_vertices is None and tokens[1] == 'vertex':
+                    n_vertices = int(tokens[2])
+                    in_vertex = True
+                else:
+                    in_vertex = False
+            elif tokens[0] == 'property' and in_vertex:
+                if tokens[1] == 'list': raise ValueError('%s: list vertex properties not supported' % fn)
+                properties.append((tokens[2], PLY_TYPES[tokens[1]]))
+
+        if n_vertices is None: raise ValueError('%s: no vertex element' % fn)
+
+        if fmt == 'ascii':
+            dtype = np.dtype([(name, t) for name, t in properties])
+            points = np.empty(n_vertices, dtype=dtype)
+            if n_vertices == 0: return points
+            values = np.loadtxt(f, max_rows=n_vertices, ndmin=2)
+            for i, (name, _) in enumerate(properties): points[name] = values[:, i]
+            return points
+
+        byte_order = { 'binary_little_endian': '<', 'binary_big_endian': '>' }.get(fmt)
+        if byte_order is None: raise ValueError('%s: unknown PLY format %s' % (fn, fmt))
+        dtype = np.dtype([(name, byte_order + t) for name, t in properties])
+        data = f.read(dtype.itemsize * n_vertices)
+        return np.frombuffer(data, dtype=dtype, count=n_vertices)
 
 def triangulate_point(o1, d1, o2, d2):
     A = np.stack([d1, -d2]).T
@@ -241,49 +382,527 @@ def reprojection_error(p_reproj, p_orig):
     if p_reproj is None: return 1e6
     return np.linalg.norm(p_reproj - np.array(p_orig))
 
-def triangulate(points1, points2, c2w_i, c2w_j, matches, intrinsics, reprojection_error_pixels):
-    filtered_matches = []
-    points3d = []
-    rejected_matches = []
+def keypoint_coordinates(keypoints):
+    """Convert a list of cv2.KeyPoints to a (N, 2) array of pixel coordinates"""
+    if isinstance(keypoints, np.ndarray): return keypoints.reshape(-1, 2)
+    return np.array([kp.pt for kp in keypoints], dtype=np.float64).reshape(-1, 2)
+
+def pixels_to_dirs(p, intrinsics):
+    """Unit camera-frame ray directions for (N, 2) pixel coordinates"""
+    px = (p[:, 0] - intrinsics['cx']) / intrinsics['fl_x']
+    py = -(p[:, 1] - intrinsics['cy']) / intrinsics['fl_y']
+    h = np.stack([px, py, -np.ones_like(px)], axis=1)
+    return h / np.linalg.norm(h, axis=1, keepdims=True)
+
+def triangulate_points(o1, d1, o2, d2):
+    """
+    Closed-form midpoint triangulation of N ray pairs, i.e., a batched
+    version of triangulate_point. Directions (N, 3) must be unit vectors
+    """
+    b = o2 - o1
+    a = np.sum(d1 * d2, axis=-1)
+    c1 = np.sum(d1 * b, axis=-1)
+    c2 = np.sum(d2 * b, axis=-1)
+    denom = 1 - a*a
+    parallel = np.abs(denom) < 1e-12
+    safe_denom = np.where(parallel, 1, denom)
+    # for (nearly) parallel rays, use the minimum norm solution like lstsq
+    t1 = np.where(parallel, c1 * 0.5, (c1 - a * c2) / safe_denom)
+    t2 = np.where(parallel, -c2 * 0.5, (a * c1 - c2) / safe_denom)
+    P1 = o1 + t1[:, None] * d1
+    P2 = o2 + t2[:, None] * d2
+    return (P1 + P2) / 2
+
+def reproject_points(P, c2w, intrinsics):
+    """
+    Batched reproject_point. Returns (N, 2) pixel coordinates and a validity
+    mask (False for points behind the camera)
+    """
+    p_cam = (P - c2w[:3, 3]) @ c2w[:3, :3]
+    MIN_D = 1e-6
 
-    for match in matches:
-        i, j = match.queryIdx, match.trainIdx
+    depth = -p_cam[:, 2]
+    valid = depth > MIN_D
+    safe_depth = np.where(valid, depth, 1)
+    p_px = np.stack([
+        p_cam[:, 0] / safe_depth * intrinsics['fl_x'] + intrinsics['cx'],
+        -p_cam[:, 1] / safe_depth * intrinsics['fl_y'] + intrinsics['cy']
+    ], axis=1)
+    return p_px, valid
 
-        def to_dir(p):
-            px = (p[0] - intrinsics['cx']) / intrinsics['fl_x']
-            py = -(p[1] - intrinsics['cy']) / intrinsics['fl_y']
-            h = [px, py, -1]
-            return np.array(h) / np.linalg.norm(h)
+def reprojection_errors(p_reproj, valid, p_orig):
+    err = np.linalg.norm(p_reproj - p_orig, axis=1)
+    return np.where(valid, err, 1e6)
 
-        p1 = points1[i].pt
-        p2 = points2[j].pt
+def triangulate_arrays(p1, p2, c2w_i, c2w_j, intrinsics, reprojection_error_pixels):
+    """
+    Triangulate all matches of an image pair at once.
+
+    Args:
+        p1, p2: (N, 2) arrays of matched pixel coordinates in images i and j
+        c2w_i, c2w_j: camera-to-world matrices
+        intrinsics: dict with fl_x, fl_y, cx, cy
+        reprojection_error_pixels: max reprojection error in either image
+
+    Returns:
+        (accepted, points3d, rp1, valid1, rp2, valid2), where accepted is a
+        boolean mask of length N, points3d is (N, 3) and rp*, valid* are the
+        reprojections and their validity masks
+    """
+    c2w_i = np.asarray(c2w_i, dtype=np.float64)
+    c2w_j = np.asarray(c2w_j, dtype=np.float64)
+    dir_i = pixels_to_dirs(p1, intrinsics) @ c2w_i[:3, :3].T
+    dir_j = pixels_to_dirs(p2, intrinsics) @ c2w_j[:3, :3].T
+
+    P = triangulate_points(c2w_i[:3, 3], dir_i, c2w_j[:3, 3], dir_j)
+
+    rp1, valid1 = reproject_points(P, c2w_i, intrinsics)
+    rp2, valid2 = reproject_points(P, c2w_j, intrinsics)
 
-        dir_i_cam = to_dir(p1)
-        dir_j_cam = to_dir(p2)
+    err = np.maximum(
+        reprojection_errors(rp1, valid1, p1),
+        reprojection_errors(rp2, valid2, p2))
 
-        dir_i = c2w_i[:3, :3] @ dir_i_cam
-        dir_j = c2w_j[:3, :3] @ dir_j_cam
+    accepted = err <= reprojection_error_pixels
+    return accepted, P, rp1, valid1, rp2, valid2
+
+def triangulate(points1, points2, c2w_i, c2w_j, matches, intrinsics, reprojection_error_pixels):
+    """
+    Triangulate and filter matches by reprojection error.
 
-        P = triangulate_point(c2w_i[:3, 3], dir_i, c2w_j[:3, 3], dir_j)
+    Args:
+        points1, points2: keypoints (list of cv2.KeyPoint) or (K, 2) arrays
+            of their pixel coordinates
+        matches: list of cv2.DMatch
 
-        rp1 = reproject_point(P, c2w_i, intrinsics)
-        rp2 = reproject_point(P, c2w_j, intrinsics)
+    Returns:
+        filtered_matches, points3d, rejected_matches
+    """
+    if len(matches) == 0: return [], [], []
 
-        err = max(
-            reprojection_error(rp1, p1),
-            reprojection_error(rp2, p2))
+    query_idx = np.array([m.queryIdx for m in matches])
+    train_idx = np.array([m.trainIdx for m in matches])
+    p1 = keypoint_coordinates(points1)[query_idx]
+    p2 = keypoint_coordinates(points2)[train_idx]
 
-        if err > reprojection_error_pixels:
-            rejected_matches.append((match, rp1, rp2))
-            continue
+    accepted, P, rp1, valid1, rp2, valid2 = triangulate_arrays(
+        p1, p2, c2w_i, c2w_j, intrinsics, reprojection_error_pixels)
 
-        filtered_matches.append(match)
-        points3d.append(P)
+    filtered_matches = [matches[k] for k in np.flatnonzero(accepted)]
+    points3d = list(P[accepted])
+    rejected_matches = [
+        (matches[k],
+         rp1[k] if valid1[k] else None,
+         rp2[k] if valid2[k] else None)
+        for k in np.flatnonzero(~accepted)
+    ]
 
     return filtered_matches, points3d, rejected_matches
 
-def generate_seed_points_match_and_triangulate(target, visualize=False, dry_run=False, reprojection_error_pixels=10):
-    json_path = os.path.join(target, "transforms.json")
+SIFT_PARAMETERS = {
+    'nfeatures': 0,
+    'nOctaveLayers': 3,
+    'contrastThreshold': 0.04,
+    'edgeThreshold': 10,
+    'sigma': 1.6
+}
+
+DEFAULT_FEATURE_CACHE_DIR = 'data/cache/features'
+
+def feature_cache_key(image_path, detector_params):
+    """Hash of the image file contents and the detector parameters"""
+    import hashlib
+    h = hashlib.sha1()
+    h.update(json.dumps(detector_params, sort_keys=True).encode('utf-8'))
+    h.update(cv2.__version__.encode('utf-8'))
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def keypoints_to_array(keypoints):
+    return np.array([
+        [kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id]
+        for kp in keypoints
+    ], dtype=np.float64).reshape(-1, 7)
+
+def array_to_keypoints(arr):
+    return [
+        cv2.KeyPoint(x, y, size, angle, response, int(octave), int(class_id))
+        for x, y, size, angle, response, octave, class_id in arr.tolist()
+    ]
+
+def extract_sift_features(image_path, cache_dir=None, detector_params=SIFT_PARAMETERS):
+    """
+    Compute SIFT keypoints and descriptors for a single image, or load them from
+    the on-disk cache. Runs in a worker process, hence arrays instead of cv2.KeyPoints.
+
+    Returns:
+        (keypoint_array (K, 7), descriptors (K, 128), was_cached)
+    """
+    cache_path = None
+    if cache_dir is not None:
+        key = feature_cache_key(image_path, detector_params)
+        cache_path = os.path.join(cache_dir, key[:2], key + '.npz')
+        if os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as d:
+                    return d['keypoints'], d['descriptors'], True
+            except (OSError, ValueError, KeyError):
+                print('warning: ignoring corrupted feature cache file %s' % cache_path)
+
+    image = cv2.imread(image_path)
+    if image is None: raise RuntimeError('could not read image %s' % image_path)
+    detector = cv2.SIFT_create(**detector_params)
+    keypoints, descriptors = detector.detectAndCompute(image, None)
+    keypoint_array = keypoints_to_array(keypoints)
+    if descriptors is None:
+        descriptors = np.zeros((0, 128), dtype=np.float32)
+
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, keypoints=keypoint_array, descriptors=descriptors)
+        os.replace(tmp_path, cache_path)
+
+    return keypoint_array, descriptors, False
+
+def find_keypoints_and_descriptors(image_paths, cache_dir=DEFAULT_FEATURE_CACHE_DIR, num_workers=None):
+    """
+    Find SIFT keypoints and descriptors for each image using a process pool
+    and a persistent feature cache (disabled if cache_dir is None).
+
+    Returns:
+        list of (keypoints, descriptors) in the order of image_paths
+    """
+    import concurrent.futures
+
+    if num_workers is None: num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(image_paths)))
+
+    if num_workers == 1:
+        results = [extract_sift_features(p, cache_dir) for p in image_paths]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(extract_sift_features, image_paths, [cache_dir] * len(image_paths)))
+
+    n_cached = sum(1 for r in results if r[2])
+    if cache_dir is not None:
+        print('features: %d/%d images from cache (%s)' % (n_cached, len(results), cache_dir))
+
+    return [(array_to_keypoints(kps), descriptors) for kps, descriptors, _ in results]
+
+PAIR_SELECTION_POLICIES = ['exhaustive', 'covisibility']
+
+def estimate_scene_depth(centers, view_dirs):
+    """
+    Rough distance from the cameras to the observed scene: the median depth
+    of the point closest to all optical axes. Falls back to the extent of the
+    camera trajectory if the axes are (nearly) parallel or the point lies
+    behind the cameras
+    """
+    A = np.zeros((3, 3))
+    b = np.zeros(3)
+    for c, d in zip(centers, view_dirs):
+        M = np.eye(3) - np.outer(d, d)
+        A += M
+        b += M @ c
+
+    fallback = max(np.max(np.linalg.norm(centers - np.mean(centers, axis=0), axis=1)), 1e-6)
+    if np.linalg.cond(A) > 1e6: return fallback
+
+    focus = np.linalg.solve(A, b)
+    depth = np.median(np.sum((focus - centers) * view_dirs, axis=1))
+    if depth <= 0: return fallback
+    return depth
+
+def plan_image_pairs(frames, intrinsics,
+        policy='covisibility',
+        k_nearest=20,
+        min_frustum_overlap=0.1,
+        min_baseline_angle_deg=0.5,
+        max_baseline_angle_deg=60,
+        scene_depth=None):
+    """
+    Select the image pairs to match using the known camera poses.
+
+    In the 'covisibility' policy, each camera is paired with its k nearest
+    cameras (by position), and the pair is kept if enough of the frustum of
+    the first camera, sampled at a few depths around the estimated scene
+    depth, is visible in the second one and the triangulation angle at the
+    frustum center is within the given window.
+
+    Returns:
+        Sorted list of (i, j) pairs with i < j
+    """
+    n = len(frames)
+    all_pairs = [(i, j) for i in range(n) for j in range(i+1, n)]
+    if policy == 'exhaustive' or n < 2: return all_pairs
+    if policy != 'covisibility': raise ValueError('Unknown pair selection policy: %s' % policy)
+
+    c2ws = np.array([f['transform_matrix'] for f in frames], dtype=np.float64)
+    centers = c2ws[:, :3, 3]
+    view_dirs = -c2ws[:, :3, 2]
+
+    w = intrinsics.get('w', 2 * intrinsics['cx'])
+    h = intrinsics.get('h', 2 * intrinsics['cy'])
+    if scene_depth is None:
+        scene_depth = estimate_scene_depth(centers, view_dirs)
+
+    # frustum sample points in camera coordinates
+    GRID = 5
+    us, vs = np.meshgrid(np.linspace(0, w, GRID), np.linspace(0, h, GRID))
+    pix = np.stack([us.ravel(), vs.ravel()], axis=1)
+    rays = np.stack([
+        (pix[:, 0] - intrinsics['cx']) / intrinsics['fl_x'],
+        -(pix[:, 1] - intrinsics['cy']) / intrinsics['fl_y'],
+        -np.ones(len(pix))
+    ], axis=1)
+    samples_cam = np.concatenate([rays * scene_depth * s for s in [0.5, 1, 2]])
+
+    dists = np.linalg.norm(centers[:, None, :] - centers[None, :, :], axis=2)
+    np.fill_diagonal(dists, np.inf)
+    k = min(k_nearest, n - 1)
+    neighbors = np.argsort(dists, axis=1)[:, :k]
+
+    min_cos = np.cos(np.radians(max_baseline_angle_deg))
+    max_cos = np.cos(np.radians(min_baseline_angle_deg))
+
+    pairs = set()
+    for i in range(n):
+        samples_w = samples_cam @ c2ws[i, :3, :3].T + centers[i]
+        frustum_center = centers[i] + view_dirs[i] * scene_depth
+        for j in neighbors[i]:
+            p_cam = (samples_w - centers[j]) @ c2ws[j, :3, :3]
+            depth = -p_cam[:, 2]
+            in_front = depth > 1e-6
+            safe_depth = np.where(in_front, depth, 1)
+            u = p_cam[:, 0] / safe_depth * intrinsics['fl_x'] + intrinsics['cx']
+            v = -p_cam[:, 1] / safe_depth * intrinsics['fl_y'] + intrinsics['cy']
+            visible = in_front & (u >= 0) & (u < w) & (v >= 0) & (v < h)
+            if np.mean(visible) < min_frustum_overlap: continue
+
+            r_i = frustum_center - centers[i]
+            r_j = frustum_center - centers[j]
+            cos_angle = np.dot(r_i, r_j) / max(np.linalg.norm(r_i) * np.linalg.norm(r_j), 1e-12)
+            if cos_angle < min_cos or cos_angle > max_cos: continue
+
+            pairs.add((min(i, j), max(i, j)))
+
+    return sorted(pairs)
+
+class UnionFind:
+    """Disjoint sets over integer ids, created lazily"""
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, x):
+        parent = self.parent
+        if x not in parent:
+            parent[x] = x
+            self.size[x] = 1
+            return x
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b: return
+        if self.size[a] < self.size[b]: a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+def build_tracks(n_keypoints, pair_matches):
+    """
+    Link pairwise matches into multi-view tracks.
+
+    Args:
+        n_keypoints: number of keypoints in each image
+        pair_matches: dict (i, j) -> (query_idx, train_idx) arrays of
+            matched keypoint indices in images i and j
+
+    Returns:
+        (obs_track, obs_image, obs_keypoint) arrays, one entry per
+        observation, sorted by track. Track ids are consecutive integers
+    """
+    offsets = np.concatenate([[0], np.cumsum(n_keypoints)]).astype(np.int64)
+    uf = UnionFind()
+    for (i, j), (query_idx, train_idx) in pair_matches.items():
+        for a, b in zip((query_idx + offsets[i]).tolist(), (train_idx + offsets[j]).tolist()):
+            uf.union(a, b)
+
+    obs = np.array(sorted(uf.parent.keys()), dtype=np.int64)
+    roots = np.array([uf.find(o) for o in obs.tolist()], dtype=np.int64)
+    _, obs_track = np.unique(roots, return_inverse=True)
+    order = np.argsort(obs_track, kind='stable')
+    obs, obs_track = obs[order], obs_track[order]
+
+    obs_image = np.searchsorted(offsets, obs, side='right') - 1
+    obs_keypoint = obs - offsets[obs_image]
+    return obs_track, obs_image, obs_keypoint
+
+def triangulate_tracks(obs_track, obs_image, obs_px, c2ws, intrinsics, reprojection_error_pixels):
+    """
+    Triangulate each track as the point closest to all of its observation
+    rays. Observations with a reprojection error above the threshold are
+    dropped and the track re-triangulated from the remaining ones.
+
+    Returns:
+        (points (T, 3), track_ok (T,) mask, obs_inlier (M,) mask)
+    """
+    n_tracks = int(obs_track.max()) + 1 if len(obs_track) > 0 else 0
+    dirs = np.einsum('nij,nj->ni', c2ws[obs_image, :3, :3], pixels_to_dirs(obs_px, intrinsics))
+    centers = c2ws[obs_image, :3, 3]
+    M = np.eye(3)[None] - dirs[:, :, None] * dirs[:, None, :]
+    Mc = np.einsum('nij,nj->ni', M, centers)
+
+    def solve(weights):
+        A = np.zeros((n_tracks, 3, 3))
+        b = np.zeros((n_tracks, 3))
+        np.add.at(A, obs_track, M * weights[:, None, None])
+        np.add.at(b, obs_track, Mc * weights[:, None])
+        ok = np.linalg.cond(A) < 1e8
+        X = np.zeros((n_tracks, 3))
+        if np.any(ok): X[ok] = np.linalg.solve(A[ok], b[ok][..., None])[..., 0]
+        return X, ok
+
+    def errors(X):
+        p_cam = np.einsum('nji,nj->ni', c2ws[obs_image, :3, :3], X[obs_track] - centers)
+        depth = -p_cam[:, 2]
+        valid = depth > 1e-6
+        safe_depth = np.where(valid, depth, 1)
+        rp = np.stack([
+            p_cam[:, 0] / safe_depth * intrinsics['fl_x'] + intrinsics['cx'],
+            -p_cam[:, 1] / safe_depth * intrinsics['fl_y'] + intrinsics['cy']
+        ], axis=1)
+        return reprojection_errors(rp, valid, obs_px)
+
+    X, ok = solve(np.ones(len(obs_track)))
+    obs_inlier = (errors(X) <= reprojection_error_pixels) & ok[obs_track]
+    X, ok = solve(obs_inlier.astype(np.float64))
+    n_inliers = np.bincount(obs_track, weights=obs_inlier, minlength=n_tracks)
+    obs_inlier &= errors(X) <= reprojection_error_pixels
+    n_final = np.bincount(obs_track, weights=obs_inlier, minlength=n_tracks)
+    track_ok = ok & (n_inliers >= 2) & (n_final == n_inliers)
+    return X, track_ok, obs_inlier & track_ok[obs_track]
+
+def voxel_downsample(xyz, rgb, voxel_size=None, max_points=None):
+    """
+    Merge points falling into the same voxel (mean position and color). If
+    voxel_size is not given, the smallest voxel size that produces at most
+    max_points points is searched for
+    """
+    if max_points is not None and max_points < 1:
+        raise ValueError('max_points must be at least 1, got %d' % max_points)
+    if len(xyz) == 0: return xyz, rgb
+
+    def downsample(size):
+        keys = np.floor((xyz - xyz.min(axis=0)) / size).astype(np.int64)
+        _, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        mean = lambda v: np.stack([
+            np.bincount(inverse, weights=v[:, c]) for c in range(v.shape[1])
+        ], axis=1) / counts[:, None]
+        return mean(xyz), np.round(mean(rgb.astype(np.float64))).astype(rgb.dtype)
+
+    if voxel_size is not None:
+        xyz, rgb = downsample(voxel_size)
+    if max_points is None or len(xyz) <= max_points: return xyz, rgb
+
+    extent = max(np.max(xyz.max(axis=0) - xyz.min(axis=0)), 1e-9)
+    lo = voxel_size if voxel_size is not None else extent * 1e-6
+    # all points fall into a single voxel at this size (at size = extent they can span 2x2x2 voxels)
+    hi = 2 * extent
+    for _ in range(30):
+        mid = np.sqrt(lo * hi)
+        if len(downsample(mid)[0]) > max_points: lo = mid
+        else: hi = mid
+        if hi / lo < 1.01: break
+    return downsample(hi)
+
+DESCRIPTOR_MATCHERS = ['bruteforce', 'flann']
+
+class BruteForceMatcher:
+    """Exhaustive L2 matching with a cross check"""
+    def __init__(self, descriptors):
+        self.descriptors = descriptors
+        self.matcher = cv2.BFMatcher(cv2.NORM_L2, crossCheck=True)
+
+    def match(self, i, j):
+        d1, d2 = self.descriptors[i], self.descriptors[j]
+        if len(d1) == 0 or len(d2) == 0: return []
+        return sorted(self.matcher.match(d1, d2), key=lambda x: x.distance)
+
+class FlannMatcher:
+    """
+    Approximate nearest neighbor matching with FLANN KD-trees. The index of
+    each image is built once and reused for all of its pairs. Matches must
+    pass the ratio test and be mutual nearest neighbors
+    """
+    def __init__(self, descriptors, ratio=0.8, trees=4, checks=64):
+        self.descriptors = [np.ascontiguousarray(d, dtype=np.float32) for d in descriptors]
+        self.ratio = ratio
+        self.trees = trees
+        self.checks = checks
+        self.indices = {}
+
+    def index(self, i):
+        if i not in self.indices:
+            FLANN_INDEX_KDTREE = 1
+            self.indices[i] = cv2.flann_Index(self.descriptors[i], dict(algorithm=FLANN_INDEX_KDTREE, trees=self.trees))
+        return self.indices[i]
+
+    def knn(self, query, train):
+        idx, dist = self.index(train).knnSearch(self.descriptors[query], 2, params=dict(checks=self.checks))
+        return idx, dist
+
+    def match(self, i, j):
+        if min(len(self.descriptors[i]), len(self.descriptors[j])) < 2: return []
+
+        # note: FLANN returns squared L2 distances
+        fwd_idx, fwd_dist = self.knn(i, j)
+        bwd_idx, _ = self.knn(j, i)
+
+        query = np.flatnonzero(fwd_dist[:, 0] < self.ratio**2 * fwd_dist[:, 1])
+        train = fwd_idx[query, 0]
+        mutual = bwd_idx[train, 0] == query
+        query, train = query[mutual], train[mutual]
+        dist = np.sqrt(fwd_dist[query, 0])
+
+        order = np.argsort(dist, kind='stable')
+        return [cv2.DMatch(int(q), int(t), float(d)) for q, t, d in zip(query[order], train[order], dist[order])]
+
+def create_descriptor_matcher(name, descriptors):
+    if name == 'bruteforce': return BruteForceMatcher(descriptors)
+    if name == 'flann': return FlannMatcher(descriptors)
+    raise ValueError('Unknown descriptor matcher: %s' % name)
+
+class SeedPointCache:
+    """
+    Features and raw descriptor matches kept in memory between seed point
+    runs on datasets that share the same images (but possibly different poses)
+    """
+    def __init__(self):
+        self.image_names = None
+        self.matcher_name = None
+        self.keypoints_and_descriptors = None
+        self.raw_matches = {}
+
+    def use(self, image_names, matcher_name):
+        if self.image_names != image_names:
+            self.image_names = image_names
+            self.keypoints_and_descriptors = None
+            self.raw_matches = {}
+        if self.matcher_name != matcher_name:
+            self.matcher_name = matcher_name
+            self.raw_matches = {}
+
+def read_seed_point_training_frames(target):
+    """Read transforms.json and select the training frames (every 8th frame is for evaluation)"""
     def is_eval_frame(i, frame):
         if i % 8 == 0:
             if 'camera_linear_velocity' in frame:
@@ -292,42 +911,207 @@ def generate_seed_points_match_and_triangulate(target, visualize=False, dry_run=
             return True
         return False
 
-    with open(json_path, 'rt') as f: transforms = json.load(f)
+    with open(os.path.join(target, "transforms.json"), 'rt') as f: transforms = json.load(f)
     training_frames = [f for i, f in enumerate(sorted(transforms['frames'], key=lambda fr: fr['file_path'])) if not is_eval_frame(i, f)]
+    return transforms, training_frames
+
+def current_memory_mb():
+    """Resident set size of this process in MB (Linux), or the peak RSS elsewhere"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        return peak_memory_mb()
+
+def peak_memory_mb():
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+class LazyImageCache:
+    """Least-recently-used cache of decoded images with a byte budget"""
+    def __init__(self, image_paths, max_bytes):
+        import collections
+        self.image_paths = image_paths
+        self.max_bytes = max_bytes
+        self.images = collections.OrderedDict()
+        self.n_bytes = 0
+        self.n_reads = 0
+
+    def get(self, i):
+        if i in self.images:
+            self.images.move_to_end(i)
+            return self.images[i]
+        image = cv2.imread(self.image_paths[i])
+        self.n_reads += 1
+        self.images[i] = image
+        self.n_bytes += image.nbytes
+        self.shrink(self.max_bytes)
+        return image
+
+    def shrink(self, max_bytes):
+        while self.n_bytes > max_bytes and len(self.images) > 1:
+            _, image = self.images.popitem(last=False)
+            self.n_bytes -= image.nbytes
+
+def generate_seed_points_streaming(target,
+        dry_run=False,
+        reprojection_error_pixels=10,
+        pair_selection='exhaustive',
+        feature_cache_dir=DEFAULT_FEATURE_CACHE_DIR,
+        num_workers=None,
+        voxel_size=None,
+        max_points=None,
+        matcher='bruteforce',
+        memory_limit_mb=4000):
+    """
+    Bounded-memory version of generate_seed_points_match_and_triangulate.
+    Only keypoint coordinates and descriptors are kept in memory, images are
+    re-read (through a small LRU cache) only for sampling point colors, and
+    triangulated points are flushed to disk after each image pair.
+    """
+    import tempfile
+
+    json_path = os.path.join(target, "transforms.json")
+    transforms, training_frames = read_seed_point_training_frames(target)
+    transforms['ply_file_path'] = './sparse_pc.ply'
+
+    image_paths = [os.path.join(target, frame['file_path']) for frame in training_frames]
+
+    print('finding keypoints and descriptors...')
+    keypoint_coords = []
+    descriptors = []
+    for kps, d in find_keypoints_and_descriptors(image_paths, cache_dir=feature_cache_dir, num_workers=num_workers):
+        keypoint_coords.append(keypoint_coordinates(kps))
+        descriptors.append(d)
+
+    n_images = len(image_paths)
+    n_all_pairs = n_images * (n_images - 1) // 2
+    pairs = plan_image_pairs(training_frames, transforms, policy=pair_selection)
+    print('streaming matches of %d/%d image pairs (%s, %s), memory limit %d MB...' % (
+        len(pairs), n_all_pairs, pair_selection, matcher, memory_limit_mb))
+    descriptor_matcher = create_descriptor_matcher(matcher, descriptors)
+
+    image_budget = max(memory_limit_mb - current_memory_mb(), 0) * 1e6 / 2
+    images = LazyImageCache(image_paths, image_budget)
+    c2ws = np.array([f['transform_matrix'] for f in training_frames], dtype=np.float64)
+
+    start_time = time.time()
+    n_points = 0
+    over_limit = False
+    with tempfile.TemporaryFile(dir=None if dry_run else target) as points_file:
+        for (i, j) in pairs:
+            matches_ij = descriptor_matcher.match(i, j)
+            if len(matches_ij) == 0: continue
+            query_idx = np.array([m.queryIdx for m in matches_ij])
+            train_idx = np.array([m.trainIdx for m in matches_ij])
+            p1 = keypoint_coords[i][query_idx]
+            accepted, P, _, _, _, _ = triangulate_arrays(
+                p1, keypoint_coords[j][train_idx],
+                c2ws[i], c2ws[j], transforms, reprojection_error_pixels)
+            if not np.any(accepted): continue
+
+            px = p1[accepted].astype(int)
+            rgb = images.get(i)[px[:, 1], px[:, 0]][:, [2, 1, 0]]
+            points_file.write(make_point_cloud(P[accepted], rgb).tobytes())
+            n_points += int(np.sum(accepted))
+
+            if current_memory_mb() > memory_limit_mb:
+                if not over_limit:
+                    print('warning: memory limit of %d MB exceeded, dropping cached images' % memory_limit_mb)
+                over_limit = True
+                images.shrink(0)
+
+        points_file.flush()
+        print('Triangulated %d points in %.1fs (%d image reads, peak memory %.0f MB)' % (
+            n_points, time.time() - start_time, images.n_reads, peak_memory_mb()))
+
+        if dry_run: return
+
+        with open(json_path, 'wt') as f:
+            json.dump(transforms, f, indent=4)
+
+        seed_ply_path = os.path.join(target, "sparse_pc.ply")
+        if voxel_size is not None or max_points is not None:
+            points = np.memmap(points_file, dtype=PLY_VERTEX_DTYPE, mode='r', shape=(n_points,)) \
+                if n_points > 0 else np.empty(0, dtype=PLY_VERTEX_DTYPE)
+            xyz = np.stack([points[c] for c in 'xyz'], axis=1).astype(np.float64)
+            rgb = np.stack([points[c] for c in ['red', 'green', 'blue']], axis=1)
+            xyz, rgb = voxel_downsample(xyz, rgb, voxel_size=voxel_size, max_points=max_points)
+            print('voxel downsampling: %d -> %d points' % (n_points, len(xyz)))
+            point_cloud_to_ply(make_point_cloud(xyz, rgb), seed_ply_path)
+        else:
+            points_file.seek(0)
+            with open(seed_ply_path, 'wb') as f:
+                f.write(ply_header(n_points))
+                shutil.copyfileobj(points_file, f)
+
+def generate_seed_points_match_and_triangulate(target,
+        visualize=False,
+        dry_run=False,
+        reprojection_error_pixels=10,
+        pair_selection='exhaustive',
+        feature_cache_dir=DEFAULT_FEATURE_CACHE_DIR,
+        num_workers=None,
+        merge_tracks=False,
+        voxel_size=None,
+        max_points=None,
+        matcher='bruteforce',
+        shared_cache=None,
+        streaming=False,
+        memory_limit_mb=4000):
+    if streaming:
+        if merge_tracks: raise ValueError('track merging is not supported in streaming mode')
+        return generate_seed_points_streaming(target,
+            dry_run=dry_run,
+            reprojection_error_pixels=reprojection_error_pixels,
+            pair_selection=pair_selection,
+            feature_cache_dir=feature_cache_dir,
+            num_workers=num_workers,
+            voxel_size=voxel_size,
+            max_points=max_points,
+            matcher=matcher,
+            memory_limit_mb=memory_limit_mb)
+
+    json_path = os.path.join(target, "transforms.json")
+    transforms, training_frames = read_seed_point_training_frames(target)
 
     transforms['ply_file_path'] = './sparse_pc.ply'
     converted_json = transforms
 
-    images = [cv2.imread(os.path.join(target, frame['file_path'])) for frame in training_frames]
+    image_paths = [os.path.join(target, frame['file_path']) for frame in training_frames]
+    images = [cv2.imread(p) for p in image_paths]
+
+    if shared_cache is None: shared_cache = SeedPointCache()
+    shared_cache.use([os.path.basename(p) for p in image_paths], matcher)
 
     # --- By ChatGPT
-    def find_keypoints_and_descriptors(images, detector):
-        """Find keypoints and descriptors for each image using the given detector."""
-        keypoints_and_descriptors = []
-        for image in images:
-            keypoints, descriptors = detector.detectAndCompute(image, None)
-            keypoints_and_descriptors.append((keypoints, descriptors))
-        return keypoints_and_descriptors
-
-    def match_descriptors_and_triangulate(descriptor_pairs, matcher, frames, intrinsics):
-        """Match descriptors between all pairs of images."""
+    def match_descriptors_and_triangulate(matcher, frames, intrinsics, pairs):
+        """Match descriptors between the given pairs of images."""
         matches = {}
-        n = len(descriptor_pairs)
-        for i in range(n):
-            for j in range(i+1, n):
-                matches_ij = matcher.match(descriptor_pairs[i][1], descriptor_pairs[j][1])
-                matches_ij = sorted(matches_ij, key=lambda x: x.distance)
-
-                c2w_i = np.array(frames[i]['transform_matrix'])
-                c2w_j = np.array(frames[j]['transform_matrix'])
-
-                matches_ij, points3d, rejected_matches = triangulate(
-                    descriptor_pairs[i][0],
-                    descriptor_pairs[j][0],
-                    c2w_i, c2w_j,
-                    matches_ij, intrinsics, reprojection_error_pixels)
-                matches[(i, j)] = (matches_ij, points3d, rejected_matches)
-
+        n_reused = 0
+        for (i, j) in pairs:
+            if (i, j) in shared_cache.raw_matches:
+                matches_ij = shared_cache.raw_matches[(i, j)]
+                n_reused += 1
+            else:
+                matches_ij = matcher.match(i, j)
+                shared_cache.raw_matches[(i, j)] = matches_ij
+
+            c2w_i = np.array(frames[i]['transform_matrix'])
+            c2w_j = np.array(frames[j]['transform_matrix'])
+
+            matches_ij, points3d, rejected_matches = triangulate(
+                keypoint_coords[i],
+                keypoint_coords[j],
+                c2w_i, c2w_j,
+                matches_ij, intrinsics, reprojection_error_pixels)
+            matches[(i, j)] = (matches_ij, points3d, rejected_matches)
+
+        if n_reused > 0:
+            print('reused descriptor matches of %d/%d image pairs' % (n_reused, len(pairs)))
         return matches
 
     def visualize_matches(images, keypoints_and_descriptors, matches, pair):
@@ -353,26 +1137,86 @@ def generate_seed_points_match_and_triangulate(target, visualize=False, dry_run=
         cv2.waitKey(0)
         cv2.destroyAllWindows()
 
-    detector = cv2.SIFT_create()
-    print('finding keypoints and descriptors...')
-    keypoints_and_descriptors = find_keypoints_and_descriptors(images, detector)
-    print('matching descriptors...')
-    #bf_matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-    bf_matcher = cv2.BFMatcher(cv2.NORM_L2, crossCheck=True)
-    matches = match_descriptors_and_triangulate(keypoints_and_descriptors, bf_matcher, training_frames, transforms)
-    if visualize:
-        visualize_matches(images, keypoints_and_descriptors, matches, (0, 1))
-
-    xyzrgbs = []
-    for i in range(len(images)):
-        for j in range(i+1, len(images)):
-            matches_ij, points, rejected_matches = matches[(i, j)]
-            for (k, match) in enumerate(matches_ij):
-                p = points[k]
-                kp1 = keypoints_and_descriptors[i][0][match.queryIdx].pt
-                color = images[i][int(kp1[1]), int(kp1[0]), [2, 1, 0]]
-                xyzrgbs.append(p.tolist() + color.tolist())
-    print('Triangulated %d points' % len(xyzrgbs))
+    if shared_cache.keypoints_and_descriptors is None:
+        print('finding keypoints and descriptors...')
+        shared_cache.keypoints_and_descriptors = find_keypoints_and_descriptors(image_paths,
+            cache_dir=feature_cache_dir,
+            num_workers=num_workers)
+    keypoints_and_descriptors = shared_cache.keypoints_and_descriptors
+    keypoint_coords = [keypoint_coordinates(kps) for kps, _ in keypoints_and_descriptors]
+    n_images = len(images)
+    n_all_pairs = n_images * (n_images - 1) // 2
+    pairs = plan_image_pairs(training_frames, transforms, policy=pair_selection)
+    print('matching descriptors in %d/%d image pairs (%s, %s)...' % (len(pairs), n_all_pairs, pair_selection, matcher))
+    descriptor_matcher = create_descriptor_matcher(matcher, [d for _, d in keypoints_and_descriptors])
+    match_start_time = time.time()
+    matches = match_descriptors_and_triangulate(descriptor_matcher, training_frames, transforms, pairs)
+    match_time = time.time() - match_start_time
+    if len(pairs) < n_all_pairs and len(pairs) > 0:
+        n_pruned = n_all_pairs - len(pairs)
+        print('pruned %d image pairs, matching took %.1fs (est. %.1fs saved)' % (
+            n_pruned, match_time, match_time / len(pairs) * n_pruned))
+    else:
+        print('matching took %.1fs' % match_time)
+    if visualize and len(pairs) > 0:
+        visualize_matches(images, keypoints_and_descriptors, matches, pairs[0])
+
+    build_start_time = time.time()
+    pair_matches = {}
+    for (i, j) in pairs:
+        matches_ij, points, rejected_matches = matches[(i, j)]
+        if len(matches_ij) == 0: continue
+        pair_matches[(i, j)] = (
+            np.array([match.queryIdx for match in matches_ij]),
+            np.array([match.trainIdx for match in matches_ij]))
+    n_pairwise_points = sum(len(q) for q, _ in pair_matches.values())
+
+    if merge_tracks:
+        obs_track, obs_image, obs_keypoint = build_tracks([len(c) for c in keypoint_coords], pair_matches)
+        obs_px = np.zeros((len(obs_track), 2))
+        for i in range(n_images):
+            sel = obs_image == i
+            obs_px[sel] = keypoint_coords[i][obs_keypoint[sel]]
+
+        c2ws = np.array([f['transform_matrix'] for f in training_frames], dtype=np.float64)
+        xyz, track_ok, obs_inlier = triangulate_tracks(
+            obs_track, obs_image, obs_px, c2ws, transforms, reprojection_error_pixels)
+
+        # mean color of the inlier observations
+        obs_rgb = np.zeros((len(obs_track), 3))
+        for i in range(n_images):
+            sel = obs_image == i
+            px = obs_px[sel].astype(int)
+            obs_rgb[sel] = images[i][px[:, 1], px[:, 0]][:, [2, 1, 0]]
+        w = obs_inlier.astype(np.float64)
+        n_obs = np.maximum(np.bincount(obs_track, weights=w, minlength=len(xyz)), 1)
+        rgb = np.stack([
+            np.bincount(obs_track, weights=obs_rgb[:, c] * w, minlength=len(xyz)) for c in range(3)
+        ], axis=1) / n_obs[:, None]
+        xyz, rgb = xyz[track_ok], np.round(rgb[track_ok]).astype(np.uint8)
+        print('merged %d pairwise points into %d tracks (%d rejected)' % (
+            n_pairwise_points, len(xyz), len(track_ok) - len(xyz)))
+    else:
+        xyzs = []
+        rgbs = []
+        for (i, j), (query_idx, _) in pair_matches.items():
+            kp1 = keypoint_coords[i][query_idx].astype(int)
+            rgbs.append(images[i][kp1[:, 1], kp1[:, 0]][:, [2, 1, 0]])
+            xyzs.append(np.array(matches[(i, j)][1]))
+        xyz = np.concatenate(xyzs) if len(xyzs) > 0 else np.zeros((0, 3))
+        rgb = np.concatenate(rgbs) if len(rgbs) > 0 else np.zeros((0, 3), dtype=np.uint8)
+
+    if voxel_size is not None or max_points is not None:
+        n_before = len(xyz)
+        xyz, rgb = voxel_downsample(xyz, rgb, voxel_size=voxel_size, max_points=max_points)
+        print('voxel downsampling: %d -> %d points' % (n_before, len(xyz)))
+
+    xyzrgbs = make_point_cloud(xyz, rgb)
+    if n_pairwise_points > 0 and len(xyzrgbs) < n_pairwise_points:
+        print('Triangulated %d points (%d pairwise, %.1fx reduction), built in %.1fs' % (
+            len(xyzrgbs), n_pairwise_points, n_pairwise_points / max(len(xyzrgbs), 1), time.time() - build_start_time))
+    else:
+        print('Triangulated %d points' % len(xyzrgbs))
 
     if not dry_run:
         with open(json_path, 'wt') as f:
@@ -381,6 +1225,66 @@ def generate_seed_points_match_and_triangulate(target, visualize=False, dry_run=
         seed_ply_path = os.path.join(target, "sparse_pc.ply")
         point_cloud_to_ply(xyzrgbs, seed_ply_path)
 
+SYNTHETIC_VARIANTS = [
+    # (dataset, raw subfolder, noisy poses, noisy intrinsics)
+    ('synthetic-posenoise', 'raw_clear', True, False),
+    ('synthetic-rs', 'raw_rs', False, False),
+    ('synthetic-mb', 'raw_mb', False, False),
+    ('synthetic-mb-posenoise', 'raw_mb', True, False),
+    ('synthetic-clear', 'raw_clear', False, False),
+    ('synthetic-mbrs', 'raw_mbrs', False, False),
+    ('synthetic-mbrs-posenoise', 'raw_mbrs', True, False),
+    ('synthetic-mbrs-pose-calib-noise', 'raw_mbrs', True, True),
+]
+
+def build_synthetic_datasets(
+        base_folder,
+        output_root,
+        variants=SYNTHETIC_VARIANTS,
+        points_only=False,
+        dry_run=False,
+        hardlink_images=False,
+        **seed_point_options):
+    """
+    Build several dataset variants in one pass over the raw scenes. Each raw
+    subfolder is read and converted once, and features and descriptor matches
+    are shared between the variants that use the same images.
+
+    Args:
+        variants: list of (dataset, raw subfolder, noisy poses, noisy intrinsics)
+    """
+    items = os.listdir(base_folder)
+    directories = sorted([item for item in items if os.path.isdir(os.path.join(base_folder, item))])
+
+    subfolders = []
+    for _, subfolder, _, _ in variants:
+        if subfolder not in subfolders: subfolders.append(subfolder)
+
+    for directory in directories:
+        print(directory)
+        for subfolder in subfolders:
+            full_path = os.path.join(base_folder, directory, subfolder)
+            if not os.path.exists(full_path): continue
+
+            converted = None
+            seed_point_cache = SeedPointCache()
+            for dataset, variant_subfolder, noisy_poses, noisy_intrinsics in variants:
+                if variant_subfolder != subfolder: continue
+                out_path = os.path.join(output_root, dataset, directory)
+                if not points_only and not dry_run:
+                    if converted is None:
+                        converted = convert_synthetic_frames(full_path)
+                    process(full_path, out_path,
+                        noisy_poses=noisy_poses,
+                        noisy_intrinsics=noisy_intrinsics,
+                        hardlink_images=hardlink_images,
+                        num_workers=seed_point_options.get('num_workers'),
+                        converted=converted)
+                if os.path.exists(out_path):
+                    generate_seed_points_match_and_triangulate(out_path,
+                        shared_cache=seed_point_cache,
+                        **seed_point_options)
+
 def process_dataset_folder(
         base_folder, 
         output_folder,
@@ -389,19 +1293,15 @@ def process_dataset_folder(
         noisy_poses=False,
         noisy_intrinsics=False,
         dry_run=False,
-        visualize=False):
-    items = os.listdir(base_folder)
-    directories = sorted([item for item in items if os.path.isdir(os.path.join(base_folder, item))])
-
-    for directory in directories:
-        print(directory)
-        full_path = os.path.join(base_folder, directory, subfolder)
-        if not os.path.exists(full_path): continue
-        out_path = os.path.join(output_folder, directory)
-        if not points_only and not dry_run:
-            process(full_path, out_path, noisy_poses=noisy_poses, noisy_intrinsics=noisy_intrinsics)
-        if os.path.exists(out_path):
-            generate_seed_points_match_and_triangulate(out_path, visualize=visualize)
+        hardlink_images=False,
+        **seed_point_options):
+    output_root, dataset = os.path.split(os.path.normpath(output_folder))
+    build_synthetic_datasets(base_folder, output_root,
+        variants=[(dataset, subfolder, noisy_poses, noisy_intrinsics)],
+        points_only=points_only,
+        dry_run=dry_run,
+        hardlink_images=hardlink_images,
+        **seed_point_options)
 
 if __name__ == '__main__':
     import argparse
@@ -409,57 +1309,35 @@ if __name__ == '__main__':
     parser.add_argument('--dry_run', action='store_true')
     parser.add_argument('--points_only', action='store_true')
     parser.add_argument('--visualize', action='store_true')
+    parser.add_argument('--variants', nargs='+', default=None,
+                        choices=[v[0] for v in SYNTHETIC_VARIANTS],
+                        help='Only build these datasets (default: all)')
+    parser.add_argument('--pair_selection', choices=PAIR_SELECTION_POLICIES, default='exhaustive',
+                        help='Which image pairs to match when generating seed points')
+    parser.add_argument('--feature_cache_dir', type=str, default=DEFAULT_FEATURE_CACHE_DIR)
+    parser.add_argument('--no_feature_cache', dest='feature_cache_dir', action='store_const', const=None)
+    parser.add_argument('--num_workers', type=int, default=None,
+                        help='Parallel workers for frame conversion and feature extraction')
+    parser.add_argument('--matcher', choices=DESCRIPTOR_MATCHERS, default='bruteforce',
+                        help='Descriptor matching backend for seed points')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Bounded-memory seed point generation (images re-read lazily, points flushed per pair)')
+    parser.add_argument('--memory_limit_mb', type=int, default=4000,
+                        help='Memory ceiling in --streaming mode')
+    parser.add_argument('--hardlink_images', action='store_true',
+                        help='Hardlink unmodified images to the output folder instead of copying')
+    parser.add_argument('--merge_tracks', action='store_true',
+                        help='Merge pairwise matches into multi-view tracks before triangulation')
+    parser.add_argument('--voxel_size', type=float, default=None,
+                        help='Merge seed points within voxels of this size')
+    parser.add_argument('--max_points', type=int, default=None,
+                        help='Voxel-downsample the seed point cloud to at most this many points')
     args = parser.parse_args()
 
-    process_dataset_folder(
-        'data/inputs-raw/synthetic-raw',
-        'data/inputs-processed/synthetic-posenoise',
-        subfolder='raw_clear',
-        noisy_poses=True,
-        **vars(args))
-
-    process_dataset_folder(
-        'data/inputs-raw/synthetic-raw',
-        'data/inputs-processed/synthetic-rs',
-        subfolder='raw_rs',
-        **vars(args))
-
-    process_dataset_folder(
-        'data/inputs-raw/synthetic-raw',
-        'data/inputs-processed/synthetic-mb',
-        subfolder='raw_mb',
-        **vars(args))
-
-    process_dataset_folder(
+    variant_names = args.variants
+    del args.variants
+    build_synthetic_datasets(
         'data/inputs-raw/synthetic-raw',
-        'data/inputs-processed/synthetic-mb-posenoise',
-        subfolder='raw_mb',
-        noisy_poses=True,
+        'data/inputs-processed',
+        variants=[v for v in SYNTHETIC_VARIANTS if variant_names is None or v[0] in variant_names],
         **vars(args))
-
-    process_dataset_folder(
-        'data/inputs-raw/synthetic-raw',
-        'data/inputs-processed/synthetic-clear',
-        subfolder='raw_clear',
-        **vars(args))
-
-    process_dataset_folder(
-        'data/inputs-raw/synthetic-raw',
-        'data/inputs-processed/synthetic-mbrs',
-        subfolder='raw_mbrs',
-        **vars(args))
-
-    process_dataset_folder(
-        'data/inputs-raw/synthetic-raw',
-        'data/inputs-processed/synthetic-mbrs-posenoise',
-        subfolder='raw_mbrs',
-        noisy_poses=True,
-        **vars(args))
-
-    process_dataset_folder(
-        'data/inputs-raw/synthetic-raw',
-        'data/inputs-processed/synthetic-mbrs-pose-calib-noise',
-        subfolder='raw_mbrs',
-        noisy_poses=True,
-        noisy_intrinsics=True,
-        **vars(args))
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Renders stored in a few preallocated, memory-mapped arrays instead of one
+file per image (render_model.py --output_format archive).
+
+An archive folder contains index.json (image names, array names, model
+fingerprint) and one .npy file per array: uint8 RGB stacks (pred, gt),
+float16 or float32 depth stacks in meters (depth, gt_depth), the size of
+each image and a flag for each image that has been written. Arrays have the
+shape (n_images, max_height, max_width, ...) and smaller images are stored
+in the top-left corner.
+
+Usage for analysis:
+
+    archive = RenderArchive('.../renders')
+    pred = archive['pred'] # memory-mapped, nothing is read yet
+    im = archive.image('gt', 'frame_00012') # zero-copy view
+"""
+import os
+import json
+import threading
+
+import numpy as np
+
+INDEX_FILE = 'index.json'
+SIZES = 'sizes'
+WRITTEN = 'written'
+RGB_ARRAYS = ['pred', 'gt']
+
+def array_path(folder, name):
+    return os.path.join(folder, name + '.npy')
+
+def read_index(folder):
+    path = os.path.join(folder, INDEX_FILE)
+    if not os.path.exists(path): return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+def is_complete(folder, fingerprint):
+    """All images have been written from the model with this fingerprint"""
+    index = read_index(folder)
+    if index is None or index['fingerprint'] != fingerprint: return False
+    return bool(np.all(np.load(array_path(folder, WRITTEN), mmap_mode='r')))
+
+class ArchiveWriter:
+    """
+    Streams rendered images into the memory-mapped arrays of an archive.
+
+    Arrays are created on the first write that contains them. With resume,
+    an existing archive of the same images, sizes and fingerprint is opened
+    for writing and the images already written in it can be skipped.
+    """
+    def __init__(self, folder, names, max_height, max_width, depth_dtype='float16', fingerprint=None, resume=False):
+        self.folder = folder
+        self.names = list(names)
+        self.shape = (len(self.names), max_height, max_width)
+        self.depth_dtype = depth_dtype
+        self.index = {
+            'names': self.names,
+            'shape': list(self.shape),
+            'depth_dtype': depth_dtype,
+            'depth_unit': 'm',
+            'fingerprint': fingerprint,
+            'arrays': []
+        }
+        self.arrays = {}
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+        previous = read_index(folder) if resume else None
+        if previous is not None and all(previous[k] == self.index[k] for k in ['names', 'shape', 'depth_dtype', 'fingerprint']):
+            self.index['arrays'] = previous['arrays']
+            for name in self.index['arrays'] + [SIZES, WRITTEN]:
+                self.arrays[name] = np.load(array_path(folder, name), mmap_mode='r+')
+        else:
+            self.arrays[SIZES] = self.create(SIZES, np.int32, (len(self.names), 2))
+            self.arrays[WRITTEN] = self.create(WRITTEN, np.bool_, (len(self.names),))
+            self.save_index()
+
+    def create(self, name, dtype, shape):
+        return np.lib.format.open_memmap(array_path(self.folder, name), mode='w+', dtype=dtype, shape=shape)
+
+    def save_index(self):
+        path = os.path.join(self.folder, INDEX_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def array(self, name, sample):
+        with self.lock:
+            if name not in self.arrays:
+                dtype = np.uint8 if name in RGB_ARRAYS else self.depth_dtype
+                self.arrays[name] = self.create(name, dtype, self.shape + sample.shape[2:])
+                self.index['arrays'].append(name)
+                self.save_index()
+            return self.arrays[name]
+
+    def is_written(self, index):
+        return bool(self.arrays[WRITTEN][index])
+
+    def write(self, index, images):
+        """
+        Args:
+            index: image index in names
+            images: dict array name -> numpy array (height, width, ...)
+        """
+        height, width = next(iter(images.values())).shape[:2]
+        for name, image in images.items():
+            self.array(name, image)[index, :height, :width] = image
+        self.arrays[SIZES][index] = (height, width)
+        self.arrays[WRITTEN][index] = True
+
+    def close(self):
+        for a in self.arrays.values():
+            a.flush()
+        self.arrays = {}
+
+class RenderArchive:
+    """Read-only, memory-mapped access to an archive written by ArchiveWriter"""
+    def __init__(self, folder):
+        self.folder = folder
+        self.index = read_index(folder)
+        if self.index is None:
+            raise FileNotFoundError('no render archive in %s' % folder)
+        self.names = self.index['names']
+        self.name_to_index = { name: i for i, name in enumerate(self.names) }
+        self.sizes = np.load(array_path(folder, SIZES), mmap_mode='r')
+        self.written = np.load(array_path(folder, WRITTEN), mmap_mode='r')
+        self.arrays = { name: np.load(array_path(folder, name), mmap_mode='r') for name in self.index['arrays'] }
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, name):
+        """The whole (n_images, max_height, max_width, ...) array"""
+        return self.arrays[name]
+
+    def keys(self):
+        return list(self.arrays.keys())
+
+    def image(self, name, image):
+        """One image (by index or name) without padding, as a view of the memory-mapped array"""
+        i = self.name_to_index[image] if isinstance(image, str) else image
+        height, width = self.sizes[i]
+        return self.arrays[name][i, :height, :width]
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('folder')
+    parser.add_argument('--extract', type=str, default=None, help='write the images as PNG files to this folder')
+    args = parser.parse_args()
+
+    archive = RenderArchive(args.folder)
+    print('%d images (%d written), arrays:' % (len(archive), int(np.sum(archive.written))))
+    for name in archive.keys():
+        a = archive[name]
+        print('  %s %s %s' % (name, str(a.dtype), 'x'.join(str(d) for d in a.shape)))
+
+    if args.extract is not None:
+        from PIL import Image
+        for name in RGB_ARRAYS:
+            if name not in archive.arrays: continue
+            os.makedirs(os.path.join(args.extract, name), exist_ok=True)
+            for i, image_name in enumerate(archive.names):
+                if not archive.written[i]: continue
+                Image.fromarray(np.asarray(archive.image(name, i))).save(os.path.join(args.extract, name, image_name + '.png'))
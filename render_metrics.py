@@ -0,0 +1,151 @@
+"""
+Per-image quality metrics computed from the rendered images while they are
+on the GPU (render_model.py --compute_metrics), so that the renders need not
+be decoded again for analysis.
+
+PSNR, SSIM and LPIPS use the metric modules of the Splatfacto model, i.e.,
+the same definitions as ns-eval. If the dataset has masks, masked variants
+are computed too: PSNR of the masked pixels, the SSIM map averaged over the
+mask and LPIPS of the masked images.
+"""
+import os
+import csv
+import json
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+PER_IMAGE_FILE = 'metrics_per_image'
+SUMMARY_FILE = 'metrics_summary.json'
+
+def to_bchw(image):
+    return torch.moveaxis(image, -1, 0)[None, ...]
+
+def masked_psnr(pred, gt, mask):
+    mse = torch.sum((pred - gt)**2 * mask) / (torch.sum(mask) * pred.shape[1])
+    return -10 * torch.log10(mse)
+
+def ssim_map(pred, gt, window_size=11, sigma=1.5, c1=0.01**2, c2=0.03**2):
+    """SSIM of each pixel with a Gaussian window, without padding (data range 1)"""
+    coords = torch.arange(window_size, dtype=pred.dtype, device=pred.device) - window_size // 2
+    g = torch.exp(-coords**2 / (2 * sigma**2))
+    g = g / torch.sum(g)
+    channels = pred.shape[1]
+    window = (g[:, None] * g[None, :]).expand(channels, 1, window_size, window_size)
+
+    def blur(x):
+        return F.conv2d(x, window, groups=channels)
+
+    mu_p, mu_g = blur(pred), blur(gt)
+    var_p = blur(pred * pred) - mu_p**2
+    var_g = blur(gt * gt) - mu_g**2
+    cov = blur(pred * gt) - mu_p * mu_g
+    return ((2 * mu_p * mu_g + c1) * (2 * cov + c2)) / ((mu_p**2 + mu_g**2 + c1) * (var_p + var_g + c2))
+
+def masked_ssim(pred, gt, mask, window_size=11):
+    ssim = ssim_map(pred, gt, window_size)
+    r = window_size // 2
+    mask = mask[..., r:-r, r:-r]
+    return torch.sum(ssim * mask) / (torch.sum(mask) * ssim.shape[1])
+
+def read_per_image(output_dir):
+    path = os.path.join(output_dir, PER_IMAGE_FILE + '.json')
+    if not os.path.exists(path): return {}
+    with open(path) as f:
+        return json.load(f)
+
+def has_metrics(result, lpips):
+    return result is not None and (not lpips or 'lpips' in result)
+
+def is_complete(output_dir, image_names, lpips=False):
+    """Metrics of all these images were written by a previous run"""
+    results = read_per_image(output_dir)
+    return all(has_metrics(results.get(name), lpips) for name in image_names)
+
+class ImageMetrics:
+    """
+    Accumulates per-image metrics. LPIPS is evaluated in batches of
+    lpips_batch_size images of the same size. With keep_previous, the
+    results of images that are not re-rendered are kept from the previous
+    per-image metrics file
+    """
+    def __init__(self, model, output_dir, lpips=False, lpips_batch_size=4, keep_previous=False):
+        self.model = model
+        self.output_dir = output_dir
+        self.lpips = lpips
+        self.lpips_batch_size = lpips_batch_size
+        self.lpips_queue = [] # (image_name, metric, gt, pred)
+        self.results = read_per_image(output_dir) if keep_previous else {}
+
+    def has(self, image_name):
+        return has_metrics(self.results.get(image_name), self.lpips)
+
+    def add(self, image_name, outputs, data):
+        model = self.model
+        gt = to_bchw(model.composite_with_background(model.get_gt_img(data["image"]), outputs["background"]))
+        pred = to_bchw(outputs["rgb"])
+
+        result = {
+            'psnr': float(model.psnr(gt, pred)),
+            'ssim': float(model.ssim(gt, pred))
+        }
+        lpips_inputs = [('lpips', gt, pred)]
+        if "mask" in data:
+            mask = to_bchw(data["mask"].to(pred.device).float())
+            result['mask_fraction'] = float(torch.mean(mask))
+            result['psnr_masked'] = float(masked_psnr(pred, gt, mask))
+            result['ssim_masked'] = float(masked_ssim(pred, gt, mask))
+            lpips_inputs.append(('lpips_masked', gt * mask, pred * mask))
+        self.results[image_name] = result
+
+        if self.lpips:
+            for metric, a, b in lpips_inputs:
+                if len(self.lpips_queue) > 0 and self.lpips_queue[0][2].shape != a.shape:
+                    self.flush_lpips()
+                self.lpips_queue.append((image_name, metric, a, b))
+            if len(self.lpips_queue) >= self.lpips_batch_size:
+                self.flush_lpips()
+
+    def flush_lpips(self):
+        if len(self.lpips_queue) == 0: return
+        lpips = self.model.lpips
+        gt = torch.cat([q[2] for q in self.lpips_queue])
+        pred = torch.cat([q[3] for q in self.lpips_queue])
+        # per-image values (the metric module itself averages over the batch)
+        values = lpips.net(gt, pred, normalize=lpips.normalize).reshape(-1)
+        for (image_name, metric, _, _), value in zip(self.lpips_queue, values.tolist()):
+            self.results[image_name][metric] = value
+        self.lpips_queue = []
+
+    def summary(self):
+        summary = { 'images': len(self.results) }
+        metrics = sorted(set(k for r in self.results.values() for k in r))
+        for metric in metrics:
+            values = np.array([r[metric] for r in self.results.values() if metric in r])
+            summary[metric] = {
+                'mean': float(np.mean(values)),
+                'std': float(np.std(values)),
+                'min': float(np.min(values)),
+                'max': float(np.max(values))
+            }
+        return summary
+
+    def write(self):
+        """Write the per-image metrics as JSON and CSV and their summary to the output folder"""
+        self.flush_lpips()
+        with open(os.path.join(self.output_dir, PER_IMAGE_FILE + '.json'), 'w') as f:
+            json.dump(self.results, f, indent=4)
+
+        columns = sorted(set(k for r in self.results.values() for k in r))
+        with open(os.path.join(self.output_dir, PER_IMAGE_FILE + '.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['image'] + columns)
+            for image_name in sorted(self.results):
+                r = self.results[image_name]
+                writer.writerow([image_name] + [r.get(c, '') for c in columns])
+
+        summary = self.summary()
+        with open(os.path.join(self.output_dir, SUMMARY_FILE), 'w') as f:
+            json.dump(summary, f, indent=4)
+        return summary
@@ -7,6 +7,10 @@ import tyro
 import os
 import numpy as np
 import shutil
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from nerfstudio.cameras.cameras import Cameras
 from nerfstudio.models.splatfacto import SplatfactoModel
@@ -16,7 +20,28 @@ from nerfstudio.data.datasets.base_dataset import InputDataset
 from PIL import Image
 from torch import Tensor
 
-from typing import List, Literal, Optional, Union
+import cache_manifest
+import render_archive
+import render_metrics
+
+from typing import Callable, List, Literal, Optional, Tuple
+
+# PIL default. 0-1 are several times faster to encode, at the cost of larger files
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+
+def image_to_numpy(image) -> np.ndarray:
+    """Copy an image to the CPU as uint8 (numpy, Tensor in [0, 1])"""
+    if image.shape[-1] == 1 and torch.is_tensor(image):
+        image = image.repeat(1, 1, 3)
+    if torch.is_tensor(image):
+        image = image.detach().cpu().numpy() * 255
+        image = image.astype(np.uint8)
+    return image
+
+def write_img(image: np.ndarray, image_path, png_compress_level=DEFAULT_PNG_COMPRESS_LEVEL) -> None:
+    """Encode and write an uint8 image (see image_to_numpy)"""
+    os.makedirs(os.path.dirname(image_path), exist_ok=True)
+    Image.fromarray(image).save(image_path, compress_level=png_compress_level)
 
 def save_img(image, image_path, verbose=True) -> None:
     """helper to save images
@@ -29,22 +54,28 @@ def save_img(image, image_path, verbose=True) -> None:
     Returns:
         None
     """
-    if image.shape[-1] == 1 and torch.is_tensor(image):
-        image = image.repeat(1, 1, 3)
-    if torch.is_tensor(image):
-        image = image.detach().cpu().numpy() * 255
-        image = image.astype(np.uint8)
-    if not Path(os.path.dirname(image_path)).exists():
-        Path(os.path.dirname(image_path)).mkdir(parents=True)
-    im = Image.fromarray(image)
+    image = image_to_numpy(image)
     if verbose:
         print("saving to: ", image_path)
-    im.save(image_path)
+    write_img(image, image_path)
 
 # Depth Scale Factor m to mm
 SCALE_FACTOR = 0.001
 SAVE_RAW_DEPTH = False
 
+def depth_to_numpy(depth, scale_factor=SCALE_FACTOR) -> np.ndarray:
+    """Copy a metric depth map to the CPU (numpy, Tensor)"""
+    if torch.is_tensor(depth):
+        depth = depth.float() / scale_factor
+        depth = depth.detach().cpu().numpy()
+    else:
+        depth = depth / scale_factor
+    return depth
+
+def write_depth(depth: np.ndarray, depth_path) -> None:
+    os.makedirs(os.path.dirname(depth_path), exist_ok=True)
+    np.save(depth_path, depth)
+
 def save_depth(depth, depth_path, verbose=True, scale_factor=SCALE_FACTOR) -> None:
     """helper to save metric depths
 
@@ -57,16 +88,106 @@ def save_depth(depth, depth_path, verbose=True, scale_factor=SCALE_FACTOR) -> No
     Returns:
         None
     """
-    if torch.is_tensor(depth):
-        depth = depth.float() / scale_factor
-        depth = depth.detach().cpu().numpy()
-    else:
-        depth = depth / scale_factor
-    if not Path(os.path.dirname(depth_path)).exists():
-        Path(os.path.dirname(depth_path)).mkdir(parents=True)
+    depth = depth_to_numpy(depth, scale_factor)
     if verbose:
         print("saving to: ", depth_path)
-    np.save(depth_path, depth)
+    write_depth(depth, depth_path)
+
+def output_files(
+    rgb_out: Optional[Tensor],
+    gt_img: Optional[Tensor],
+    depth_color: Optional[Tensor],
+    depth_gt_color: Optional[Tensor],
+    depth_gt: Optional[Tensor],
+    depth: Optional[Tensor],
+    normal_gt: Optional[Tensor],
+    normal: Optional[Tensor],
+    render_output_path: Path,
+    image_name: Optional[str],
+) -> List[Tuple[str, str, np.ndarray]]:
+    """Copy the outputs written by save_outputs_helper to the CPU
+
+    Returns:
+        list of (kind, path, array), where kind is "image" or "depth"
+    """
+    if image_name is None:
+        image_name = ""
+
+    prefix = os.path.join(os.getcwd(), render_output_path)
+    files = []
+    if rgb_out is not None and gt_img is not None:
+        # easier consecutive compare
+        files.append(("image", f"{prefix}/{image_name}_pred.png", image_to_numpy(rgb_out)))
+        files.append(("image", f"{prefix}/{image_name}_gt.png", image_to_numpy(gt_img)))
+
+    if depth_color is not None:
+        files.append(("image", f"{prefix}/pred/depth/colorised/{image_name}.png", image_to_numpy(depth_color)))
+    if depth_gt_color is not None:
+        files.append(("image", f"{prefix}/gt/depth/colorised/{image_name}.png", image_to_numpy(depth_gt_color)))
+    if depth_gt is not None:
+        # save metric depths
+        files.append(("depth", f"{prefix}/gt/depth/raw/{image_name}.npy", depth_to_numpy(depth_gt)))
+
+    if SAVE_RAW_DEPTH:
+        if depth is not None:
+            files.append(("depth", f"{prefix}/pred/depth/raw/{image_name}.npy", depth_to_numpy(depth)))
+
+    # normals in [-1, 1]
+    if normal is not None:
+        files.append(("image", f"{prefix}/pred/normal/{image_name}.png", image_to_numpy((normal + 1) / 2)))
+    if normal_gt is not None:
+        files.append(("image", f"{prefix}/gt/normal/{image_name}.png", image_to_numpy((normal_gt + 1) / 2)))
+
+    return files
+
+def write_files(files, png_compress_level=DEFAULT_PNG_COMPRESS_LEVEL) -> None:
+    for kind, path, array in files:
+        if kind == "image":
+            write_img(array, path, png_compress_level)
+        else:
+            write_depth(array, path)
+
+class ImageWriter:
+    """Encode and write the outputs of rendered images in background threads,
+    while the next image is being rendered.
+
+    PIL releases the GIL while compressing PNGs, so threads encode in parallel.
+    At most max_pending images are queued: submit blocks when the writers fall
+    behind, which bounds the memory use.
+    """
+    def __init__(self, num_threads=4, max_pending=8, png_compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
+        self.png_compress_level = png_compress_level
+        self.pool = ThreadPoolExecutor(max_workers=num_threads)
+        self.pending = threading.Semaphore(max_pending)
+        self.lock = threading.Lock()
+        self.encode_times = {}
+        self.error = None
+
+    def write(self, image_name, files, on_written):
+        try:
+            start_time = time.time()
+            write_files(files, self.png_compress_level)
+            with self.lock:
+                self.encode_times[image_name] = time.time() - start_time
+            if on_written is not None:
+                on_written(files)
+        except BaseException as e:
+            with self.lock:
+                self.error = e
+        finally:
+            self.pending.release()
+
+    def submit(self, image_name, files, on_written: Optional[Callable] = None) -> None:
+        if self.error is not None:
+            raise self.error
+        self.pending.acquire()
+        self.pool.submit(self.write, image_name, files, on_written)
+
+    def close(self) -> None:
+        """Wait for all queued images to be written"""
+        self.pool.shutdown(wait=True)
+        if self.error is not None:
+            raise self.error
 
 def save_outputs_helper(
     rgb_out: Optional[Tensor],
@@ -79,6 +200,8 @@ def save_outputs_helper(
     normal: Optional[Tensor],
     render_output_path: Path,
     image_name: Optional[str],
+    writer: Optional[ImageWriter] = None,
+    on_written: Optional[Callable] = None,
 ) -> None:
     """Helper to save model rgb/depth/gt outputs to disk
 
@@ -91,60 +214,191 @@ def save_outputs_helper(
         depth: depth map
         render_output_path: save directory path
         image_name: stem of save name
+        writer: write in the background with this ImageWriter instead of here
+        on_written: called with the output_files list once they are written
 
     Returns:
         None
     """
-    if image_name is None:
-        image_name = ""
+    files = output_files(rgb_out, gt_img, depth_color, depth_gt_color, depth_gt, depth,
+        normal_gt, normal, render_output_path, image_name)
+    if writer is None:
+        write_files(files)
+        if on_written is not None:
+            on_written(files)
+    else:
+        writer.submit(image_name, files, on_written)
 
-    if rgb_out is not None and gt_img is not None:
-        # easier consecutive compare
-        save_img(rgb_out, os.getcwd() + f"/{render_output_path}/{image_name}_pred.png", False)
-        save_img(gt_img, os.getcwd() + f"/{render_output_path}/{image_name}_gt.png", False)
+def prepare_outputs(outputs, data) -> tuple:
+    """Match the model outputs for one camera with the ground truth data and apply the mask
 
-    if depth_color is not None:
-        save_img(
-            depth_color,
-            os.getcwd()
-            + f"/{render_output_path}/pred/depth/colorised/{image_name}.png",
-            False,
-        )
-    if depth_gt_color is not None:
-        save_img(
-            depth_gt_color,
-            os.getcwd() + f"/{render_output_path}/gt/depth/colorised/{image_name}.png",
-            False,
+    Args:
+        outputs: model outputs (get_outputs_for_camera)
+        data: ground truth data (cached image data or eval batch)
+
+    Returns:
+        rgb_out, gt_img, depth_color, depth_gt_color, depth_gt, depth, normal_gt,
+        normal (the first arguments of save_outputs_helper)
+    """
+    # process batch gt data
+    mask = None
+    if "mask" in data:
+        mask = data["mask"]
+
+    gt_img = 256 - data["image"] # not sure why negative
+    if "sensor_depth" in data:
+        depth_gt = data["sensor_depth"]
+        depth_gt_color = colormaps.apply_depth_colormap(
+            data["sensor_depth"]
         )
+    else:
+        depth_gt = None
+        depth_gt_color = None
+    if "normal" in data:
+        normal_gt = data["normal"]
+    else:
+        normal_gt = None
+
+    rgb_out, depth_out = outputs["rgb"], outputs["depth"]
+
+    normal = None
+    if "normal" in outputs:
+        normal = outputs["normal"]
+
+    depth_color = colormaps.apply_depth_colormap(depth_out)
+    depth = depth_out.detach().cpu().numpy()
+
+    if mask is not None:
+        rgb_out = rgb_out * mask
+        gt_img = gt_img * mask
+        if depth_color is not None:
+            depth_color = depth_color * mask
+        if depth_gt_color is not None:
+            depth_gt_color = depth_gt_color * mask
+        if depth_gt is not None:
+            depth_gt = depth_gt * mask
+        if depth is not None:
+            depth = depth * mask
+        if normal_gt is not None:
+            normal_gt = normal_gt * mask
+        if normal is not None:
+            normal = normal * mask
+
+    return rgb_out, gt_img, depth_color, depth_gt_color, depth_gt, depth, normal_gt, normal
+
+def save_outputs(
+    outputs,
+    data,
+    render_output_path: Path,
+    image_name: str,
+    writer: Optional[ImageWriter] = None,
+    on_written: Optional[Callable] = None,
+) -> None:
+    """Save the model outputs for one camera and the matching ground truth data
+
+    Args:
+        outputs: model outputs (get_outputs_for_camera)
+        data: ground truth data (cached image data or eval batch)
+        render_output_path: save directory path
+        image_name: stem of save name
+        writer, on_written: see save_outputs_helper
+
+    Returns:
+        None
+    """
+    save_outputs_helper(*prepare_outputs(outputs, data), render_output_path, image_name, writer, on_written)
+
+def archive_images(outputs, data) -> dict:
+    """The outputs stored by render_archive.ArchiveWriter, copied to the CPU
+
+    Returns:
+        dict: pred and gt uint8 RGB images, depth and gt_depth (if any) in meters
+    """
+    rgb_out, gt_img, _, _, depth_gt, depth, _, _ = prepare_outputs(outputs, data)
+    images = { 'pred': image_to_numpy(rgb_out), 'gt': image_to_numpy(gt_img) }
+    if depth is not None:
+        images['depth'] = depth_to_numpy(depth, scale_factor=1)[..., 0]
     if depth_gt is not None:
-        # save metric depths
-        save_depth(
-            depth_gt,
-            os.getcwd() + f"/{render_output_path}/gt/depth/raw/{image_name}.npy",
-            False,
-        )
+        images['gt_depth'] = depth_to_numpy(depth_gt, scale_factor=1)[..., 0]
+    return images
 
-    if SAVE_RAW_DEPTH:
-        if depth is not None:
-            save_depth(
-                depth,
-                os.getcwd() + f"/{render_output_path}/pred/depth/raw/{image_name}.npy",
-                False,
-            )
+RENDER_MANIFEST_FILE = 'render_manifest.json'
 
-    if normal is not None:
-        save_normal(
-            normal,
-            os.getcwd() + f"/{render_output_path}/pred/normal/{image_name}.png",
-            verbose=False,
-        )
+class RenderManifest:
+    """Files rendered for each camera, with the fingerprint of the model and
+    camera they were rendered from, so that up-to-date outputs can be kept.
 
-    if normal_gt is not None:
-        save_normal(
-            normal_gt,
-            os.getcwd() + f"/{render_output_path}/gt/normal/{image_name}.png",
-            verbose=False,
-        )
+    Written to the output folder every save_interval images, so an
+    interrupted render job loses at most the last few images.
+    """
+    def __init__(self, output_dir, model_fingerprint, save_interval=10):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, RENDER_MANIFEST_FILE)
+        self.model_fingerprint = model_fingerprint
+        self.save_interval = save_interval
+        self.images = {}
+        self.complete_sets = []
+        self.n_unsaved = 0
+        self.lock = threading.Lock()
+
+        manifest = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    manifest = json.load(f)
+            except ValueError:
+                pass
+        # all renders are stale if the model changed
+        if manifest.get('model') == model_fingerprint:
+            self.images = manifest['images']
+            self.complete_sets = manifest.get('complete_sets', [])
+
+    def image_fingerprint(self, set_name, camera_index, image_name):
+        return cache_manifest.hash_json([self.model_fingerprint, set_name, camera_index, image_name, SAVE_RAW_DEPTH])
+
+    def files_exist(self, image_name):
+        return all(os.path.exists(os.path.join(self.output_dir, f)) for f in self.images[image_name]['files'])
+
+    def is_up_to_date(self, image_name, fingerprint):
+        entry = self.images.get(image_name)
+        return entry is not None and entry['fingerprint'] == fingerprint and self.files_exist(image_name)
+
+    def is_complete(self, set_name):
+        """All images of the set were rendered from this model and are still on disk"""
+        return set_name in self.complete_sets and all(self.files_exist(name) for name in self.images)
+
+    def record(self, image_name, camera_index, fingerprint, files):
+        output_dir = os.path.abspath(self.output_dir)
+        with self.lock:
+            self.images[image_name] = {
+                'camera_index': camera_index,
+                'fingerprint': fingerprint,
+                'files': [os.path.relpath(path, output_dir) for _, path, _ in files]
+            }
+            self.n_unsaved += 1
+            if self.n_unsaved >= self.save_interval:
+                self.save_locked()
+
+    def mark_complete(self, set_name):
+        with self.lock:
+            if set_name not in self.complete_sets:
+                self.complete_sets.append(set_name)
+            self.save_locked()
+
+    def save(self):
+        with self.lock:
+            self.save_locked()
+
+    def save_locked(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'model': self.model_fingerprint,
+                'complete_sets': self.complete_sets,
+                'images': self.images
+            }, f, indent=4)
+        os.replace(tmp_path, self.path)
+        self.n_unsaved = 0
 
 @dataclass
 class RenderModel:
@@ -154,110 +408,227 @@ class RenderModel:
     """Path to the config YAML file."""
     output_dir: Path = Path("./data/renders/")
     """Path to the output directory."""
-    set: Literal["train", "eval"] = "eval"
-    """Dataset to test with (train or eval)"""
+    set: Literal["train", "eval", "both"] = "eval"
+    """Dataset to test with (train or eval). both: render both with one model load, to train and eval subfolders"""
+    indices: Optional[List[int]] = None
+    """Only render these images of the set (indices in the dataset)"""
+    stride: int = 1
+    """Only render every stride-th (selected) image"""
     output_same_dir: bool = True
     """Output to the subdirectory of the load_config path"""
+    writer_threads: int = 4
+    """Threads encoding and writing images while the next one is rendered (0: write synchronously)"""
+    max_pending_images: int = 8
+    """Maximum number of rendered images waiting to be written"""
+    png_compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL
+    """PNG zlib compression level 0-9. 1 is much faster than the default, with somewhat larger files"""
+    incremental: bool = False
+    """Keep the existing renders that are up to date with the checkpoint and only render missing or stale images"""
+    output_format: Literal["png", "archive"] = "png"
+    """png: image files, archive: a few memory-mapped arrays (see render_archive.py)"""
+    depth_dtype: Literal["float16", "float32"] = "float16"
+    """Depth precision in the archive output format"""
+    compute_metrics: bool = False
+    """Write per-image PSNR and SSIM (and masked variants) and their summary next to the renders"""
+    lpips: bool = False
+    """Also compute LPIPS with --compute_metrics"""
+    lpips_batch_size: int = 4
+    """Images per LPIPS evaluation"""
+
+    def selection(self, set_name):
+        """Name of the rendered subset of a set, for the manifests"""
+        if self.indices is None and self.stride == 1:
+            return set_name
+        return '%s %s' % (set_name, json.dumps({ 'indices': self.indices, 'stride': self.stride }))
+
+    def selected_indices(self, n_images):
+        indices = list(range(n_images))
+        if self.indices is not None:
+            for i in self.indices:
+                if i < 0 or i >= n_images:
+                    raise IndexError('image index %d out of range (%d images)' % (i, n_images))
+            indices = list(self.indices)
+        return indices[::self.stride]
+
+    def check_outputs(self, set_name, output_dir, model_fingerprint):
+        """
+        Returns:
+            whether the renders of the set are up to date, the render manifest
+            (PNG output) and whether existing outputs can be kept
+        """
+        manifest = None
+        if self.output_format == "archive":
+            archive_fingerprint = cache_manifest.hash_json([model_fingerprint, self.selection(set_name)])
+            up_to_date = render_archive.is_complete(output_dir, archive_fingerprint)
+            keep_previous = self.incremental
+            if up_to_date: image_names = render_archive.read_index(output_dir)['names']
+        else:
+            manifest = RenderManifest(output_dir, model_fingerprint)
+            up_to_date = manifest.is_complete(self.selection(set_name))
+            keep_previous = self.incremental and len(manifest.images) > 0
+            image_names = list(manifest.images.keys())
+        if up_to_date and self.compute_metrics:
+            up_to_date = render_metrics.is_complete(output_dir, image_names, self.lpips)
+        return self.incremental and up_to_date, manifest, keep_previous
 
     def main(self):
         if self.output_same_dir:
             self.output_dir = os.path.join(os.path.dirname(self.load_config), 'renders')
 
-        if os.path.exists(self.output_dir):
+        set_names = ["train", "eval"] if self.set == "both" else [self.set]
+        # a single set is written directly to the output folder
+        output_dirs = { s: os.path.join(self.output_dir, s) if len(set_names) > 1 else self.output_dir for s in set_names }
+
+        if not self.incremental and os.path.exists(self.output_dir):
             shutil.rmtree(self.output_dir)
-        os.makedirs(self.output_dir)
-        print('writing %s' % str(self.output_dir))
+
+        model_fingerprint = cache_manifest.model_fingerprint(os.path.dirname(self.load_config))
+        pending = []
+        for set_name in set_names:
+            up_to_date, manifest, keep_previous = self.check_outputs(set_name, output_dirs[set_name], model_fingerprint)
+            if up_to_date:
+                print('%s: all renders up to date' % str(output_dirs[set_name]))
+            else:
+                pending.append((set_name, manifest, keep_previous))
+        if len(pending) == 0:
+            return
 
         _, pipeline, _, _ = eval_setup(self.load_config)
 
         assert isinstance(pipeline.model, SplatfactoModel)
 
+        for set_name, manifest, keep_previous in pending:
+            self.render_set(pipeline, set_name, output_dirs[set_name], model_fingerprint, manifest, keep_previous)
+
+    def render_set(self, pipeline, set_name, output_dir, model_fingerprint, manifest, keep_previous):
+        if not keep_previous:
+            if os.path.exists(output_dir):
+                shutil.rmtree(output_dir)
+            if manifest is not None:
+                manifest.images = {}
+                manifest.complete_sets = []
+        os.makedirs(output_dir, exist_ok=True)
+        print('writing %s' % str(output_dir))
+
         model: SplatfactoModel = pipeline.model
         dataset: InputDataset
 
         with torch.no_grad():
-            if self.set == "train":
+            if set_name == "train":
                 dataset = pipeline.datamanager.train_dataset
                 images = pipeline.datamanager.cached_train
-            elif self.set == "eval":
+            elif set_name == "eval":
                 dataset = pipeline.datamanager.eval_dataset
                 images = pipeline.datamanager.cached_eval
             else:
                 raise RuntimeError("Invalid set")
         
             cameras: Cameras = dataset.cameras  # type: ignore
-            for image_idx in range(len(dataset)):  # type: ignore
-                data = images[image_idx]
-
-                # process batch gt data
-                mask = None
-                if "mask" in data:
-                    mask = data["mask"]
-
-                gt_img = 256 - data["image"] # not sure why negative
-                if "sensor_depth" in data:
-                    depth_gt = data["sensor_depth"]
-                    depth_gt_color = colormaps.apply_depth_colormap(
-                        data["sensor_depth"]
-                    )
-                else:
-                    depth_gt = None
-                    depth_gt_color = None
-                if "normal" in data:
-                    normal_gt = data["normal"]
-                else:
-                    normal_gt = None
-
-                # process pred outputs
-                camera = cameras[image_idx : image_idx + 1].to("cpu")
-                #if self.set == "train":
-                # camera idx is used to fetch camera optimizer adjustments
-                # and should not be used for 'eval' data
-                camera.metadata['cam_idx'] = image_idx
-                outputs = model.get_outputs_for_camera(camera=camera)
-
-                rgb_out, depth_out = outputs["rgb"], outputs["depth"]
-
-                normal = None
-                if "normal" in outputs:
-                    normal = outputs["normal"]
-
-                seq_name = Path(dataset.image_filenames[image_idx])
-                image_name = f"{seq_name.stem}"
-
-                depth_color = colormaps.apply_depth_colormap(depth_out)
-                depth = depth_out.detach().cpu().numpy()
-
-                if mask is not None:
-                    rgb_out = rgb_out * mask
-                    gt_img = gt_img * mask
-                    if depth_color is not None:
-                        depth_color = depth_color * mask
-                    if depth_gt_color is not None:
-                        depth_gt_color = depth_gt_color * mask
-                    if depth_gt is not None:
-                        depth_gt = depth_gt * mask
-                    if depth is not None:
-                        depth = depth * mask
-                    if normal_gt is not None:
-                        normal_gt = normal_gt * mask
-                    if normal is not None:
-                        normal = normal * mask
-
-                # save all outputs
-                save_outputs_helper(
-                    rgb_out,
-                    gt_img,
-                    depth_color,
-                    depth_gt_color,
-                    depth_gt,
-                    depth,
-                    normal_gt,
-                    normal,
-                    self.output_dir,
-                    image_name,
-                )
-
+            image_indices = self.selected_indices(len(dataset))  # type: ignore
+            writer = None
+            archive = None
+            if self.output_format == "archive":
+                archive = render_archive.ArchiveWriter(output_dir,
+                    [Path(dataset.image_filenames[i]).stem for i in image_indices],
+                    int(cameras.height[image_indices].max()), int(cameras.width[image_indices].max()),
+                    self.depth_dtype, cache_manifest.hash_json([model_fingerprint, self.selection(set_name)]),
+                    resume=self.incremental)
+            elif self.writer_threads > 0:
+                writer = ImageWriter(self.writer_threads, self.max_pending_images, self.png_compress_level)
+
+            metrics = None
+            if self.compute_metrics:
+                metrics = render_metrics.ImageMetrics(model, output_dir,
+                    self.lpips, self.lpips_batch_size, keep_previous=keep_previous)
+
+            timings = {}
+            n_up_to_date = 0
+            start_time = time.time()
+            try:
+                for archive_idx, image_idx in enumerate(image_indices):
+                    seq_name = Path(dataset.image_filenames[image_idx])
+                    image_name = f"{seq_name.stem}"
+
+                    metrics_up_to_date = metrics is None or metrics.has(image_name)
+                    if archive is not None:
+                        if archive.is_written(archive_idx) and metrics_up_to_date:
+                            n_up_to_date += 1
+                            continue
+                    else:
+                        fingerprint = manifest.image_fingerprint(set_name, image_idx, image_name)
+                        if manifest.is_up_to_date(image_name, fingerprint) and metrics_up_to_date:
+                            n_up_to_date += 1
+                            continue
+
+                        def on_written(files, image_name=image_name, image_idx=image_idx, fingerprint=fingerprint):
+                            manifest.record(image_name, image_idx, fingerprint, files)
+
+                    data = images[image_idx]
+
+                    # process pred outputs
+                    t0 = time.time()
+                    camera = cameras[image_idx : image_idx + 1].to("cpu")
+                    #if self.set == "train":
+                    # camera idx is used to fetch camera optimizer adjustments
+                    # and should not be used for 'eval' data
+                    camera.metadata['cam_idx'] = image_idx
+                    outputs = model.get_outputs_for_camera(camera=camera)
+                    if torch.cuda.is_available(): torch.cuda.synchronize()
+                    t1 = time.time()
+                    image_timings = { 'render': t1 - t0 }
+                    timings[image_name] = image_timings
+
+                    if metrics is not None:
+                        metrics.add(image_name, outputs, data)
+                        t2 = time.time()
+                        image_timings['metrics'] = t2 - t1
+                        t1 = t2
+
+                    if archive is not None:
+                        archive_data = archive_images(outputs, data)
+                        t2 = time.time()
+                        archive.write(archive_idx, archive_data)
+                        image_timings['transfer'] = t2 - t1
+                        image_timings['write'] = time.time() - t2
+                    elif writer is None:
+                        save_outputs(outputs, data, output_dir, image_name, on_written=on_written)
+                        image_timings['transfer_and_encode'] = time.time() - t1
+                    else:
+                        # the GPU -> CPU copy happens here, encoding in the writer threads
+                        save_outputs(outputs, data, output_dir, image_name, writer, on_written)
+                        image_timings['transfer'] = time.time() - t1
+            finally:
+                # also on errors: wait for the queued writes (raising their errors)
+                # and keep what was written for --incremental
+                try:
+                    if writer is not None:
+                        writer.close()
+                finally:
+                    if archive is not None:
+                        archive.close()
+                    else:
+                        manifest.save()
+
+            if writer is not None:
+                for image_name, encode_time in writer.encode_times.items():
+                    timings[image_name]['encode'] = encode_time
+            if metrics is not None:
+                metrics_summary = metrics.write()
+                print(', '.join('%s %.4f' % (k, v['mean']) for k, v in metrics_summary.items() if k in ['psnr', 'ssim', 'lpips']))
+            if archive is None:
+                manifest.mark_complete(self.selection(set_name))
+
+        total_time = time.time() - start_time
+        stages = sorted(set(stage for t in timings.values() for stage in t))
+        summary = { 'set': set_name, 'images': len(timings), 'wall_clock_seconds': total_time }
+        for stage in stages:
+            summary[stage + '_seconds'] = sum(t[stage] for t in timings.values())
+        if n_up_to_date > 0:
+            summary['up_to_date'] = n_up_to_date
+        print('%s: rendered %d images in %.1fs (total %s), %d up to date' % (set_name, len(timings), total_time,
+            ', '.join('%s %.1fs' % (stage, summary[stage + '_seconds']) for stage in stages), n_up_to_date))
+        with open(os.path.join(output_dir, 'render_timings.json'), 'w') as f:
+            json.dump({ 'summary': summary, 'images': timings }, f, indent=4)
 
 if __name__ == "__main__":
     tyro.cli(RenderModel).main()
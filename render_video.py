@@ -4,6 +4,8 @@ import json
 import subprocess
 import numpy as np
 
+from kinematics import finite_difference_velocities
+
 class SplineInterpolator:        
     def __init__(self, target, frames_per_transition):
         self.target = target
@@ -83,36 +85,13 @@ def get_original_length_seconds(raw_input_data_jsonl):
     return last_ts - first_ts
 
 def add_velocities(camera_path, loop=False):
-    from scipy.spatial.transform import Rotation
-
     path = camera_path['camera_path']
-    for i in range(len(path)):
-        if loop:
-            i_prev = (i - 1) % len(path)
-            i_next = (i + 1) % len(path)
-        else:
-            i_prev = max(0, i - 1)
-            i_next = min(len(path) - 1, i + 1)
-        
-        delta_t = i_next - i_prev
-
-        prev_pose = np.array(path[i_prev]['camera_to_world'])
-        next_pose = np.array(path[i_next]['camera_to_world'])
-
-        velocity_w = (next_pose[:3, 3] - prev_pose[:3, 3]) / delta_t
-
-        cur_pose = np.array(path[i]['camera_to_world'])
-
-        rot = next_pose[:3, :3] @ prev_pose[:3, :3].transpose()
-        rot_vec = Rotation.from_matrix(rot).as_rotvec()
-        ang_vel_w = rot_vec / delta_t
-
-        R_w2c = cur_pose[:3, :3].transpose()
-        velocity_cam = R_w2c @ velocity_w
-        ang_vel_cam = R_w2c @ ang_vel_w
+    c2ws = np.array([frame['camera_to_world'] for frame in path], dtype=np.float64).reshape(-1, 4, 4)
+    velocity_cam, ang_vel_cam = finite_difference_velocities(c2ws, loop=loop)
 
-        path[i]['camera_linear_velocity'] = velocity_cam.tolist()
-        path[i]['camera_angular_velocity'] = ang_vel_cam.tolist()
+    for frame, v, w in zip(path, velocity_cam.tolist(), ang_vel_cam.tolist()):
+        frame['camera_linear_velocity'] = v
+        frame['camera_angular_velocity'] = w
 
 def process(out_folder, args):
     import numpy as np
@@ -0,0 +1,184 @@
+"""
+Successive halving (Hyperband-style) sweep of ns-train parameters with train.py.
+
+All candidate parameter sets are first trained with a small iteration
+budget on the selected sessions and evaluated. Only the best 1/eta of them
+are promoted to the next rung, whose budget is eta times larger, until the
+full budget. Note that the Splatfacto densification schedule is defined in
+absolute steps, so short runs are a proxy of the full ones, not prefixes.
+
+All runs, scores and promotion decisions are recorded in sweep.json in the
+sweep folder. Finished runs are skipped by train.py, so an interrupted sweep
+can be resumed by running the same command again.
+"""
+import os
+import sys
+import json
+import glob
+import itertools
+import shlex
+import subprocess
+
+# True: higher is better
+METRICS = {
+    'psnr': True,
+    'ssim': True,
+    'lpips': False
+}
+
+def parse_candidates(args):
+    """Candidate parameter sets as dicts (ns-train argument -> value), from a JSON file or a grid"""
+    if args.candidates is not None:
+        with open(args.candidates) as f:
+            return json.load(f)
+
+    names = []
+    values = []
+    for p in args.param:
+        name, _, vals = p.partition('=')
+        names.append(name.lstrip('-'))
+        values.append(vals.split(','))
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def candidate_ns_train_args(candidate):
+    return ' '.join(shlex.quote('--%s=%s' % (k, v)) for k, v in sorted(candidate.items()))
+
+def iteration_budgets(min_iterations, max_iterations, eta):
+    budgets = [min_iterations]
+    while budgets[-1] * eta < max_iterations:
+        budgets.append(budgets[-1] * eta)
+    if budgets[-1] < max_iterations: budgets.append(max_iterations)
+    return budgets
+
+def find_metrics(output_prefix, session):
+    name = os.path.basename(os.path.normpath(session))
+    paths = glob.glob(os.path.join(output_prefix, 'custom', '*', name, 'splatfacto', '*', 'metrics.json'))
+    if len(paths) == 0: return None
+    assert len(paths) == 1
+    with open(paths[0]) as f:
+        return json.load(f)['results']
+
+def run(args, candidate_index, candidate, budget, session):
+    """Train and evaluate one candidate on one session (or just print the command with --dry_run)"""
+    output_prefix = os.path.join(args.sweep_folder, 'iter-%d' % budget, 'candidate-%02d' % candidate_index)
+    cmd = [
+        sys.executable, 'train.py', session,
+        '--dataset', args.dataset,
+        '--max_iterations', str(budget),
+        '--output_prefix', output_prefix
+    ]
+    if len(candidate) > 0:
+        # (= form, since the value starts with --)
+        cmd.append('--ns_train_args=' + candidate_ns_train_args(candidate))
+    cmd.extend(['--' + flag for flag in args.variant_flags])
+
+    print('RUNNING COMMAND: ' + ' '.join(shlex.quote(c) for c in cmd))
+    if args.dry_run: return None
+
+    subprocess.check_call(cmd)
+    return find_metrics(output_prefix, session)
+
+def successive_halving(args, candidates, sessions):
+    higher_is_better = METRICS[args.metric]
+    budgets = iteration_budgets(args.min_iterations, args.max_iterations, args.eta)
+    record = {
+        'dataset': args.dataset,
+        'sessions': sessions,
+        'variant_flags': args.variant_flags,
+        'metric': args.metric,
+        'eta': args.eta,
+        'budgets': budgets,
+        'candidates': candidates,
+        'rungs': []
+    }
+
+    def save():
+        if args.dry_run: return
+        os.makedirs(args.sweep_folder, exist_ok=True)
+        with open(os.path.join(args.sweep_folder, 'sweep.json'), 'w') as f:
+            json.dump(record, f, indent=4)
+
+    alive = list(range(len(candidates)))
+    total_iterations = 0
+    for rung, budget in enumerate(budgets):
+        print('--- rung %d: %d candidates, %d iterations' % (rung, len(alive), budget))
+        rung_record = { 'iterations': budget, 'results': [] }
+        record['rungs'].append(rung_record)
+
+        for c in alive:
+            per_session = {}
+            for session in sessions:
+                per_session[session] = run(args, c, candidates[c], budget, session)
+                total_iterations += budget
+            scores = [m[args.metric] for m in per_session.values() if m is not None]
+            rung_record['results'].append({
+                'candidate': c,
+                'parameters': candidates[c],
+                'metrics': per_session,
+                'score': sum(scores) / len(scores) if len(scores) > 0 else None
+            })
+            save()
+
+        if args.dry_run:
+            n_keep = max(1, len(alive) // args.eta)
+            alive = alive[:n_keep]
+            continue
+
+        ranked = sorted((r for r in rung_record['results'] if r['score'] is not None),
+            key=lambda r: r['score'], reverse=higher_is_better)
+        for r in ranked:
+            print('candidate %d: %s = %.4f %s' % (r['candidate'], args.metric, r['score'], json.dumps(r['parameters'])))
+
+        if rung == len(budgets) - 1: break
+        n_keep = max(1, len(ranked) // args.eta)
+        alive = [r['candidate'] for r in ranked[:n_keep]]
+        rung_record['promoted'] = alive
+        print('promoting candidates %s' % str(alive))
+        save()
+
+    full_cost = len(candidates) * len(sessions) * budgets[-1]
+    record['total_iterations'] = total_iterations
+    record['full_sweep_iterations'] = full_cost
+    if not args.dry_run:
+        record['best'] = ranked[0] if len(ranked) > 0 else None
+        save()
+        if record['best'] is not None:
+            print('best: candidate %d %s' % (record['best']['candidate'], json.dumps(record['best']['parameters'])))
+    print('%d training iterations (%.1f%% of training all candidates fully)' % (
+        total_iterations, 100.0 * total_iterations / full_cost))
+    return record
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', type=str, required=True)
+    parser.add_argument('--sessions', nargs='+', default=None, help='session names (default: all sessions of the dataset)')
+    parser.add_argument('--param', action='append', default=[],
+        help='ns-train parameter grid, e.g., --param pipeline.model.blur-samples=5,10,15 (can be repeated)')
+    parser.add_argument('--candidates', type=str, default=None,
+        help='JSON file with a list of candidate parameter sets ({"pipeline.model.cull-scale-thresh": "2.0", ...})')
+    parser.add_argument('--variant_flags', nargs='*', default=[],
+        help='train.py variant flags for all runs, e.g., no_rolling_shutter velocity_opt_zero_init')
+    parser.add_argument('--metric', choices=list(METRICS.keys()), default='psnr')
+    parser.add_argument('--eta', type=int, default=3, help='keep the best 1/eta candidates at each rung')
+    parser.add_argument('--min_iterations', type=int, default=3000, help='first rung budget (the --draft iteration count)')
+    parser.add_argument('--max_iterations', type=int, default=20000)
+    parser.add_argument('--sweep_folder', type=str, default=None, help='default: data/sweeps/<dataset>')
+    parser.add_argument('--dry_run', action='store_true')
+    args = parser.parse_args()
+
+    if args.sweep_folder is None:
+        args.sweep_folder = os.path.join('data/sweeps', args.dataset)
+
+    input_root = os.path.join('data/inputs-processed', args.dataset)
+    if args.sessions is None:
+        args.sessions = sorted(os.listdir(input_root))
+    sessions = [os.path.join(input_root, s) for s in args.sessions]
+
+    candidates = parse_candidates(args)
+    if len(candidates) == 0:
+        raise ValueError('no candidates: use --param or --candidates')
+    print('%d candidates, %d sessions, budgets %s' % (len(candidates), len(sessions),
+        str(iteration_budgets(args.min_iterations, args.max_iterations, args.eta))))
+
+    successive_halving(args, candidates, sessions)
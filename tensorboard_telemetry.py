@@ -0,0 +1,137 @@
+"""Training throughput telemetry from the tensorboard event files of a Nerfstudio run"""
+import os
+import glob
+import numpy as np
+
+# Nerfstudio scalar tags
+LOSS_TAG = 'Train Loss'
+ITERATION_TIME_TAG = 'Train Iter (time)'
+GAUSSIAN_COUNT_TAG = 'Train Metrics Dict/gaussian_count'
+
+TIME_TO_STEP_MILESTONES = [1000, 3000, 7000, 20000]
+WARMUP_FRACTION = 0.1
+MAX_CURVE_POINTS = 50
+
+def find_event_files(model_folder):
+    """Event files of a model folder (.../splatfacto/<timestamp>), also in subfolders"""
+    return sorted(glob.glob(os.path.join(model_folder, '**', 'events.out.tfevents.*'), recursive=True))
+
+def read_scalars(event_files):
+    """
+    Read all scalar summaries from event files.
+
+    Returns:
+        dict tag -> (N, 3) array of (step, wall time, value), sorted by step
+    """
+    from tensorboard.backend.event_processing.event_file_loader import EventFileLoader
+    from tensorboard.util import tensor_util
+
+    rows = {}
+    for path in event_files:
+        for event in EventFileLoader(path).Load():
+            if not event.HasField('summary'): continue
+            for value in event.summary.value:
+                # EventFileLoader converts simple_value scalars to tensors
+                if value.HasField('tensor'):
+                    v = tensor_util.make_ndarray(value.tensor)
+                    if v.size != 1: continue
+                    v = float(v.reshape(-1)[0])
+                elif value.HasField('simple_value'):
+                    v = value.simple_value
+                else:
+                    continue
+                rows.setdefault(value.tag, []).append((event.step, event.wall_time, v))
+
+    scalars = {}
+    for tag, r in rows.items():
+        a = np.array(r, dtype=np.float64)
+        scalars[tag] = a[np.argsort(a[:, 0], kind='stable')]
+    return scalars
+
+def downsample_curve(a, max_points=MAX_CURVE_POINTS):
+    """(step, value) pairs of at most max_points evenly spaced rows"""
+    idx = np.unique(np.linspace(0, len(a) - 1, min(len(a), max_points)).round().astype(int))
+    return [[int(a[i, 0]), float(a[i, 2])] for i in idx]
+
+def summarize_scalars(scalars, milestones=TIME_TO_STEP_MILESTONES, warmup_fraction=WARMUP_FRACTION):
+    """Throughput and progress summary of a training run from its scalars (see read_scalars)"""
+    if len(scalars) == 0: return None
+
+    # the most frequently logged tag gives the finest step timeline
+    timeline = max(scalars.values(), key=len)
+    steps, wall_times = timeline[:, 0], timeline[:, 1]
+    start_time = min(s[:, 1].min() for s in scalars.values())
+
+    summary = {
+        'last_step': int(steps[-1]),
+        'duration_seconds': float(wall_times[-1] - start_time),
+    }
+
+    if len(steps) > 1 and wall_times[-1] > wall_times[0]:
+        summary['iterations_per_second'] = float((steps[-1] - steps[0]) / (wall_times[-1] - wall_times[0]))
+
+        # median of the rates between consecutive log points after warm-up,
+        # which is not affected by occasional evaluation pauses
+        after_warmup = steps >= steps[0] + warmup_fraction * (steps[-1] - steps[0])
+        d_step = np.diff(steps[after_warmup])
+        d_time = np.diff(wall_times[after_warmup])
+        ok = d_time > 0
+        if np.any(ok):
+            summary['steady_state_iterations_per_second'] = float(np.median(d_step[ok] / d_time[ok]))
+
+    summary['seconds_to_step'] = {
+        str(n): float(wall_times[np.argmax(steps >= n)] - start_time)
+        for n in milestones if steps[-1] >= n
+    }
+
+    if ITERATION_TIME_TAG in scalars:
+        iter_times = scalars[ITERATION_TIME_TAG]
+        iter_times = iter_times[iter_times[:, 0] >= warmup_fraction * iter_times[-1, 0]]
+        if len(iter_times) > 0:
+            summary['median_iteration_ms'] = float(np.median(iter_times[:, 2]) * 1000)
+
+    if GAUSSIAN_COUNT_TAG in scalars:
+        counts = scalars[GAUSSIAN_COUNT_TAG]
+        summary['gaussian_count'] = {
+            'final': int(counts[-1, 2]),
+            'peak': int(counts[:, 2].max()),
+            'curve': downsample_curve(counts)
+        }
+
+    if LOSS_TAG in scalars:
+        loss = scalars[LOSS_TAG]
+        tail = loss[loss[:, 0] >= loss[-1, 0] * 0.95]
+        summary['loss'] = {
+            'final': float(np.mean(tail[:, 2])),
+            'min': float(loss[:, 2].min()),
+            'curve': downsample_curve(loss)
+        }
+
+    return summary
+
+def training_telemetry(model_folder):
+    """Summary (see summarize_scalars) of the event files in a model folder, or None if there are none"""
+    event_files = find_event_files(model_folder)
+    if len(event_files) == 0: return None
+    summary = summarize_scalars(read_scalars(event_files))
+    if summary is not None: summary['event_files'] = len(event_files)
+    return summary
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('model_folder', help='e.g., data/outputs/<dataset>/<variant>/<session>/splatfacto/<timestamp>')
+    parser.add_argument('--write', action='store_true', help='add the summary to metrics.json in the model folder')
+    args = parser.parse_args()
+
+    telemetry = training_telemetry(args.model_folder)
+    print(json.dumps(telemetry, indent=4))
+
+    if args.write and telemetry is not None:
+        metrics_path = os.path.join(args.model_folder, 'metrics.json')
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+        metrics['training_telemetry'] = telemetry
+        with open(metrics_path, 'w') as f:
+            json.dump(metrics, f, indent=4)
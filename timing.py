@@ -0,0 +1,99 @@
+"""Wall clock time and resource usage of child processes"""
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Log lines of ns-train that mark the beginning of each training phase,
+# in order. Everything before the first marker is counted as "startup"
+NS_TRAIN_PHASE_MARKERS = [
+    ('caching', r'Caching'),
+    ('training', r'Step \(% Done\)'),
+    ('finishing', r'Training Finished'),
+]
+
+def rusage_to_dict(ru):
+    return {
+        'user_cpu_seconds': ru.ru_utime,
+        'system_cpu_seconds': ru.ru_stime,
+        'peak_rss_mb': ru.ru_maxrss / 1024.0, # KB on Linux
+        # block I/O, in 512-byte units
+        'read_bytes': ru.ru_inblock * 512,
+        'write_bytes': ru.ru_oublock * 512,
+    }
+
+def phase_durations(boundaries, total):
+    """Durations of the phases from (name, start time) pairs, the first phase being startup"""
+    names = ['startup'] + [name for name, _ in boundaries]
+    starts = [0] + [t for _, t in boundaries] + [total]
+    return { name: starts[i + 1] - starts[i] for i, name in enumerate(names) }
+
+def run_measured(cmd, phase_markers=None, env=None):
+    """
+    Run a command like subprocess.check_call and measure its wall clock time
+    and resource usage, including the processes it waits for (e.g., data
+    loader workers).
+
+    If phase_markers is given, the output of the command is passed through
+    and scanned for the (phase name, regex) markers, in order, to time the
+    phases of the run.
+
+    Returns:
+        dict with wall_seconds, CPU times, peak RSS, I/O bytes and phases
+    """
+    if phase_markers is not None:
+        env = dict(os.environ if env is None else env)
+        # otherwise the marker lines would arrive late
+        env['PYTHONUNBUFFERED'] = '1'
+
+    start_time = time.time()
+    proc = subprocess.Popen(cmd, env=env,
+        stdout=subprocess.PIPE if phase_markers is not None else None)
+
+    boundaries = []
+    next_marker = 0
+    if phase_markers is not None:
+        for raw_line in iter(proc.stdout.readline, b''):
+            sys.stdout.buffer.write(raw_line)
+            sys.stdout.flush()
+            line = raw_line.decode('utf-8', errors='replace')
+            # markers may be missing (e.g., no caching), but are never out of order
+            for i in range(next_marker, len(phase_markers)):
+                name, pattern = phase_markers[i]
+                if re.search(pattern, line):
+                    boundaries.append((name, time.time() - start_time))
+                    next_marker = i + 1
+                    break
+        proc.stdout.close()
+
+    _, status, ru = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    wall_seconds = time.time() - start_time
+    timings = { 'wall_seconds': wall_seconds }
+    timings.update(rusage_to_dict(ru))
+    if phase_markers is not None:
+        timings['phases'] = phase_durations(boundaries, wall_seconds)
+    return timings
+
+def measure_in_process(func):
+    """
+    Like run_measured, for a function call in this process. CPU time and
+    I/O are differences of the process totals, but the peak RSS is that of
+    the whole process so far
+    """
+    import resource
+    ru_start = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.time()
+    func()
+    wall_seconds = time.time() - start_time
+    ru_end = resource.getrusage(resource.RUSAGE_SELF)
+
+    start = rusage_to_dict(ru_start)
+    timings = { 'wall_seconds': wall_seconds }
+    for k, v in rusage_to_dict(ru_end).items():
+        timings[k] = v if k == 'peak_rss_mb' else v - start[k]
+    return timings
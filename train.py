@@ -7,6 +7,14 @@ import time
 import datetime
 import json
 import re
+import shlex
+import argparse
+from multiprocessing.pool import ThreadPool
+
+import cache_manifest
+import timing
+import validate_dataset
+import work_queue
 
 DATASET_SPECIFIC_PARAMETERS = {
     r".*synthetic.*": [
@@ -23,6 +31,9 @@ DATASET_SPECIFIC_PARAMETERS = {
     ]
 }
 
+TRAINING_TIME_FILE = 'training_time.json'
+DEFAULT_OUTPUT_PREFIX = 'data/outputs'
+
 def print_cmd(cmd):
     print('RUNNING COMMAND: ' + ' '.join(cmd))
 
@@ -75,7 +86,67 @@ def flags_to_variant_name_and_cmd(args):
 
     return '-'.join(variant), cmd, optimize_eval_cameras
 
-def evaluate(output_folder, elapsed_time, dry_run=False, render_images=True):
+def read_training_telemetry(model_folder):
+    try:
+        import tensorboard_telemetry
+        return tensorboard_telemetry.training_telemetry(model_folder)
+    except ImportError:
+        print('tensorboard not available, training telemetry not recorded')
+        return None
+
+def build_eval_cmds(config_path, metrics_path, render_images, separate_eval, incremental_render=False):
+    """
+    Args:
+        incremental_render: only re-render missing or stale images (render_model.py --incremental)
+
+    Returns:
+        evaluation command, scripts it runs (for cache fingerprints) and
+        the separate render command, or None
+    """
+    eval_scripts = []
+    render_cmd = None
+    if separate_eval:
+        eval_cmd = [
+            'ns-eval',
+             '--load-config', config_path,
+             '--output-path', metrics_path
+        ]
+        if render_images:
+            render_cmd = [
+                'python', 'render_model.py',
+                '--load-config', config_path
+            ]
+            if incremental_render:
+                render_cmd.append('--incremental')
+    else:
+        # load the model once, compute the metrics and save the renders in the same pass
+        eval_scripts = ['eval_model.py', 'render_model.py']
+        eval_cmd = [
+            'python', 'eval_model.py',
+            '--load-config', config_path,
+            '--output-path', metrics_path
+        ]
+        if render_images:
+            eval_cmd.append('--render-images')
+    return eval_cmd, eval_scripts, render_cmd
+
+def complete_metrics(output_folder, model_folder, elapsed_time, eval_timings):
+    """Add the training time, step timings and training telemetry to the metrics.json written by the evaluation"""
+    metrics_path = os.path.join(model_folder, 'metrics.json')
+    timings = {}
+    training_timings = read_training_timings(output_folder)
+    if training_timings is not None: timings['train'] = training_timings
+    timings['eval'] = eval_timings
+    with open(metrics_path) as f:
+        metrics = json.load(f)
+    metrics['wall_clock_time_seconds'] = elapsed_time
+    metrics['timings'] = timings
+    telemetry = read_training_telemetry(model_folder)
+    if telemetry is not None: metrics['training_telemetry'] = telemetry
+    with open(metrics_path, 'w') as f:
+        json.dump(metrics, f, indent=4)
+
+def evaluate(output_folder, elapsed_time, dry_run=False, render_images=True, use_cache=False, separate_eval=False, env=None):
     result_paths = find_config_path(output_folder)
     if result_paths is None:
         if dry_run: return
@@ -83,32 +154,58 @@ def evaluate(output_folder, elapsed_time, dry_run=False, render_images=True):
 
     out_path, config_path = result_paths
     metrics_path = os.path.join(out_path, 'metrics.json')
-    elapsed_time
-    eval_cmd = [
-        'ns-eval',
-         '--load-config', config_path,
-         '--output-path', metrics_path
-    ]
+    eval_cmd, eval_scripts, render_cmd = build_eval_cmds(config_path, metrics_path, render_images, separate_eval, incremental_render=use_cache)
+
+    if use_cache:
+        model = cache_manifest.model_fingerprint(out_path)
+        code = cache_manifest.code_version()
 
     print_cmd(eval_cmd)
-    if not dry_run:
-        subprocess.check_call(eval_cmd)
-        with open(metrics_path) as f:
-            metrics = json.load(f)
-        metrics['wall_clock_time_seconds'] = elapsed_time
-        with open(metrics_path, 'w') as f:
-            json.dump(metrics, f, indent=4)
+    if use_cache:
+        eval_fingerprint = cache_manifest.hash_json(dict(cmd=eval_cmd, model=model, code=code,
+            scripts=[cache_manifest.hash_file(f) for f in eval_scripts]))
+    if use_cache and cache_manifest.is_up_to_date(output_folder, 'eval', eval_fingerprint) and os.path.exists(metrics_path):
+        print('evaluation up to date, skipping')
+    elif not dry_run:
+        complete_metrics(output_folder, out_path, elapsed_time, timing.run_measured(eval_cmd, env=env))
+        if use_cache: cache_manifest.record_step(output_folder, 'eval', eval_fingerprint, metrics=metrics_path)
     
-    if render_images:
-        render_cmd = [
-            'python', 'render_model.py',
-            '--load-config', config_path
-        ]
+    if render_cmd is not None:
         print_cmd(render_cmd)
-        if not dry_run:
-            subprocess.check_call(render_cmd)
-
-def process(input_folder, args):
+        if use_cache:
+            render_fingerprint = cache_manifest.hash_json(dict(cmd=render_cmd, model=model, code=code,
+                script=cache_manifest.hash_file('render_model.py')))
+        renders_path = os.path.join(out_path, 'renders')
+        if use_cache and cache_manifest.is_up_to_date(output_folder, 'render', render_fingerprint) and os.path.exists(renders_path):
+            print('renders up to date, skipping')
+        elif not dry_run:
+            render_timings = timing.run_measured(render_cmd, env=env)
+            if os.path.exists(metrics_path):
+                with open(metrics_path) as f:
+                    metrics = json.load(f)
+                metrics.setdefault('timings', {})['render'] = render_timings
+                with open(metrics_path, 'w') as f:
+                    json.dump(metrics, f, indent=4)
+            if use_cache: cache_manifest.record_step(output_folder, 'render', render_fingerprint, renders=renders_path)
+
+def write_training_time(output_folder, elapsed_time, timings=None):
+    with open(os.path.join(output_folder, TRAINING_TIME_FILE), 'w') as f:
+        json.dump({ 'wall_clock_time_seconds': elapsed_time, 'timings': timings }, f)
+
+def read_training_time(output_folder, default=0):
+    path = os.path.join(output_folder, TRAINING_TIME_FILE)
+    if not os.path.exists(path): return default
+    with open(path) as f:
+        return json.load(f)['wall_clock_time_seconds']
+
+def read_training_timings(output_folder):
+    path = os.path.join(output_folder, TRAINING_TIME_FILE)
+    if not os.path.exists(path): return None
+    with open(path) as f:
+        return json.load(f).get('timings')
+
+def build_train_cmd(input_folder, args):
+    """The ns-train command and the output folder of a training run"""
     name = os.path.split(input_folder)[-1]
 
     cmd = [
@@ -126,7 +223,9 @@ def process(input_folder, args):
             cmd.extend(values)
 
     if '--max-num-iterations' not in cmd:
-        if args.draft:
+        if args.max_iterations is not None:
+            cmd.extend(['--max-num-iterations', str(args.max_iterations)])
+        elif args.draft:
             cmd.extend(['--max-num-iterations', '3000'])
         else:
             cmd.extend(['--max-num-iterations', '20000'])
@@ -142,6 +241,9 @@ def process(input_folder, args):
     variant, variant_cmd, optimize_eval_cameras = flags_to_variant_name_and_cmd(vars(args))
     cmd.extend(variant_cmd)
 
+    if args.ns_train_args is not None:
+        cmd.extend(shlex.split(args.ns_train_args))
+
     if args.case_number is None:
         dataset_folder = 'custom'
     else:
@@ -149,7 +251,7 @@ def process(input_folder, args):
         
     variant_folder = os.path.join(dataset_folder, variant)
 
-    output_prefix = 'data/outputs'
+    output_prefix = args.output_prefix
 
     # note: 'name' is automatically added by Nerfstudio
     output_root = os.path.join(output_prefix, variant_folder)
@@ -182,23 +284,54 @@ def process(input_folder, args):
             '--optimize-eval-cameras', 'True',
         ])
 
+    return cmd, os.path.join(output_root, name)
+
+def process(input_folder, args):
+    cmd, output_folder = build_train_cmd(input_folder, args)
     print_cmd(cmd)
-    output_folder = os.path.join(output_root, name)
     elapsed_time = 0
-    if not args.dry_run and not args.eval_only:
+    use_cache = not args.no_cache and not args.preview
+
+    if not args.eval_only and not args.skip_validation:
+        errors, warnings = validate_dataset.validate(input_folder, vars(args))
+        for w in warnings: print('WARNING: ' + w)
+        if len(errors) > 0:
+            raise ValueError('invalid dataset %s:\n  %s' % (input_folder, '\n  '.join(errors)))
+
+    up_to_date = False
+    # (the dataset fingerprint reads every image, too slow for a dry run)
+    if use_cache and not args.eval_only and not args.dry_run:
+        train_fingerprint = cache_manifest.hash_json(dict(
+            cmd=cmd,
+            dataset=cache_manifest.dataset_fingerprint(input_folder),
+            code=cache_manifest.code_version()))
+        up_to_date = cache_manifest.is_up_to_date(output_folder, 'train', train_fingerprint) \
+            and find_config_path(output_folder) is not None
+        if up_to_date:
+            print('training up to date, skipping')
+            elapsed_time = read_training_time(output_folder, elapsed_time)
+
+    if not args.dry_run and not args.eval_only and not up_to_date:
         if os.path.exists(output_folder):
             shutil.rmtree(output_folder)
 
         start_time = time.time()
-        subprocess.check_call(cmd)
+        training_timings = timing.run_measured(cmd, phase_markers=timing.NS_TRAIN_PHASE_MARKERS)
         end_time = time.time()
         elapsed_time = end_time - start_time
         print('Training time: %s' % str(datetime.timedelta(seconds=elapsed_time)))
+        write_training_time(output_folder, elapsed_time, training_timings)
+        if use_cache: cache_manifest.record_step(output_folder, 'train', train_fingerprint, input_folder=input_folder)
+    elif args.eval_only:
+        # training may have run in a separate process (see run_cases_locally)
+        elapsed_time = read_training_time(output_folder, elapsed_time)
     
     if not args.no_eval:
         evaluate(output_folder, elapsed_time,
             dry_run=args.dry_run,
-            render_images=args.render_images)
+            render_images=args.render_images,
+            use_cache=use_cache,
+            separate_eval=args.separate_eval)
 
 def find_config_path(output_folder):
     model_folder = os.path.join(output_folder, 'splatfacto')
@@ -238,77 +371,518 @@ def add_velocity_opt_variants(variants, dataset):
 
     return new_variants
 
-if __name__ == '__main__':
-    import argparse
-    parser = argparse.ArgumentParser(description=__doc__)
+# note: velocity optimization arguments are auto-added to all of these
+BASELINE = {
+    'no_pose_opt',
+    'no_motion_blur',
+    'no_rolling_shutter'
+}
 
-    # note: velocity optimization arguments are auto-added to all of these
-    baseline = {
-        'no_pose_opt',
-        'no_motion_blur',
-        'no_rolling_shutter'
-    }
-
-    no_rolling_shutter_variants = [
-        baseline,
-        { 'no_rolling_shutter', 'no_pose_opt' },
-        { 'no_rolling_shutter', 'no_motion_blur' },
-        { 'no_rolling_shutter' }
-    ]
-    
-    full_variants = no_rolling_shutter_variants + [
-        { 'no_pose_opt', 'no_motion_blur' },
+no_rolling_shutter_variants = [
+    BASELINE,
+    { 'no_rolling_shutter', 'no_pose_opt' },
+    { 'no_rolling_shutter', 'no_motion_blur' },
+    { 'no_rolling_shutter' }
+]
+
+full_variants = no_rolling_shutter_variants + [
+    { 'no_pose_opt', 'no_motion_blur' },
+    { 'no_pose_opt' },
+    { 'no_motion_blur' },
+    set([])
+]
+
+DEFAULT_VARIANTS = full_variants
+bad_nerf_variants = [
+    BASELINE,
+    { 'no_rolling_shutter', 'no_pose_opt' },
+    { 'no_rolling_shutter' }
+]
+
+add_popt = lambda a: a + [o - {'no_pose_opt'} for o in a if 'no_pose_opt' in o]
+
+VARIANTS_BY_DATASET = {
+    'synthetic-clear': [
+        BASELINE
+    ],
+    'synthetic-mb': add_popt([
+        BASELINE,
+        { 'no_pose_opt', 'no_rolling_shutter' }
+    ]),
+    'synthetic-rs': add_popt([
+        BASELINE,
+        { 'no_pose_opt', 'no_motion_blur' }
+    ]),
+    'synthetic-posenoise': add_popt([
+        BASELINE,
+        { 'no_rolling_shutter', 'no_motion_blur' }
+    ]),
+    'synthetic-mbrs': add_popt([
+        BASELINE,
         { 'no_pose_opt' },
-        { 'no_motion_blur' },
-        set([])
-    ]
+        { 'no_pose_opt', 'no_motion_blur' },
+        { 'no_pose_opt', 'no_rolling_shutter' }
+    ]),
+    'synthetic-posenoise-2nd-pass': [
+        BASELINE
+    ],
+    'colmap-bad-nerf-synthetic-deblurring': bad_nerf_variants,
+    'colmap-bad-nerf-synthetic-novel-view': bad_nerf_variants,
+    'colmap-bad-nerf-synthetic-novel-view-manual-pc': add_popt(bad_nerf_variants),
+    'colmap-exblurf-synthetic-novel-view-manual-pc': bad_nerf_variants,
+    'hloc-exblurf-synthetic-novel-view-manual-pc': bad_nerf_variants,
+    'hloc-bad-nerf-synthetic-novel-view-manual-pc': bad_nerf_variants,
+    'hloc-bad-nerf-synthetic-novel-view-exact-intrinsics-manual-pc': bad_nerf_variants,
+    'hloc-bad-gaussians-synthetic-novel-view-manual-pc': bad_nerf_variants,
+    'colmap-bad-gaussians-synthetic-novel-view-manual-pc': bad_nerf_variants,
+    'colmap-mpr-deblurred-synthetic-all-manual-pc': bad_nerf_variants,
+    'colmap-mpr-deblurred-synthetic-novel-view-manual-pc': bad_nerf_variants + [{ 'no_rolling_shutter', 'no_motion_blur' }],
+}
+
+def get_cases(dataset):
+    """All (session input folder, variant flag set) cases of a dataset, in case number order"""
+    input_root = 'data/inputs-processed/' + dataset
+    sessions = [os.path.join(input_root, f) for f in sorted(os.listdir(input_root))]
+    variants = add_velocity_opt_variants(VARIANTS_BY_DATASET.get(dataset, DEFAULT_VARIANTS), dataset)
+    return [(s, v) for v in variants for s in sessions]
+
+def case_variant_name(case, args=None):
+    """Variant name of a case, including the variant flags forwarded from args (e.g., --no_gamma)"""
+    flags = {k: True for k in case[1]}
+    if args is not None:
+        flags.update({f: True for f in SCHEDULER_FORWARDED_FLAGS if getattr(args, f)})
+    return flags_to_variant_name_and_cmd(flags)[0]
+
+# flags forwarded from the scheduler to the train.py processes it starts
+SCHEDULER_FORWARDED_FLAGS = ['draft', 'render_images', 'train_all', 'no_cache', 'separate_eval', 'no_gamma', 'skip_validation']
+
+# options forwarded with their values when they differ from these defaults
+SCHEDULER_FORWARDED_OPTIONS = {
+    'max_iterations': None,
+    'ns_train_args': None,
+    'output_prefix': DEFAULT_OUTPUT_PREFIX
+}
+
+def forwarded_options(args):
+    # (= form, since ns_train_args values start with --)
+    return ['--%s=%s' % (option, str(getattr(args, option)))
+        for option, default in SCHEDULER_FORWARDED_OPTIONS.items() if getattr(args, option) != default]
+
+def forwarded_args(args):
+    """The train.py arguments passed on to the per-case processes"""
+    return ['--' + flag for flag in SCHEDULER_FORWARDED_FLAGS if getattr(args, flag)] + forwarded_options(args)
+
+def case_step_cmd(args, case_number, step, python_cmd=['python', 'train.py']):
+    """train.py command that runs only the 'train' or 'eval' step of a case"""
+    cmd = python_cmd + ['--dataset', args.dataset, '--case_number', str(case_number)] + forwarded_args(args)
+    if step == 'train': cmd.append('--no_eval')
+    else: cmd.append('--eval_only')
+    return cmd
+
+def read_case_status(path):
+    if not os.path.exists(path): return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+def write_case_status(path, status):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f, indent=4)
+    os.replace(tmp_path, path)
+
+def run_cases_locally(args, cases):
+    """
+    Run all cases of the dataset on this machine: up to args.jobs trainings
+    at a time, with evaluations of finished trainings running concurrently
+    in up to args.eval_jobs extra slots. Each step runs train.py in a
+    subprocess. The sessions are first validated in background threads
+    (the cached pre-flight check of validate_dataset.py), and a training
+    starts once its session has been checked. Progress is recorded in a
+    status file per case, and cases already done with the same forwarded
+    arguments are skipped, so an interrupted run can be resumed by running
+    the same command again.
+    """
+    status_dir = os.path.join(args.output_prefix, args.dataset, '.cases')
+    if not args.dry_run: os.makedirs(status_dir, exist_ok=True)
+
+    gpus = args.gpus.split(',') if args.gpus is not None else [None]
+    python_cmd = [sys.executable, os.path.abspath(__file__)]
+    case_args = forwarded_args(args)
+
+    def status_path(case_number):
+        return os.path.join(status_dir, 'case-%03d.json' % case_number)
+
+    pending_train = []
+    pending_eval = []
+    for i, (session, variant) in enumerate(cases):
+        case_number = i + 1
+        status = read_case_status(status_path(case_number))
+        if status is not None and status.get('args') != case_args:
+            # e.g., a --draft run does not count as a full run
+            status = None
+        if status is not None and status['state'] == 'done':
+            continue
+        status = {
+            'case_number': case_number,
+            'session': session,
+            'variant': case_variant_name((session, variant), args),
+            'args': case_args,
+            'state': 'pending',
+            'steps': {}
+        } if status is None else status
+        # a case interrupted after training only needs evaluation
+        if status.get('steps', {}).get('train', {}).get('returncode') == 0 and not args.no_eval:
+            pending_eval.append(case_number)
+        else:
+            pending_train.append(case_number)
+        status['state'] = 'pending'
+        if not args.dry_run: write_case_status(status_path(case_number), status)
+
+    print('%d/%d cases to run (%d to train, %d to evaluate), %d training slots, %d eval slots' % (
+        len(pending_train) + len(pending_eval), len(cases), len(pending_train), len(pending_eval),
+        args.jobs, args.eval_jobs))
+
+    running = {} # Popen -> (case_number, step, slot, gpu index, log file, start time)
+    free_train_slots = list(range(args.jobs))
+    n_eval_running = 0
+    n_failed = 0
+
+    def least_busy_gpu():
+        """GPU index with the fewest running trainings, then evaluations"""
+        load = [[0, 0] for _ in gpus]
+        for _, step, _, gpu_index, _, _ in running.values():
+            load[gpu_index][0 if step == 'train' else 1] += 1
+        return min(range(len(gpus)), key=lambda g: load[g])
+
+    def start(case_number, step, slot, gpu_index):
+        cmd = case_step_cmd(args, case_number, step, python_cmd)
+        print_cmd(cmd)
+        if args.dry_run: return
+
+        env = dict(os.environ)
+        gpu = gpus[gpu_index]
+        if gpu is not None: env['CUDA_VISIBLE_DEVICES'] = gpu
+
+        log_path = os.path.join(status_dir, 'case-%03d-%s.log' % (case_number, step))
+        log_file = open(log_path, 'w')
+        proc = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT, env=env)
+        running[proc] = (case_number, step, slot, gpu_index, log_file, time.time())
+
+        status = read_case_status(status_path(case_number))
+        status['state'] = 'training' if step == 'train' else 'evaluating'
+        status['steps'][step] = { 'log': log_path, 'started': time.time(), 'gpu': gpu }
+        write_case_status(status_path(case_number), status)
+
+    if args.dry_run:
+        for case_number in pending_train:
+            start(case_number, 'train', None, 0)
+            if not args.no_eval: start(case_number, 'eval', None, 0)
+        for case_number in pending_eval:
+            start(case_number, 'eval', None, 0)
+        return
+
+    # prepare step: validate the sessions in the order they are trained
+    prepared = {}
+    prepare_pool = ThreadPool(2)
+    for case_number in pending_train:
+        session = cases[case_number - 1][0]
+        if session not in prepared and not args.skip_validation:
+            prepared[session] = prepare_pool.apply_async(validate_dataset.load_report, (session,))
+    prepare_pool.close()
+
+    def next_prepared_case():
+        for case_number in pending_train:
+            result = prepared.get(cases[case_number - 1][0])
+            # (a failed check is reported by the train step)
+            if result is None or result.ready(): return case_number
+        return None
+
+    while len(pending_train) + len(pending_eval) + len(running) > 0:
+        while len(free_train_slots) > 0:
+            case_number = next_prepared_case()
+            if case_number is None: break
+            pending_train.remove(case_number)
+            slot = free_train_slots.pop(0)
+            start(case_number, 'train', slot, slot % len(gpus))
+        while len(pending_eval) > 0 and n_eval_running < args.eval_jobs:
+            start(pending_eval.pop(0), 'eval', None, least_busy_gpu())
+            n_eval_running += 1
+
+        time.sleep(1)
+
+        for proc in list(running.keys()):
+            returncode = proc.poll()
+            if returncode is None: continue
+            case_number, step, slot, _, log_file, start_time = running.pop(proc)
+            log_file.close()
+            elapsed = time.time() - start_time
+
+            status = read_case_status(status_path(case_number))
+            status['steps'][step].update({ 'returncode': returncode, 'elapsed_seconds': elapsed })
+            if returncode != 0:
+                status['state'] = 'failed'
+                n_failed += 1
+            elif step == 'train' and not args.no_eval:
+                status['state'] = 'trained'
+                pending_eval.append(case_number)
+            else:
+                status['state'] = 'done'
+            write_case_status(status_path(case_number), status)
+
+            print('case %d %s %s in %s' % (case_number, step,
+                'finished' if returncode == 0 else 'FAILED (see %s)' % status['steps'][step]['log'],
+                str(datetime.timedelta(seconds=round(elapsed)))))
+
+            if step == 'train': free_train_slots.append(slot)
+            else: n_eval_running -= 1
+
+    prepare_pool.join()
+    print('all cases processed, %d failed' % n_failed)
+    if n_failed > 0: sys.exit(1)
+
+def queue_name(args):
+    """Queue subfolder of a sweep: cases with different forwarded arguments are different work items"""
+    name = [args.dataset] + [f for f in SCHEDULER_FORWARDED_FLAGS if getattr(args, f)]
+    options = forwarded_options(args)
+    if len(options) > 0:
+        name.append('opts_' + cache_manifest.hash_json(options)[:8])
+    return '-'.join(name)
+
+def run_cases_from_queue(args, cases):
+    """
+    Work through the cases of the dataset as one of any number of workers
+    sharing a queue folder (e.g., on NFS), see work_queue.py. Each worker
+    claims the next free case, runs its steps (train.py in a subprocess)
+    and records the result in the queue. Cases of crashed workers are
+    re-run once their claims go stale. Returns when all cases are done or
+    failed.
+    """
+    queue_dir = os.path.join(args.queue, queue_name(args))
+    items = ['case-%03d' % (i + 1) for i in range(len(cases))]
+
+    if args.dry_run:
+        # no side effects on a queue other workers may be using: only read the item files
+        def state(item):
+            for kind, name in [('done', 'done'), ('failed', 'failed'), ('claim', 'claimed')]:
+                if os.path.exists(os.path.join(queue_dir, '%s.%s' % (item, kind))): return name
+            return 'pending'
+        print('queue %s' % queue_dir)
+        for item, c in zip(items, cases):
+            print('%s\t%s\t%s\t%s' % (item, state(item), case_variant_name(c, args), c[0]))
+        return
+
+    queue = work_queue.WorkQueue(queue_dir,
+        worker_id=args.worker_id,
+        stale_seconds=args.stale_seconds,
+        heartbeat_seconds=min(30, args.stale_seconds / 4))
+    queue.initialize([[item, c[0], case_variant_name(c, args)] for item, c in zip(items, cases)])
+
+    if args.retry_failed:
+        for item in items: queue.reset_failed(item)
+
+    log_dir = os.path.join(queue.queue_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    python_cmd = [sys.executable, os.path.abspath(__file__)]
+    steps = ['train'] + ([] if args.no_eval else ['eval'])
+    n_done = 0
+    n_failed = 0
+    print('worker %s, queue %s' % (queue.worker_id, queue.queue_dir))
+
+    try:
+        while True:
+            states = [queue.state(item) for item in items]
+            if all(s in ['done', 'failed'] for s in states): break
+
+            claimed = None
+            for i, item in enumerate(items):
+                if states[i] in ['pending', 'stale'] and queue.try_claim(item):
+                    claimed = i
+                    break
+
+            if claimed is None:
+                # the remaining cases are being worked on by others
+                time.sleep(args.poll_seconds)
+                continue
+
+            case_number = claimed + 1
+            item = items[claimed]
+            info = { 'steps': {} }
+            returncode = 0
+            for step in steps:
+                cmd = case_step_cmd(args, case_number, step, python_cmd)
+                print_cmd(cmd)
+                log_path = os.path.join(log_dir, '%s-%s-%s.log' % (item, step, queue.worker_id))
+                start_time = time.time()
+                with open(log_path, 'w') as log_file:
+                    returncode = subprocess.call(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+                info['steps'][step] = {
+                    'log': log_path,
+                    'returncode': returncode,
+                    'elapsed_seconds': time.time() - start_time
+                }
+                if returncode != 0: break
+
+            if returncode == 0:
+                queue.finish(item, 'done', info)
+                n_done += 1
+                print('case %d done' % case_number)
+            else:
+                queue.finish(item, 'failed', info)
+                n_failed += 1
+                print('case %d FAILED (see %s)' % (case_number, log_path))
+    finally:
+        queue.close()
+
+    print('queue drained, this worker ran %d cases, %d failed' % (n_done + n_failed, n_failed))
+
+PLAN_FORMATS = ['json', 'make', 'ninja']
+# written after a successful evaluation step by the exported Makefile / ninja file
+EVAL_STAMP_FILE = 'eval.stamp'
+
+def plan_cases(args, cases):
+    """The expanded case matrix with the commands, inputs and outputs of each case"""
+    plan = []
+    for i, (session, variant) in enumerate(cases):
+        case_number = i + 1
+        case_args = argparse.Namespace(**vars(args))
+        case_args.case_number = case_number
+        case_args.input_folder = session
+        for p in variant: setattr(case_args, p, True)
+
+        train_cmd, output_folder = build_train_cmd(session, case_args)
+        # the timestamp folder is created by ns-train
+        model_folder = os.path.join(output_folder, 'splatfacto', '{timestamp}')
+        eval_cmd, _, render_cmd = build_eval_cmds(
+            os.path.join(model_folder, 'config.yml'),
+            os.path.join(model_folder, 'metrics.json'),
+            args.render_images,
+            args.separate_eval)
+
+        steps = {
+            'train': {
+                'cmd': train_cmd,
+                'run': case_step_cmd(args, case_number, 'train'),
+                'output': os.path.join(output_folder, TRAINING_TIME_FILE)
+            }
+        }
+        if not args.no_eval:
+            steps['eval'] = {
+                'cmd': [eval_cmd] + ([render_cmd] if render_cmd is not None else []),
+                'run': case_step_cmd(args, case_number, 'eval'),
+                'output': os.path.join(model_folder, 'metrics.json')
+            }
+
+        plan.append({
+            'case_number': case_number,
+            'dataset': args.dataset,
+            'session': os.path.basename(session),
+            'variant': case_variant_name((session, variant), args),
+            'flags': sorted(variant),
+            'input_folder': session,
+            'output_folder': output_folder,
+            # produced by the preprocessing scripts (process_*_inputs.py)
+            'depends_on': [os.path.join(session, 'transforms.json')],
+            'steps': steps
+        })
+    return plan
+
+def make_path(path):
+    """A target or prerequisite name for a Makefile: make cannot express spaces or colons in them"""
+    if ' ' in path or ':' in path:
+        raise ValueError(f'Path not supported in a Makefile, use --export_plan ninja: {path}')
+    return path.replace('$', '$$')
+
+def plan_to_makefile(plan):
+    quote = lambda cmd: ' '.join(shlex.quote(c) for c in cmd).replace('$', '$$')
+    lines = ['# generated by train.py --export_plan make', '']
+    targets = []
+    train_targets = []
+    rules = []
+    for case in plan:
+        train_target = make_path(case['steps']['train']['output'])
+        train_targets.append(train_target)
+        rules.extend([
+            '%s: %s' % (train_target, ' '.join(make_path(p) for p in case['depends_on'])),
+            '\t' + quote(case['steps']['train']['run']),
+            ''
+        ])
+        if 'eval' in case['steps']:
+            eval_target = make_path(os.path.join(case['output_folder'], EVAL_STAMP_FILE))
+            targets.append(eval_target)
+            rules.extend([
+                '%s: %s' % (eval_target, train_target),
+                '\t%s && touch $@' % quote(case['steps']['eval']['run']),
+                ''
+            ])
+        else:
+            targets.append(train_target)
 
-    default_variants = full_variants
-    bad_nerf_variants = [
-        baseline,
-        { 'no_rolling_shutter', 'no_pose_opt' },
-        { 'no_rolling_shutter' }
+    lines.extend([
+        '.PHONY: all train',
+        'all: ' + ' '.join(targets),
+        'train: ' + ' '.join(train_targets),
+        ''
+    ])
+    return '\n'.join(lines + rules)
+
+def plan_to_ninja(plan):
+    quote = lambda cmd: ' '.join(shlex.quote(c) for c in cmd).replace('$', '$$')
+    escape_path = lambda p: p.replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
+    lines = [
+        '# generated by train.py --export_plan ninja',
+        '# trainings and evaluations share the GPU: raise the pool depth for several GPUs',
+        'pool gpu',
+        '  depth = 1',
+        '',
+        'rule train',
+        '  command = $cmd',
+        '  description = train case $case',
+        '  pool = gpu',
+        '',
+        'rule eval',
+        '  command = $cmd && touch $out',
+        '  description = evaluate case $case',
+        '  pool = gpu',
+        ''
     ]
+    defaults = []
+    for case in plan:
+        train_target = escape_path(case['steps']['train']['output'])
+        lines.extend([
+            'build %s: train %s' % (train_target, ' '.join(escape_path(p) for p in case['depends_on'])),
+            '  cmd = ' + quote(case['steps']['train']['run']),
+            '  case = %d' % case['case_number'],
+        ])
+        if 'eval' in case['steps']:
+            eval_target = escape_path(os.path.join(case['output_folder'], EVAL_STAMP_FILE))
+            defaults.append(eval_target)
+            lines.extend([
+                'build %s: eval %s' % (eval_target, train_target),
+                '  cmd = ' + quote(case['steps']['eval']['run']),
+                '  case = %d' % case['case_number'],
+            ])
+        else:
+            defaults.append(train_target)
+        lines.append('')
+    lines.append('default ' + ' '.join(defaults))
+    return '\n'.join(lines) + '\n'
+
+def export_plan(args, cases):
+    plan = plan_cases(args, cases)
+    if args.export_plan == 'json':
+        print(json.dumps(plan, indent=4))
+    elif args.export_plan == 'make':
+        print(plan_to_makefile(plan))
+    elif args.export_plan == 'ninja':
+        print(plan_to_ninja(plan), end='')
+    else:
+        raise ValueError(f'Unknown plan format: {args.export_plan}')
 
-    add_popt = lambda a: a + [o - {'no_pose_opt'} for o in a if 'no_pose_opt' in o]
-
-    variants_by_dataset = {
-        'synthetic-clear': [
-            baseline
-        ],
-        'synthetic-mb': add_popt([
-            baseline,
-            { 'no_pose_opt', 'no_rolling_shutter' }
-        ]),
-        'synthetic-rs': add_popt([
-            baseline,
-            { 'no_pose_opt', 'no_motion_blur' }
-        ]),
-        'synthetic-posenoise': add_popt([
-            baseline,
-            { 'no_rolling_shutter', 'no_motion_blur' }
-        ]),
-        'synthetic-mbrs': add_popt([
-            baseline,
-            { 'no_pose_opt' },
-            { 'no_pose_opt', 'no_motion_blur' },
-            { 'no_pose_opt', 'no_rolling_shutter' }
-        ]),
-        'synthetic-posenoise-2nd-pass': [
-            baseline
-        ],
-        'colmap-bad-nerf-synthetic-deblurring': bad_nerf_variants,
-        'colmap-bad-nerf-synthetic-novel-view': bad_nerf_variants,
-        'colmap-bad-nerf-synthetic-novel-view-manual-pc': add_popt(bad_nerf_variants),
-        'colmap-exblurf-synthetic-novel-view-manual-pc': bad_nerf_variants,
-        'hloc-exblurf-synthetic-novel-view-manual-pc': bad_nerf_variants,
-        'hloc-bad-nerf-synthetic-novel-view-manual-pc': bad_nerf_variants,
-        'hloc-bad-nerf-synthetic-novel-view-exact-intrinsics-manual-pc': bad_nerf_variants,
-        'hloc-bad-gaussians-synthetic-novel-view-manual-pc': bad_nerf_variants,
-        'colmap-bad-gaussians-synthetic-novel-view-manual-pc': bad_nerf_variants,
-        'colmap-mpr-deblurred-synthetic-all-manual-pc': bad_nerf_variants,
-        'colmap-mpr-deblurred-synthetic-novel-view-manual-pc': bad_nerf_variants + [{ 'no_rolling_shutter', 'no_motion_blur' }],
-    }
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
 
     parser.add_argument("input_folder", type=str, default=None, nargs='?')
     parser.add_argument("--preview", action='store_true', help='show Viser preview')
@@ -325,24 +899,55 @@ if __name__ == '__main__':
     parser.add_argument('--eval_only', action='store_true')
     parser.add_argument('--no_eval', action='store_true')
     parser.add_argument('--train_all', action='store_true')
-
-    parser.add_argument('--case_number', type=int, default=None)
+    parser.add_argument('--max_iterations', type=int, default=None, help='override the --draft / full iteration count')
+    parser.add_argument('--ns_train_args', type=str, default=None, help='extra splatfacto arguments for ns-train, e.g., --ns_train_args="--pipeline.model.blur-samples=5"')
+    parser.add_argument('--output_prefix', type=str, default=DEFAULT_OUTPUT_PREFIX)
+    parser.add_argument('--separate_eval', action='store_true',
+        help='evaluate with ns-eval and render with render_model.py in separate processes')
+    parser.add_argument('--skip_validation', action='store_true', help='do not check the dataset before training')
+    parser.add_argument('--no_cache', action='store_true',
+        help='always re-run training, evaluation and rendering, even if the outputs are up to date')
+
+    parser.add_argument('--case_number', type=str, default=None,
+        help='case to run, or "all" to run every case of the dataset locally (see --jobs)')
+    parser.add_argument('--jobs', type=int, default=1, help='concurrent trainings with --case_number all')
+    parser.add_argument('--eval_jobs', type=int, default=1, help='concurrent evaluations with --case_number all')
+    parser.add_argument('--export_plan', choices=PLAN_FORMATS, default=None,
+        help='print the expanded case matrix of the dataset as JSON, a Makefile or a ninja file, and exit')
+    parser.add_argument('--gpus', type=str, default=None,
+        help='comma-separated CUDA devices assigned round-robin to steps with --case_number all')
+    parser.add_argument('--queue', type=str, default=None,
+        help='shared queue folder: work through the cases of the dataset together with other workers using the same folder')
+    parser.add_argument('--worker_id', type=str, default=None, help='queue worker name, default: host-pid')
+    parser.add_argument('--stale_seconds', type=float, default=600,
+        help='claims of workers without a heartbeat for this long are re-run by others')
+    parser.add_argument('--poll_seconds', type=float, default=30)
+    parser.add_argument('--retry_failed', action='store_true', help='re-run cases that failed in the queue')
     args = parser.parse_args()
 
     if args.input_folder is None and args.case_number is None:
-        args.case_number = -1
+        args.case_number = '-1'
 
     if args.case_number is not None:
-        INPUT_ROOT = 'data/inputs-processed/' + args.dataset
-        sessions = [os.path.join(INPUT_ROOT, f) for f in sorted(os.listdir(INPUT_ROOT))]
-        variants = add_velocity_opt_variants(variants_by_dataset.get(args.dataset, default_variants), args.dataset)
-        cases = [(s, v) for v in variants for s in sessions]
+        cases = get_cases(args.dataset)
+
+        if args.export_plan is not None:
+            export_plan(args, cases)
+            sys.exit(0)
+
+        if args.queue is not None:
+            run_cases_from_queue(args, cases)
+            sys.exit(0)
+
+        if args.case_number == 'all':
+            run_cases_locally(args, cases)
+            sys.exit(0)
 
+        args.case_number = int(args.case_number)
         if args.case_number <= 0:
             print('valid cases')
-            for i, (c, v) in enumerate(cases):
-                variant = flags_to_variant_name_and_cmd({k: True for k in v})[0]
-                print(str(i+1) + ':\t' + variant + '\t' + c)
+            for i, c in enumerate(cases):
+                print(str(i+1) + ':\t' + case_variant_name(c, args) + '\t' + c[0])
             sys.exit(0)
         else:
             args.input_folder, variant = cases[args.case_number - 1]
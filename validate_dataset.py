@@ -0,0 +1,207 @@
+"""Fast pre-flight checks of a processed dataset, before training"""
+import os
+import json
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+DEFAULT_VALIDATION_CACHE_DIR = 'data/cache/validation'
+# part of the cache key: increase when the checks change
+VALIDATOR_VERSION = 2
+INTRINSIC_FIELDS = ['fl_x', 'fl_y', 'cx', 'cy', 'w', 'h']
+VELOCITY_FIELDS = ['camera_linear_velocity', 'camera_angular_velocity']
+
+def read_image_size(path):
+    """(width, height) from the image header, without decoding the pixels"""
+    from PIL import Image
+    try:
+        with Image.open(path) as im:
+            return im.size
+    except (OSError, SyntaxError):
+        return None
+
+def cache_key(input_folder):
+    """
+    Hash of the validator version, transforms.json, the point cloud and the
+    name, size and modification time of every other file in the dataset folder
+    """
+    h = hashlib.sha1(('validator %d\n' % VALIDATOR_VERSION).encode('utf-8'))
+    for root, dirs, files in os.walk(input_folder):
+        dirs.sort()
+        for fn in sorted(files):
+            path = os.path.join(root, fn)
+            st = os.stat(path)
+            h.update(('%s %d %d\n' % (os.path.relpath(path, input_folder), st.st_size, st.st_mtime_ns)).encode('utf-8'))
+            if fn == 'transforms.json' or fn.endswith('.ply'):
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+    return h.hexdigest()
+
+def has_field(transforms, key):
+    """Fields such as exposure_time can be given for all frames or per frame"""
+    return key in transforms or all(key in f for f in transforms['frames'])
+
+def inspect_dataset(input_folder, num_workers=16):
+    """
+    Check a dataset independently of the training variant.
+
+    Returns:
+        dict with 'errors', 'warnings' and 'fields' (field name -> present)
+    """
+    errors = []
+    warnings = []
+    report = { 'errors': errors, 'warnings': warnings, 'fields': {} }
+
+    transforms_path = os.path.join(input_folder, 'transforms.json')
+    if not os.path.exists(transforms_path):
+        errors.append('missing %s' % transforms_path)
+        return report
+    try:
+        with open(transforms_path) as f:
+            transforms = json.load(f)
+    except ValueError as e:
+        errors.append('invalid JSON in %s: %s' % (transforms_path, str(e)))
+        return report
+
+    frames = transforms.get('frames', [])
+    if len(frames) == 0:
+        errors.append('no frames in transforms.json')
+        return report
+    report['n_frames'] = len(frames)
+
+    for key in INTRINSIC_FIELDS:
+        if not has_field(transforms, key):
+            errors.append('missing intrinsic parameter %s' % key)
+    for key in ['exposure_time', 'rolling_shutter_time'] + VELOCITY_FIELDS:
+        report['fields'][key] = has_field(transforms, key)
+
+    image_paths = []
+    for i, frame in enumerate(frames):
+        if 'file_path' not in frame:
+            errors.append('frame %d: missing file_path' % i)
+            continue
+        m = np.array(frame.get('transform_matrix', []), dtype=np.float64)
+        if m.shape not in [(4, 4), (3, 4)]:
+            errors.append('frame %d (%s): transform_matrix has shape %s' % (i, frame['file_path'], str(m.shape)))
+        elif not np.all(np.isfinite(m)):
+            errors.append('frame %d (%s): non-finite transform_matrix' % (i, frame['file_path']))
+        elif not np.allclose(m[:3, :3].T @ m[:3, :3], np.eye(3), atol=1e-2) or np.linalg.det(m[:3, :3]) <= 0:
+            errors.append('frame %d (%s): transform_matrix rotation is not a proper rotation (orthonormal, det > 0)' % (i, frame['file_path']))
+
+        for key in VELOCITY_FIELDS:
+            if key in frame and not np.all(np.isfinite(np.array(frame[key], dtype=np.float64))):
+                errors.append('frame %d (%s): non-finite %s' % (i, frame['file_path'], key))
+
+        image_paths.append((i, frame['file_path']))
+        if 'mask_path' in frame and not os.path.exists(os.path.join(input_folder, frame['mask_path'])):
+            errors.append('frame %d: missing mask %s' % (i, frame['mask_path']))
+
+    def check_image(item):
+        i, file_path = item
+        path = os.path.join(input_folder, file_path)
+        if not os.path.exists(path): return i, file_path, 'missing'
+        return i, file_path, read_image_size(path)
+
+    with ThreadPool(num_workers) as pool:
+        image_sizes = pool.map(check_image, image_paths)
+
+    sizes = set()
+    for i, file_path, size in image_sizes:
+        if size == 'missing':
+            errors.append('frame %d: missing image %s' % (i, file_path))
+        elif size is None:
+            errors.append('frame %d: unreadable image %s' % (i, file_path))
+        else:
+            frame = frames[i]
+            expected = (frame.get('w', transforms.get('w')), frame.get('h', transforms.get('h')))
+            if None not in expected and tuple(size) != tuple(int(v) for v in expected):
+                errors.append('frame %d: image %s is %dx%d, expected %dx%d' % ((i, file_path) + tuple(size) + tuple(expected)))
+            sizes.add(tuple(size))
+    if len(sizes) > 1:
+        warnings.append('images have %d different sizes' % len(sizes))
+
+    if 'ply_file_path' in transforms:
+        if not os.path.exists(os.path.join(input_folder, transforms['ply_file_path'])):
+            errors.append('missing point cloud %s' % transforms['ply_file_path'])
+    else:
+        warnings.append('no ply_file_path: Gaussians will be initialized randomly')
+
+    return report
+
+def required_fields(args):
+    """
+    transforms.json fields used by a training variant (train.py flags as a dict)
+
+    Returns:
+        list of (field, reason, required). Fields that are not required
+        have defaults in the dataparser
+    """
+    fields = []
+    if not args.get('no_motion_blur', False):
+        fields.append(('exposure_time', 'motion blur compensation', False))
+    if not args.get('no_rolling_shutter', False):
+        fields.append(('rolling_shutter_time', 'rolling shutter compensation', False))
+    uses_velocities = not args.get('no_motion_blur', False) or not args.get('no_rolling_shutter', False)
+    if uses_velocities and not args.get('velocity_opt_zero_init', False):
+        for key in VELOCITY_FIELDS:
+            fields.append((key, 'motion blur / rolling shutter compensation without --velocity_opt_zero_init', True))
+    return fields
+
+def load_report(input_folder, cache_dir=DEFAULT_VALIDATION_CACHE_DIR):
+    """inspect_dataset, cached by the dataset hash (cache_key)"""
+    if cache_dir is None: return inspect_dataset(input_folder)
+
+    cache_path = os.path.join(cache_dir, cache_key(input_folder) + '.json')
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            return json.load(f)
+
+    report = inspect_dataset(input_folder)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + '.tmp-%d' % os.getpid()
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    os.replace(tmp_path, cache_path)
+    return report
+
+def validate(input_folder, args, cache_dir=DEFAULT_VALIDATION_CACHE_DIR):
+    """
+    Check that a dataset can be trained with the given train.py flags
+
+    Returns:
+        (errors, warnings) lists of messages
+    """
+    report = load_report(input_folder, cache_dir)
+    errors = list(report['errors'])
+    warnings = list(report['warnings'])
+    for key, reason, required in required_fields(args):
+        # fields are not known if transforms.json could not be read
+        if report['fields'].get(key, True) is False:
+            if required:
+                errors.append('missing %s, needed for %s' % (key, reason))
+            else:
+                warnings.append('missing %s, using the default value for %s' % (key, reason))
+    return errors, warnings
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('input_folders', nargs='+')
+    parser.add_argument('--no_motion_blur', action='store_true')
+    parser.add_argument('--no_rolling_shutter', action='store_true')
+    parser.add_argument('--velocity_opt_zero_init', action='store_true')
+    parser.add_argument('--cache_dir', type=str, default=DEFAULT_VALIDATION_CACHE_DIR)
+    parser.add_argument('--no_cache', action='store_true')
+    args = parser.parse_args()
+
+    n_invalid = 0
+    for input_folder in args.input_folders:
+        errors, warnings = validate(input_folder, vars(args), None if args.no_cache else args.cache_dir)
+        print('%s: %s' % (input_folder, 'OK' if len(errors) == 0 else '%d errors' % len(errors)))
+        for e in errors: print('  ERROR: ' + e)
+        for w in warnings: print('  WARNING: ' + w)
+        if len(errors) > 0: n_invalid += 1
+
+    if n_invalid > 0:
+        raise SystemExit(1)
@@ -0,0 +1,171 @@
+"""
+Work queue on a shared filesystem (e.g., NFS), without a central service.
+
+Items are claimed with hard links, which are atomic also on NFS: a claim is
+first written to a unique temporary file and then linked to the claim path,
+which fails if someone else already holds it. A worker refreshes the
+modification time of its claims while it works (heartbeat). A claim whose
+heartbeat is older than stale_seconds is considered abandoned and may be
+broken by another worker, which then re-runs the item. Timestamps are
+compared in file server time, so the clocks of the nodes need not agree.
+"""
+import os
+import json
+import socket
+import threading
+import time
+import uuid
+
+class WorkQueue:
+    def __init__(self, queue_dir, worker_id=None, stale_seconds=600, heartbeat_seconds=30):
+        self.queue_dir = queue_dir
+        self.worker_id = worker_id if worker_id is not None else '%s-%d' % (socket.gethostname(), os.getpid())
+        self.stale_seconds = stale_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.claims = {} # item -> claim token
+        self.lock = threading.Lock()
+        self.heartbeat_thread = None
+        self.stop_event = threading.Event()
+        os.makedirs(queue_dir, exist_ok=True)
+
+    def path(self, item, kind):
+        return os.path.join(self.queue_dir, '%s.%s' % (item, kind))
+
+    def create_exclusive(self, path, content):
+        """Atomically create a file with the given JSON content. Returns False if it exists"""
+        tmp_path = os.path.join(self.queue_dir, '.tmp-%s-%s' % (self.worker_id, uuid.uuid4().hex))
+        with open(tmp_path, 'w') as f:
+            json.dump(content, f)
+        try:
+            os.link(tmp_path, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.unlink(tmp_path)
+
+    def read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def server_time(self):
+        """Current time of the file server, from the mtime of a freshly touched file"""
+        probe = os.path.join(self.queue_dir, '.clock-%s' % self.worker_id)
+        with open(probe, 'a'):
+            pass
+        os.utime(probe, None)
+        return os.stat(probe).st_mtime
+
+    def heartbeat_age(self, path):
+        try:
+            return self.server_time() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def initialize(self, items):
+        """Record the item list, or check that it matches the one already in the queue"""
+        path = os.path.join(self.queue_dir, 'items.json')
+        if not self.create_exclusive(path, items) and self.read(path) != items:
+            raise RuntimeError('%s contains a different item list. Are all workers using the same inputs?' % path)
+
+    def state(self, item):
+        for kind in ['done', 'failed']:
+            if os.path.exists(self.path(item, kind)): return kind
+        age = self.heartbeat_age(self.path(item, 'claim'))
+        if age is None: return 'pending'
+        if age > self.stale_seconds: return 'stale'
+        return 'claimed'
+
+    def reset_failed(self, item):
+        try:
+            os.unlink(self.path(item, 'failed'))
+        except FileNotFoundError:
+            pass
+
+    def break_stale_claim(self, item):
+        """Remove a stale claim, guarded by a short-lived break lock so that only one worker does it"""
+        break_path = self.path(item, 'break')
+        if not self.create_exclusive(break_path, { 'worker': self.worker_id }):
+            age = self.heartbeat_age(break_path)
+            # a worker crashed while breaking the claim (which takes milliseconds)
+            if age is not None and age > self.stale_seconds:
+                try:
+                    os.unlink(break_path)
+                except FileNotFoundError:
+                    pass
+            return False
+        try:
+            # re-check: the claim may have been broken and re-claimed meanwhile
+            if self.state(item) != 'stale': return False
+            previous = self.read(self.path(item, 'claim'))
+            print('breaking stale claim of %s by %s' % (item, previous['worker'] if previous else '?'))
+            os.unlink(self.path(item, 'claim'))
+            return True
+        finally:
+            os.unlink(break_path)
+
+    def try_claim(self, item):
+        state = self.state(item)
+        if state == 'stale':
+            self.break_stale_claim(item)
+        elif state != 'pending':
+            return False
+
+        token = uuid.uuid4().hex
+        if not self.create_exclusive(self.path(item, 'claim'), {
+                'worker': self.worker_id,
+                'token': token,
+                'claimed': time.time()
+            }):
+            return False
+        with self.lock:
+            self.claims[item] = token
+        self.start_heartbeat()
+        return True
+
+    def holds_claim(self, item):
+        claim = self.read(self.path(item, 'claim'))
+        return claim is not None and claim['token'] == self.claims.get(item)
+
+    def heartbeat(self):
+        with self.lock:
+            items = list(self.claims.keys())
+        for item in items:
+            if self.holds_claim(item):
+                os.utime(self.path(item, 'claim'), None)
+            else:
+                print('WARNING: lost the claim of %s (considered stale by another worker)' % item)
+
+    def start_heartbeat(self):
+        if self.heartbeat_thread is not None: return
+
+        def run():
+            while not self.stop_event.wait(self.heartbeat_seconds):
+                self.heartbeat()
+
+        self.heartbeat_thread = threading.Thread(target=run, daemon=True)
+        self.heartbeat_thread.start()
+
+    def finish(self, item, kind, info):
+        """Mark a claimed item 'done' or 'failed' and release the claim"""
+        info = dict(info, worker=self.worker_id, finished=time.time())
+        path = self.path(item, kind)
+        tmp_path = path + '.tmp-' + self.worker_id
+        with open(tmp_path, 'w') as f:
+            json.dump(info, f, indent=4)
+        os.replace(tmp_path, path)
+        self.release(item)
+
+    def release(self, item):
+        if self.holds_claim(item):
+            os.unlink(self.path(item, 'claim'))
+        with self.lock:
+            self.claims.pop(item, None)
+
+    def close(self):
+        self.stop_event.set()
+        for item in list(self.claims.keys()):
+            self.release(item)